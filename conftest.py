@@ -0,0 +1,2 @@
+# makes the functions package importable when the tests are run with pytest
+# from the repository root
@@ -0,0 +1,128 @@
+import json
+import os
+import platform
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+import numpy as np
+from functions.instrument_assist import stage
+
+
+@contextmanager
+def profile_stage(results, name, trace_memory=True, **info):
+    """
+    Record a pipeline stage with stage, and optionally its peak traced 
+    memory.
+
+    Parameters:
+    - results: list the stage record is appended to
+    - name: name of the stage
+    - trace_memory: if True, record the peak memory allocated within the
+    stage with tracemalloc (slows down allocation-heavy stages)
+    - info: additional fields stored in the record, e.g. the nr of respondents
+
+    Yields:
+    - dict of the stage record as recorded by stage, rows can be added by 
+    the caller as 'rows'
+    """
+    with stage(name, report={"stages": results}, **info) as record:
+        if trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        try:
+            yield record
+        finally:
+            if trace_memory:
+                record["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+                tracemalloc.stop()
+
+
+def environment_info():
+    """
+    Collect the versions and machine details a benchmark result depends on.
+
+    Returns:
+    - dictionary with python, numpy and pandas versions, platform, cpu
+    count and the current git commit
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+    }
+
+
+def save_benchmark(results, name, output_dir='output/benchmarks', **meta):
+    """
+    Save benchmark records as json together with the environment info.
+
+    Parameters:
+    - results: list of stage records
+    - name: name of the benchmark suite, used as file prefix
+    - output_dir: directory the json file is written to
+    - meta: additional fields stored at the top level, e.g. settings
+
+    Returns:
+    - path of the written json file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = f'{output_dir}/{name}-{timestamp}.json'
+    with open(path, 'w') as f:
+        json.dump({"name": name,
+                   "timestamp": timestamp,
+                   "environment": environment_info(),
+                   **meta,
+                   "results": results}, f, indent=2, default=str)
+    print(f'Benchmark results saved to file {path}')
+    return path
+
+
+def load_benchmark(path):
+    """
+    Load the records of a saved benchmark as a DataFrame.
+
+    Parameters:
+    - path: path of a json file written by save_benchmark
+
+    Returns:
+    - DataFrame with one row per stage record
+    """
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)["results"])
+
+
+def compare_benchmarks(current, baseline,
+                       keys=['stage', 'n_respondents'],
+                       metrics=['wall_s', 'peak_traced_mb'],
+                       tolerance=1.2):
+    """
+    Compare two benchmark runs and flag regressions.
+
+    Parameters:
+    - current, baseline: paths of json files written by save_benchmark
+    - keys: columns identifying the same stage in both runs
+    - metrics: columns to compare
+    - tolerance: ratio current / baseline above which a metric is flagged
+
+    Returns:
+    - DataFrame with the metrics of both runs, their ratios and a
+    'regression' column
+    """
+    df = pd.merge(load_benchmark(current), load_benchmark(baseline),
+                  on=keys, suffixes=('', '_baseline'))
+    df = df[keys + [col for m in metrics for col in (m, f'{m}_baseline')]].copy()
+    for m in metrics:
+        df[f'{m}_ratio'] = (df[m] / df[f'{m}_baseline']).round(3)
+    df['regression'] = (df[[f'{m}_ratio' for m in metrics]] > tolerance).any(axis=1)
+    return df
@@ -0,0 +1,242 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+
+# persistent PyTensor compilation directory, shared by all scripts and workers
+compile_cache_dir = "output/pytensor_cache"
+
+# PyTensor flags of all scripts, the compiled modules in the cache depend on
+# them; clang++ as pymc bug workaround where it is installed
+pytensor_flags = {"cxx": "/usr/bin/clang++"} if os.path.exists("/usr/bin/clang++") else {}
+
+
+def use_compile_cache(path=compile_cache_dir, **flags):
+    """
+    Point PyTensor at a persistent compilation directory.
+
+    PyTensor reads its flags when it is imported, so call this before
+    importing pytensor or pymc. The flags are set in the environment, so
+    processes started later, e.g. sampling chains and pipeline workers,
+    share the same compiled modules.
+
+    Parameters:
+    - path: compilation directory, created if needed
+    - flags: further PyTensor flags, usually pytensor_flags
+    """
+    os.makedirs(path, exist_ok=True)
+    flags = {"base_compiledir": os.path.abspath(path), **flags}
+    existing = [flag for flag in os.environ.get("PYTENSOR_FLAGS", "").split(",")
+                if flag and flag.split("=")[0] not in flags]
+    os.environ["PYTENSOR_FLAGS"] = ",".join(existing + [f"{key}={value}" for key, value in flags.items()])
+
+    if "pytensor" in sys.modules:
+        import pytensor
+        if os.path.abspath(pytensor.config.base_compiledir) != flags["base_compiledir"]:
+            print("PyTensor was imported before use_compile_cache, the cache only "
+                  "applies to processes started from now on")
+
+
+def precompile(model):
+    """
+    Compile the log-probability and gradient function NUTS uses, so the
+    compiled modules are in the cache before sampling.
+
+    Returns:
+    - seconds spent compiling
+    """
+    start = time.perf_counter()
+    model.logp_dlogp_function()
+    return time.perf_counter() - start
+
+
+def time_startup(experiment, variant="hierarchical", n_respondents=100, weighted=False):
+    """
+    Time building and compiling the model for a simulated design of an
+    experiment, in the current process.
+
+    The compiled C modules depend on the graph and data types, not on the
+    number of tasks, so a small simulated design warms the cache for the
+    full data.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - variant: model variant passed on to build_model
+    - n_respondents: number of simulated respondents
+    - weighted: build the weighted likelihood model
+
+    Returns:
+    - dictionary with the design and the 'import_s', 'build_s' and
+    'compile_s' timings
+    """
+    # pymc is imported here, so use_compile_cache can run first
+    start = time.perf_counter()
+    from functions.model_assist import experiments, encode_dummies, build_model
+    from functions.recovery_assist import true_parameters, simulate_choices
+    import_s = time.perf_counter() - start
+
+    df = simulate_choices(experiment, n_respondents, true_parameters(experiment))
+    if weighted:
+        df["weight"] = 1.0
+    df, dummies, encoder = encode_dummies(df,
+                                          experiments[experiment]["attributes"],
+                                          experiments[experiment]["baselines"])
+    start = time.perf_counter()
+    model = build_model(df, dummies, variant=variant, weighted=weighted)
+    build_s = time.perf_counter() - start
+
+    return {"experiment": experiment,
+            "variant": variant,
+            "weighted": weighted,
+            "levels": dummies.shape[1],
+            "import_s": round(import_s, 3),
+            "build_s": round(build_s, 3),
+            "compile_s": round(precompile(model), 3)}
+
+
+def time_logp(model, min_time_s=1.0):
+    """
+    Time one evaluation of the log-probability and its gradient, as NUTS
+    calls it at every leapfrog step.
+
+    Evaluations are repeated at the initial point until min_time_s has
+    passed, the memory allocated within one evaluation is traced separately.
+
+    Parameters:
+    - model: pymc Model
+    - min_time_s: least wall time spent evaluating
+
+    Returns:
+    - dictionary with the number of 'parameters', 'compile_s', 'evals', 
+    'evals_per_s', 'us_per_eval' and 'peak_alloc_kb', the peak memory 
+    allocated during one evaluation
+    """
+    start = time.perf_counter()
+    function = model.logp_dlogp_function(ravel_inputs=True)
+    function.set_extra_values({})
+    compile_s = time.perf_counter() - start
+
+    point = model.initial_point()
+    x = np.concatenate([np.ravel(point[var.name]) for var in function._grad_vars])
+    function(x) # warm up
+
+    evals = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time_s:
+        for _ in range(10):
+            function(x)
+        evals += 10
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    function(x)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"parameters": len(x),
+            "compile_s": round(compile_s, 3),
+            "evals": evals,
+            "evals_per_s": round(evals / elapsed, 1),
+            "us_per_eval": round(elapsed / evals * 1e6, 2),
+            "peak_alloc_kb": round(peak / 1e3, 1)}
+
+
+def time_logp_design(experiment, n_respondents, formulation="dense", variant="hierarchical", 
+                     min_time_s=1.0, seed=42):
+    """
+    Time the log-probability and gradient of the model of a simulated design.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - n_respondents: number of simulated respondents
+    - formulation: one of model_formulations, or 'float32' for the 'dense'
+    formulation built in float32
+    - variant: model variant passed on to build_model
+    - min_time_s: passed on to time_logp
+    - seed: seed of the simulated choices
+
+    Returns:
+    - dictionary with the design, the number of 'tasks' and the timings of
+    time_logp
+    """
+    # pymc is imported here, so use_compile_cache can run first
+    from functions.model_assist import experiments, encode_dummies, build_model, float_mode
+    from functions.recovery_assist import true_parameters, simulate_choices
+
+    df = simulate_choices(experiment, n_respondents, true_parameters(experiment), seed=seed)
+    df, dummies, encoder = encode_dummies(df,
+                                          experiments[experiment]["attributes"],
+                                          experiments[experiment]["baselines"])
+    dtype = "float32" if formulation == "float32" else "float64"
+    with float_mode(dtype):
+        model = build_model(df, dummies, variant=variant, 
+                            formulation="dense" if formulation == "float32" else formulation)
+        timings = time_logp(model, min_time_s)
+
+    return {"experiment": experiment,
+            "n_respondents": n_respondents,
+            "tasks": int((df.pack_num_cat == "Left").sum()),
+            "formulation": formulation,
+            "variant": variant,
+            **timings}
+
+
+def precompile_designs(experiments=["pv", "heat"],
+                       variants=["hierarchical", "centered", "pooled"],
+                       weighted=[False]):
+    """
+    Warm the compilation cache for every experiment and model variant.
+
+    Returns:
+    - list of the records of time_startup
+    """
+    return [time_startup(experiment, variant, weighted=weight)
+            for experiment in experiments
+            for variant in variants
+            for weight in weighted]
+
+
+def startup_report(experiment, variant="hierarchical", path=compile_cache_dir, **flags):
+    """
+    Compare model startup with an empty and with the persistent cache.
+
+    Each startup runs in a fresh Python process: 'cold' with a new empty
+    compilation directory, 'warm' with the persistent one, which is first
+    warmed if needed.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - variant: model variant passed on to build_model
+    - path: persistent compilation directory
+    - flags: further PyTensor flags, passed on to use_compile_cache, the 
+    same as the fitting scripts use, usually pytensor_flags
+
+    Returns:
+    - list of two records of time_startup, with 'cache' 'cold' or 'warm'
+    and the 'total_s' wall time of the process
+    """
+    code = ("import json, sys; "
+            "from functions.compile_assist import use_compile_cache, time_startup; "
+            "use_compile_cache(sys.argv[1], **json.loads(sys.argv[2])); "
+            "print(json.dumps(time_startup(sys.argv[3], sys.argv[4])))")
+
+    def run(cache_path):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code, cache_path, json.dumps(flags),
+                                 experiment, variant],
+                                capture_output=True, text=True, check=True).stdout
+        record = json.loads(output.strip().splitlines()[-1])
+        record["total_s"] = round(time.perf_counter() - start, 3)
+        return record
+
+    with tempfile.TemporaryDirectory() as empty:
+        cold = {"cache": "cold", **run(empty)}
+    run(path) # make sure the persistent cache holds this design
+    warm = {"cache": "warm", **run(path)}
+    return [cold, warm]
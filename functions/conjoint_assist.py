@@ -1,12 +1,93 @@
+import csv
+import os
+import re
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 from scipy.stats import norm
+from functions.design_assist import fit_encoder, encode_design
+from functions.instrument_assist import instrumented
+from functions.survey_assist import (likert_dict, pv_column_names, 
+                                     translation_dict_heat, translate_dict_pv)
 
+# respondent columns joined to the stacked choices by default, as the model
+# and the AMCE need them
+model_respondent_columns = ['ID', 'canton', 'weight']
+
+
+def respondent_table(respondents):
+    '''
+    Build the respondent dimension table of the star layout.
+
+    Parameters:
+    - respondents: DataFrame with one row per respondent and an 'ID' column
+
+    Returns:
+    - DataFrame sorted by ID with an integer 'respondent' key first, equal 
+    to the row position, so stacked tables can gather by key
+    '''
+    respondents = respondents.drop_duplicates('ID').sort_values('ID', ignore_index=True)
+    respondents.insert(0, 'respondent', np.arange(len(respondents), dtype=np.int32))
+    return respondents
+
+
+def join_respondents(df, respondents, columns=None):
+    '''
+    Add respondent columns to a stacked table of the star layout.
+
+    The columns are gathered by the integer 'respondent' key, the row 
+    position in the dimension table, rather than merged.
+
+    Parameters:
+    - df: stacked DataFrame with a 'respondent' key
+    - respondents: dimension table as returned by respondent_table
+    - columns: respondent columns to add, all if None; columns df already 
+    has are kept
+
+    Returns:
+    - copy of df with the respondent columns added
+    '''
+    if columns is None:
+        columns = [col for col in respondents.columns if col != 'respondent']
+    if not np.array_equal(respondents['respondent'].values, np.arange(len(respondents))):
+        raise ValueError('The respondent keys are not the row positions, rebuild the table with respondent_table.')
+    key = df['respondent'].to_numpy()
+    df = df.copy()
+    for col in columns:
+        if col not in df:
+            df[col] = respondents[col].to_numpy()[key]
+    return df
+
+
+def read_conjoint(path, respondents_path=None, columns=model_respondent_columns):
+    '''
+    Read a stacked conjoint table and join the respondent columns needed.
+
+    Parameters:
+    - path: csv file written by prep_conjoint
+    - respondents_path: csv file of the respondent dimension table, by 
+    default respondents.csv next to path; only read for the star layout
+    - columns: respondent columns to join, all if None
+
+    Returns:
+    - stacked DataFrame, in the wide layout as stored
+    '''
+    df = pd.read_csv(path)
+    if 'respondent' not in df:
+        return df
+    if respondents_path is None:
+        respondents_path = os.path.join(os.path.dirname(path), 'respondents.csv')
+    return join_respondents(df, pd.read_csv(respondents_path), columns)
+
+
+@instrumented(key='filemarker')
 def prep_conjoint(df, 
                   respondent_columns=['responseId', 'gender', 'age'], 
                   regex_list='pv|mix|imports|tradeoffs|distribution', 
                   filemarker='stack-choice', 
-                  calculate_ratings=True):
+                  calculate_ratings=True, 
+                  output_dir='data', 
+                  layout='wide'):
 
     '''
     Change the conjoint data from wide to long format. 
@@ -18,6 +99,11 @@ def prep_conjoint(df,
     - respondent_columns: by default three basic columns as chosen, 
     otherwise provide a vector of strings, containing the desired 
     column names 
+    - output_dir: directory the stacked csv file is written to
+    - layout: 'wide' to merge the respondent columns onto every row, or 
+    'star' to store only the integer 'respondent' key instead of the ID, 
+    with respondent_columns the dimension table as returned by 
+    respondent_table; join them with read_conjoint or join_respondents
     '''
 
     # select data columns per experiment
@@ -68,8 +154,13 @@ def prep_conjoint(df,
     stack_choice = pd.merge(df_task_merged, df_choice, on=['ID', 'task_num'], how='left')
     stack_choice['Y'] = (stack_choice['pack_num'] == stack_choice['choice']).astype(int) # Create the 'Y' column where 1 indicates that the package was chosen, 0 otherwise
     
-    # merge with respondents data 
-    stack_choice = pd.merge(stack_choice, respondent_columns, on='ID', how='left')
+    if layout == 'star':
+        # integer respondent key instead of the respondent data
+        key = pd.Series(respondent_columns['respondent'].values, index=respondent_columns['ID'])
+        stack_choice.insert(0, 'respondent', stack_choice['ID'].map(key).astype(np.int32))
+    else:
+        # merge with respondents data 
+        stack_choice = pd.merge(stack_choice, respondent_columns, on='ID', how='left')
 
     # aggregate table1 and table2 columns
     table2_cols = [col for col in stack_choice.columns if col.endswith('_table2')]
@@ -97,16 +188,10 @@ def prep_conjoint(df,
         df_rating = df_rating_melted.drop(columns=['variable'])
         
         # merge rating data
-        stack_rating = pd.merge(df_task_merged, df_rating, on=['ID', 'task_num', 'pack_num'], how='left')
-        stack_rating = pd.merge(stack_rating, respondent_columns, on='ID', how='left')
-
-        # aggregate table1 and table2 columns
-        table2_cols = [col for col in stack_rating.columns if col.endswith('_table2')]
-        table1_cols = [col.replace('_table2', '_table1') for col in table2_cols]
-        for table1, table2 in zip(table1_cols, table2_cols): # move non-NaN values from '_table2' columns to '_table1' columns
-            stack_rating[table1] = stack_rating[table1].combine_first(stack_rating[table2])
-        stack_rating.rename(columns=lambda x: x.replace('_table1', ''), inplace=True) # remove the '_table1' suffix from the column names
-        stack_rating.drop(columns=table2_cols, inplace=True) # drop the '_table2' columns
+        # only the rating is added to the choices, so neither the attributes
+        # nor the respondent data are merged again
+        stack_rating = pd.merge(df_task_merged[['ID', 'task_num', 'pack_num']], df_rating, 
+                                on=['ID', 'task_num', 'pack_num'], how='left')
 
         # stack choice and rating files together
         stack_both = pd.merge(stack_choice, 
@@ -117,23 +202,300 @@ def prep_conjoint(df,
         # for pv experiment, there is still missing data, so drop all rows where choice is NaN
         stack_both = stack_both.dropna(subset=['choice'])
 
+        if layout == 'star':
+            stack_both = stack_both.drop(columns='ID')
+
         # save to file
-        stack_both.to_csv(f'data/{filemarker}-conjoint.csv', index=False)
-        print(f'Stacked choice and rating data saved to file data/{filemarker}-conjoint.csv')
+        stack_both.to_csv(f'{output_dir}/{filemarker}-conjoint.csv', index=False)
+        print(f'Stacked choice and rating data saved to file {output_dir}/{filemarker}-conjoint.csv')
         return stack_both
 
     else: 
         stack_choice = stack_choice.dropna(subset=['choice'])
-        stack_choice.to_csv(f'data/{filemarker}-choices.csv', index=False)
-        print(f'Stacked choice data saved to file data/{filemarker}-choices.csv')
+        if layout == 'star':
+            stack_choice = stack_choice.drop(columns='ID')
+        stack_choice.to_csv(f'{output_dir}/{filemarker}-choices.csv', index=False)
+        print(f'Stacked choice data saved to file {output_dir}/{filemarker}-choices.csv')
         return stack_choice
     
 
+def quote(column):
+    '''
+    Quote a column name for SQL.
+    '''
+    return '"' + column.replace('"', '""') + '"'
+
+
+def literal(value):
+    '''
+    Quote a string value for SQL.
+    '''
+    return "'" + value.replace("'", "''") + "'"
+
+
+@instrumented(key='filemarker')
+def prep_conjoint_lazy(export_path, 
+                       respondents_path, 
+                       regex_list='pv|mix|imports|tradeoffs|distribution', 
+                       filemarker='stack-choice', 
+                       calculate_ratings=True, 
+                       output_dir='data', 
+                       layout='star', 
+                       memory_limit='2GB', 
+                       temp_directory=None, 
+                       threads=None):
+    '''
+    Change the conjoint data from wide to long format out of core, straight
+    from the Qualtrics export, with the same output as prep_conjoint after 
+    the cleaning steps of survey_assist.
+
+    The cleaning of the conjoint columns, the reshape and the respondent 
+    join run in DuckDB over the export, which is read once into a long 
+    staging table in a database file in temp_directory, the output is 
+    streamed to the csv file: the question text and import id rows are skipped, the IDs 
+    are the row numbers as in clean_export, the pv columns are renamed as 
+    in drop_flagged, the levels are translated as in translate_conjoints 
+    and the ratings recoded as in recode_demographics. Only respondents in 
+    the respondent table are kept, so previews, incompletes, quota fulls 
+    and flagged respondents are dropped as in the pandas steps. Memory 
+    stays within memory_limit, and sorts and joins that need more spill to
+    temp_directory, so exports larger than RAM can be stacked. Numbers are
+    written as in the export, e.g. years as 2030 where pandas writes 2030.0.
+
+    Parameters:
+    - export_path: csv file exported from Qualtrics, as read by read_export
+    - respondents_path: csv file of the respondent data of the cleaned 
+    survey, the dimension table as returned by respondent_table for the 
+    'star' layout
+    - regex_list: regex of the other experiment's columns, as in prep_conjoint
+    - filemarker: name of the experiment, used in the output file name
+    - calculate_ratings: if True, add the ratings, as in prep_conjoint
+    - output_dir: directory the stacked csv file is written to
+    - layout: 'star' or 'wide', as in prep_conjoint
+    - memory_limit: DuckDB memory limit, e.g. '2GB'
+    - temp_directory: directory DuckDB spills to, by default a temporary 
+    directory in output_dir
+    - threads: number of DuckDB threads, all cores if None
+
+    Returns:
+    - path of the written csv file
+    '''
+    # optional dependency, only needed for data that doesn't fit in memory
+    import duckdb
+
+    if temp_directory is None:
+        temp_directory = os.path.join(output_dir, '.duckdb_tmp')
+    # a database file, so the survey table can be evicted from memory
+    os.makedirs(temp_directory, exist_ok=True)
+    database = os.path.join(temp_directory, f'{filemarker}.duckdb')
+    for stale in (database, database + '.wal'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    con = duckdb.connect(database)
+    try:
+        con.execute(f"SET memory_limit = {literal(memory_limit)}")
+        con.execute(f"SET temp_directory = {literal(temp_directory)}")
+        if threads is not None:
+            con.execute(f'SET threads = {int(threads)}')
+        path = stack_export(con, export_path, respondents_path, regex_list, filemarker, 
+                            calculate_ratings, output_dir, layout)
+    finally:
+        # the staging database is removed on errors as well
+        con.close()
+        for staged in (database, database + '.wal'):
+            if os.path.exists(staged):
+                os.remove(staged)
+    print(f'Stacked data saved to file {path}')
+    return path
+
+
+def stack_export(con, export_path, respondents_path, regex_list, filemarker, 
+                 calculate_ratings, output_dir, layout):
+    '''
+    Clean and stack the conjoint tables of a Qualtrics export on an open 
+    DuckDB connection, the queries of prep_conjoint_lazy.
+
+    Parameters:
+    - con: DuckDB connection to a database file, with the settings applied
+    - export_path, respondents_path, regex_list, filemarker, 
+    calculate_ratings, output_dir, layout: as in prep_conjoint_lazy
+
+    Returns:
+    - path of the written csv file
+    '''
+    # column names as in drop_flagged, without the empty '_Table' columns
+    with open(export_path, newline='', encoding='utf-8') as f:
+        export_columns = next(csv.reader(f))
+    renamed = {}
+    for col in export_columns:
+        name = col
+        for original, replacement in pv_column_names.items():
+            name = name.replace(original, replacement)
+        if not col.endswith('_Table'):
+            renamed[name] = col
+    columns = list(renamed)
+
+    # the same column selection as prep_conjoint
+    other = {col for col in columns if re.search(regex_list, col)}
+    select = lambda pattern: [col for col in columns if re.search(pattern, col) and col not in other]
+    task_cols = select('^choice(?!$)')
+    choice_cols = select('choice$')
+    rating_cols = select('-rating_')
+
+    con.execute(f'''
+        CREATE VIEW respondents AS SELECT * FROM read_csv({literal(respondents_path)}, 
+                                                          all_varchar = true, header = true)''')
+    respondent_cols = [row[0] for row in con.execute('DESCRIBE respondents').fetchall()]
+
+    # all columns as text, so values are passed through as in the export;
+    # rows 1 and 2 are the question text and import ids, the dialect is set
+    # since they can't be sniffed. The columns used of the kept respondents
+    # are read once into a table of one row per respondent and column, which
+    # DuckDB evicts to the database file beyond memory_limit, the queries 
+    # below scan it rather than the export
+    types = ', '.join(f'{literal(col)}: \'VARCHAR\'' for col in export_columns)
+    used = task_cols + choice_cols + rating_cols
+    con.execute(f'''
+        CREATE TABLE survey AS
+        FROM (SELECT ID, {', '.join(f'{quote(renamed[col])} AS {quote(col)}' for col in used)}
+              FROM (SELECT row_number() OVER () - 2 AS ID, {', '.join(quote(renamed[col]) for col in used)}
+                    FROM read_csv({literal(export_path)}, columns = {{{types}}}, header = true, 
+                                  delim = ',', quote = '"', escape = '"', auto_detect = false, 
+                                  strict_mode = false))
+              WHERE ID IN (SELECT CAST("ID" AS BIGINT) FROM respondents))
+        UNPIVOT INCLUDE NULLS (value FOR variable IN ({', '.join(quote(col) for col in used)}))''')
+    # the IDs are row numbers in scan order, so the insertion order is kept
+    # up to here; the output is sorted explicitly, so the queries below may
+    # reorder rows
+    con.execute('SET preserve_insertion_order = false')
+
+    def long(cols, value):
+        # respondents with all columns present, one row per column
+        variables = ', '.join(literal(col) for col in cols)
+        return (f"(SELECT ID, variable, value AS {value} FROM survey "
+                f"WHERE variable IN ({variables}) AND ID IN (SELECT ID FROM survey WHERE variable IN ({variables}) "
+                f"GROUP BY ID HAVING count(value) = {len(cols)}))")
+
+    # translations of the levels and the ratings, as map literals
+    def mapping_sql(mapping):
+        return 'MAP {' + ', '.join(f'{literal(str(key))}: {literal(str(value))}' 
+                                   for key, value in mapping.items()) + '}'
+
+    # attribute columns after the pivot, with the '_table2' values moved to '_table1'
+    attributes = sorted({re.search(r'_(.*)$', col).group(1) for col in task_cols})
+    table2_cols = [attr for attr in attributes if attr.endswith('_table2')]
+    attribute_cols = [attr for attr in attributes if attr not in table2_cols]
+    attribute_sql = [f"COALESCE({quote(attr)}, {quote(attr.replace('_table1', '_table2'))}) AS {quote(attr.replace('_table1', ''))}"
+                     if attr.replace('_table1', '_table2') in table2_cols else 
+                     f"{quote(attr)} AS {quote(attr.replace('_table1', ''))}"
+                     for attr in attribute_cols]
+
+    # a table as well, task 1 is read twice below
+    pivot = ', '.join(f"first(value) FILTER (WHERE attribute = {literal(attr)}) AS {quote(attr)}"
+                      for attr in attributes)
+    con.execute(f'''
+        CREATE TABLE packages AS
+        SELECT ID, task_num, pack_num, {pivot}
+        FROM (SELECT ID,
+                     CAST(regexp_extract(variable, '(\\d+)', 1) AS INTEGER) AS task_num,
+                     CAST(regexp_extract(variable, '(\\d)$', 1) AS INTEGER) AS pack_num,
+                     regexp_extract(variable, '_(.*)$', 1) AS attribute,
+                     COALESCE({mapping_sql(translation_dict_heat | translate_dict_pv)}[value], value) AS value
+              FROM {long(task_cols, 'value')})
+        GROUP BY ID, task_num, pack_num''')
+
+    # task 8 repeats task 1 with the packages swapped, pack_num is kept as
+    # in prep_conjoint
+    attribute_list = ', '.join(quote(attr) for attr in attributes)
+    con.execute(f'''
+        CREATE VIEW stacked AS
+        SELECT ID, task_num, CASE pack_num WHEN 1 THEN 'Left' WHEN 2 THEN 'Right' END AS pack_num_cat, 
+               pack_num, {attribute_list}
+        FROM packages
+        UNION ALL
+        SELECT ID, 8, CASE pack_num WHEN 1 THEN 'Right' WHEN 2 THEN 'Left' END, 
+               pack_num, {attribute_list}
+        FROM packages WHERE task_num = 1''')
+    # choices and ratings are small tables, so the joins below don't scan
+    # the survey table again
+    con.execute(f'''
+        CREATE TABLE choices AS
+        SELECT CAST("ID" AS BIGINT) AS ID,
+               CAST(regexp_extract(variable, '(\\d+)', 1) AS INTEGER) AS task_num,
+               CAST(trim(replace(choice, 'Massnahmenpaket', '')) AS INTEGER) AS choice
+        FROM {long(choice_cols, 'choice')}''')
+
+    # check that no extra rows were created
+    rows, respondents_n, packs, tasks = con.execute('''
+        SELECT count(*), count(DISTINCT ID), max(pack_num), max(task_num)
+        FROM stacked LEFT JOIN choices USING (ID, task_num)''').fetchone()
+    if rows == respondents_n * packs * tasks:
+        print("Conjoint data preparation successful")
+    else:
+        raise ValueError("Error: The lengths of input df and output df do not match. Check input data.")
+
+    joins = 'LEFT JOIN choices USING (ID, task_num)'
+    outputs = (['task_num', 'pack_num_cat', 'pack_num'] + attribute_sql + 
+               ['choice', 'CAST(pack_num = choice AS INTEGER) AS "Y"'])
+    if layout == 'star':
+        joins += ' JOIN (SELECT CAST("ID" AS BIGINT) AS ID, CAST(respondent AS INTEGER) AS respondent FROM respondents) USING (ID)'
+        outputs = ['respondent'] + outputs
+    else:
+        joins += (f' LEFT JOIN (SELECT CAST("ID" AS BIGINT) AS ID, '
+                  f"{', '.join(quote(col) for col in respondent_cols if col != 'ID')} FROM respondents) USING (ID)")
+        outputs = ['ID'] + outputs + [quote(col) for col in respondent_cols if col != 'ID']
+    if calculate_ratings:
+        con.execute(f'''
+            CREATE TABLE ratings AS
+            SELECT CAST("ID" AS BIGINT) AS ID,
+                   CAST(regexp_extract(variable, '^(\\d+)_.*-rating', 1) AS INTEGER) AS task_num,
+                   CAST(regexp_extract(variable, '-rating_(\\d+)$', 1) AS INTEGER) AS pack_num,
+                   CAST(CAST(COALESCE({mapping_sql(likert_dict)}[rating], rating) AS DOUBLE) AS INTEGER) AS rating
+            FROM {long(rating_cols, 'rating')}''')
+        joins += ' LEFT JOIN ratings USING (ID, task_num, pack_num)'
+        outputs.append('rating')
+        path = f'{output_dir}/{filemarker}-conjoint.csv'
+    else:
+        path = f'{output_dir}/{filemarker}-choices.csv'
+
+    # for pv there are tasks without a choice; the joined rows are stored
+    # before they are sorted as prep_conjoint and streamed to file, joining
+    # and sorting in one query runs out of memory at small memory limits
+    con.execute(f'''
+        CREATE TABLE output AS
+        SELECT ID AS sort_id, {', '.join(outputs)}
+        FROM stacked {joins}
+        WHERE choice IS NOT NULL''')
+    columns = [row[0] for row in con.execute('DESCRIBE output').fetchall() if row[0] != 'sort_id']
+    con.execute(f'''
+        COPY (SELECT {', '.join(quote(col) for col in columns)}
+              FROM output ORDER BY sort_id, task_num, pack_num)
+        TO {literal(path)} (HEADER, DELIMITER ',')''')
+    return path
+
+
 def calculate_IRR(df, 
-                  amce):
+                  amce, 
+                  weight=None, 
+                  respondents=None):
     '''
-    Description
+    Estimate the intra-respondent reliability from the repeated task 1 and 8
+    and correct the AMCE for swap error.
+
+    Parameters:
+    - df: stacked conjoint DataFrame
+    - amce: DataFrame with columns 'estimate' and 'std.error', e.g. from 
+    weighted_amce
+    - weight: optional column of respondent weights, the IRR is then the 
+    weighted share of respondents and its CI uses the Kish effective number 
+    of respondents
+    - respondents: respondent dimension table of a star layout df, the ID, 
+    the speeder, laggard and inattentive flags and the weight are gathered 
+    from it by key if df lacks them
     '''
+    if respondents is not None:
+        df = join_respondents(df, respondents, 
+                              ['ID', 'speeder', 'laggard', 'inattentive'] + ([weight] if weight else []))
     # filter out speeders, laggards, inattentives 
     df = df[~((df['speeder'] == True) | 
               (df['laggard'] == True) |
@@ -143,28 +505,36 @@ def calculate_IRR(df,
     print(f"Number of valid respondents: {nr_respondents}")
 
     # filter choices for tasks 1 and 8
-    IRR_task1_choice = df[df['task_num'] == 1][['ID', 'choice']]
-    IRR_task8_choice = df[df['task_num'] == 8][['ID', 'choice']]
+    IRR_task1_choice = df[df['task_num'] == 1].drop_duplicates('ID')
+    IRR_task1_choice = IRR_task1_choice[['ID', 'choice'] + ([weight] if weight else [])]
+    IRR_task8_choice = df[df['task_num'] == 8].drop_duplicates('ID')[['ID', 'choice']]
     
     # merge tasks 1 and 8
     IRR_tasks1_8_choice = pd.merge(IRR_task1_choice, IRR_task8_choice, on='ID', suffixes=('_task1', '_task8'))
-    IRR_tasks1_8_choice.columns = ['ID', 'task_num1', 'task_num8']
+    IRR_tasks1_8_choice.columns = ['ID', 'task_num1'] + (['weight'] if weight else []) + ['task_num8']
+    if not weight:
+        IRR_tasks1_8_choice['weight'] = 1.0
+    else:
+        # Kish effective number of respondents for the CI
+        w = IRR_tasks1_8_choice['weight']
+        nr_respondents = w.sum() ** 2 / (w ** 2).sum()
+        print(f"Effective number of respondents: {nr_respondents:.1f}")
     
     # 1 in both tasks
     both_choose_1 = IRR_tasks1_8_choice[(IRR_tasks1_8_choice['task_num1'] == 1) & (IRR_tasks1_8_choice['task_num8'] == 1)]
-    num_both_choose_1 = len(both_choose_1)
+    num_both_choose_1 = both_choose_1['weight'].sum()
 
     # 2 in both tasks
     both_choose_2 = IRR_tasks1_8_choice[(IRR_tasks1_8_choice['task_num1'] == 2) & (IRR_tasks1_8_choice['task_num8'] == 2)]
-    num_both_choose_2 = len(both_choose_2)
+    num_both_choose_2 = both_choose_2['weight'].sum()
 
     # 2 in task 1 and 1 in task 8
     b_choose = IRR_tasks1_8_choice[(IRR_tasks1_8_choice['task_num1'] == 2) & (IRR_tasks1_8_choice['task_num8'] == 1)]
-    num_b_choose = len(b_choose)
+    num_b_choose = b_choose['weight'].sum()
 
     # 1 in task 1 and 2 in task 8
     c_choose = IRR_tasks1_8_choice[(IRR_tasks1_8_choice['task_num1'] == 1) & (IRR_tasks1_8_choice['task_num8'] == 2)]
-    num_c_choose = len(c_choose)
+    num_c_choose = c_choose['weight'].sum()
 
     print(f"Number of respondents who made the same choices in tasks 1 and 8: {num_both_choose_2 + num_both_choose_1}")
     print(f"Number of respondents who made different choices in tasks 1 and 8: {num_c_choose + num_b_choose}")
@@ -197,4 +567,71 @@ def calculate_IRR(df,
 
     print(amce_corrected)
 
-    return amce_corrected
\ No newline at end of file
+    return amce_corrected
+
+
+def weighted_amce(df, 
+                  attributes, 
+                  baselines, 
+                  weight='weight', 
+                  cluster='ID', 
+                  respondents=None):
+    '''
+    Estimate AMCEs by weighted least squares of the choice on the attribute 
+    level dummies, with standard errors clustered by respondent.
+
+    Parameters:
+    - df: stacked conjoint DataFrame with the attribute columns and 'Y'
+    - attributes: list of attribute column names
+    - baselines: list of 'attribute:level' strings
+    - weight: column of respondent weights, or None for unweighted AMCEs
+    - cluster: column the standard errors are clustered by
+    - respondents: respondent dimension table of a star layout df, the 
+    weight and cluster columns are gathered from it by key if df lacks them
+
+    Returns:
+    - DataFrame with one row per attribute level and the columns 'feature', 
+    'level', 'estimate', 'std.error', 'z', 'p', 'lower' and 'upper', zero 
+    for the baselines, as used by calculate_IRR
+    '''
+    if respondents is not None:
+        df = join_respondents(df, respondents, [col for col in (weight, cluster) if col])
+    df = df.dropna(subset=list(attributes) + ['Y'])
+    encoder = fit_encoder(attributes, baselines, df)
+    design = encode_design(encoder, df, format='csr')
+
+    # intercept and all non-baseline levels
+    baseline_columns = [encoder['offsets'][attr] for attr in attributes]
+    keep = np.setdiff1d(np.arange(design.shape[1]), baseline_columns)
+    X = np.column_stack([np.ones(len(df)), design[:, keep].toarray()])
+    y = df['Y'].to_numpy(dtype=float)
+    w = np.ones(len(df)) if weight is None else df[weight].to_numpy(dtype=float)
+
+    XtW = X.T * w
+    bread = np.linalg.inv(XtW @ X)
+    coef = bread @ (XtW @ y)
+
+    # sum the score contributions per respondent with a sparse cluster indicator
+    clusters, _ = pd.factorize(df[cluster])
+    n_clusters = clusters.max() + 1
+    indicator = sp.csr_matrix((np.ones(len(df)), (clusters, np.arange(len(df)))),
+                              shape=(n_clusters, len(df)))
+    scores = indicator @ (X * (w * (y - X @ coef))[:, None])
+    n, k = X.shape
+    correction = n_clusters / (n_clusters - 1) * (n - 1) / (n - k)
+    vcov = correction * bread @ (scores.T @ scores) @ bread
+
+    estimate = np.zeros(design.shape[1])
+    std_error = np.full(design.shape[1], np.nan)
+    estimate[keep] = coef[1:]
+    std_error[keep] = np.sqrt(np.diag(vcov)[1:])
+
+    amce = pd.DataFrame({'feature': [attr for attr in attributes for _ in encoder['levels'][attr]],
+                         'level': [level for attr in attributes for level in encoder['levels'][attr]],
+                         'estimate': estimate,
+                         'std.error': std_error})
+    amce['z'] = amce['estimate'] / amce['std.error']
+    amce['p'] = 2 * (1 - norm.cdf(np.abs(amce['z'])))
+    amce['lower'] = amce['estimate'] - 1.96 * amce['std.error']
+    amce['upper'] = amce['estimate'] + 1.96 * amce['std.error']
+    return amce
@@ -0,0 +1,190 @@
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import pymc as pm
+from pymc.blocking import DictToArrayBijection
+from pymc.initial_point import make_initial_point_fns_per_chain
+from pymc.step_methods.hmc.quadpotential import QuadPotentialDiagAdapt
+from functions.model_assist import build_model, choice_arrays
+from functions.loo_assist import task_loglik, task_design
+from functions.resource_assist import (available_cpus, core_layout,
+                                       limit_blas_threads, log_layout)
+
+
+# model and NUTS step compiled once per worker process, reused for every
+# fold it fits
+worker_model = {}
+
+
+def grouped_folds(ids, n_folds=5, seed=42):
+    """
+    Assign respondents at random to folds, keeping all rows of a respondent
+    in the same fold.
+
+    Parameters:
+    - ids: respondent ID of each row
+    - n_folds: number of folds
+    - seed: seed for the assignment
+
+    Returns:
+    - integer array with the fold of each row
+    """
+    respondents, codes = np.unique(np.asarray(ids), return_inverse=True)
+    rng = np.random.default_rng(seed)
+    respondent_fold = rng.permutation(len(respondents)) % n_folds
+    return respondent_fold[codes]
+
+
+def init_worker(df, dummies, variant, blas_threads, chains=4, target_accept=0.8):
+    """
+    Build and compile the model on the full data once per worker process.
+
+    The NUTS step with the compiled logp and gradient, the jittered initial
+    points of the chains and their transformation to the constrained scale
+    are compiled here and reused for every fold, only the data changes.
+    The mass matrix adapts from the identity in each fold as in pm.sample's
+    default jitter+adapt_diag initialisation.
+    """
+    limit_blas_threads(blas_threads)
+    model = build_model(df, dummies, variant=variant)
+    with model:
+        start = DictToArrayBijection.map(model.initial_point()).data
+        potential = QuadPotentialDiagAdapt(len(start), start, np.ones_like(start), 10)
+        step = pm.NUTS(potential=potential, target_accept=target_accept)
+    worker_model.update(
+        model=model,
+        step=step,
+        initial_points=make_initial_point_fns_per_chain(model=model, overrides=None, chains=chains,
+                                                        jitter_rvs=set(model.free_RVs)),
+        constrained=model.compile_fn(model.unobserved_value_vars, inputs=model.value_vars,
+                                     on_unused_input="ignore", point_fn=True))
+
+
+def fold_initvals(seed=None):
+    """
+    Jittered initial values of the worker's chains, on the constrained scale.
+    """
+    model = worker_model["model"]
+    free = {rv.name for rv in model.free_RVs}
+    names = [var.name for var in model.unobserved_value_vars]
+    seeds = np.random.default_rng(seed).integers(2**30, size=len(worker_model["initial_points"]))
+    return [{name: value for name, value in zip(names, worker_model["constrained"](point_fn(chain_seed)))
+             if name in free}
+            for point_fn, chain_seed in zip(worker_model["initial_points"], seeds)]
+
+
+def heldout_scores(beta, data):
+    """
+    Score the posterior predictions of held-out choice tasks.
+
+    Parameters:
+    - beta: array of posterior draws of shape (draws, cantons, levels)
+    - data: dictionary of held-out tasks as returned by choice_arrays
+
+    Returns:
+    - DataFrame with one row per task, with the canton index, the log
+    predictive density 'log_score' and whether the more likely package
+    under the posterior mean probability was chosen ('hit')
+    """
+    design = task_design(data, beta.shape[-1])
+    ll = task_loglik(beta, data["c"], design, data["observed_choice_left"])
+    probability_observed = np.exp(ll).mean(axis=0)
+    return pd.DataFrame({"canton": data["c"],
+                         "log_score": np.logaddexp.reduce(ll, axis=0) - np.log(len(ll)),
+                         "hit": probability_observed > 0.5})
+
+
+def fit_fold(fold, train, test, sampler_settings):
+    """
+    Fit the worker's model to the training tasks of one fold and score
+    the held-out tasks.
+
+    Parameters:
+    - fold: fold number
+    - train, test: dictionaries of tasks as returned by choice_arrays
+    - sampler_settings: keyword arguments passed on to pm.sample, the 
+    chains and target_accept are set when the worker starts
+
+    Returns:
+    - DataFrame as returned by heldout_scores, with the fold number
+    """
+    model = worker_model["model"]
+    settings = {key: value for key, value in sampler_settings.items() 
+                if key not in ("chains", "target_accept")}
+    seed = settings.get("random_seed")
+    with model:
+        # same graph, only the data and the length of the task dimension
+        # change, so the compiled step is reused
+        pm.set_data({name: values for name, values in train.items() if name in model.named_vars})
+        inference_data = pm.sample(step=worker_model["step"],
+                                   chains=len(worker_model["initial_points"]),
+                                   initvals=fold_initvals(None if seed is None else seed + fold),
+                                   progressbar=False, **settings)
+    beta = inference_data.posterior["beta"].stack(sample=("chain", "draw"))
+    scores = heldout_scores(beta.transpose("sample", "canton", "level").values, test)
+    scores["fold"] = fold
+    return scores
+
+
+def cross_validate(df, dummies, n_folds=5, variant="hierarchical",
+                   sampler_settings={}, core_budget=None, seed=42):
+    """
+    Respondent-grouped K-fold cross-validation of the cantonal model.
+
+    Folds hold out whole respondents, so their repeated task and the
+    correlation between their answers can't leak into the training data.
+    Folds are fitted in parallel, as many at a time as the core budget
+    allows with one core per chain, see core_layout.
+
+    Parameters:
+    - df: stacked conjoint DataFrame as returned by encode_dummies
+    - dummies: DataFrame of attribute level dummies as returned by encode_dummies
+    - n_folds: number of folds
+    - variant: model variant passed on to build_model
+    - sampler_settings: keyword arguments passed on to pm.sample
+    - core_budget: number of cores used in total, by default all available
+    - seed: seed for the fold assignment and sampling
+
+    Returns:
+    - DataFrame as returned by heldout_scores for all tasks, with their fold
+    """
+    chains = sampler_settings.get("chains", 4)
+    cpus = available_cpus() if core_budget is None else core_budget
+    layout = core_layout(chains=chains, jobs=min(n_folds, max(1, cpus // chains)), cpus=cpus)
+    log_layout(layout)
+    sampler_settings = {"random_seed": seed, **sampler_settings, "cores": layout["cores"]}
+
+    folds = grouped_folds(df["ID"], n_folds=n_folds, seed=seed)
+    with ProcessPoolExecutor(max_workers=layout["jobs"],
+                             initializer=init_worker,
+                             initargs=(df, dummies, variant, layout["blas_threads"], chains,
+                                       sampler_settings.get("target_accept", 0.8))) as pool:
+        futures = [pool.submit(fit_fold, fold,
+                               choice_arrays(df[folds != fold], dummies[folds != fold]),
+                               choice_arrays(df[folds == fold], dummies[folds == fold]),
+                               sampler_settings)
+                   for fold in range(n_folds)]
+        return pd.concat([future.result() for future in futures], ignore_index=True)
+
+
+def cv_summary(scores, cantons):
+    """
+    Summarise held-out scores per canton and overall.
+
+    Parameters:
+    - scores: DataFrame as returned by cross_validate
+    - cantons: canton names in the order of the model's canton coordinate
+
+    Returns:
+    - DataFrame with the number of tasks, the summed and mean log score
+    and the hit rate per canton, and a 'total' row
+    """
+    summary = scores.groupby("canton").agg(tasks=("log_score", "size"),
+                                           log_score=("log_score", "sum"),
+                                           mean_log_score=("log_score", "mean"),
+                                           hit_rate=("hit", "mean"))
+    summary.index = np.asarray(cantons)[summary.index]
+    summary.loc["total"] = [len(scores), scores["log_score"].sum(),
+                            scores["log_score"].mean(), scores["hit"].mean()]
+    summary["tasks"] = summary["tasks"].astype(int)
+    return summary
@@ -0,0 +1,156 @@
+import json
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+
+
+def level_labels(series):
+    """
+    Turn attribute values into level labels, writing whole numbers such as
+    years read back from csv as 2050.0 as '2050'.
+
+    Parameters:
+    - series: pandas Series of attribute values
+
+    Returns:
+    - Series of strings, missing values stay missing
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        whole = series.dropna() % 1 == 0
+        if whole.all():
+            series = series.astype("Int64")
+    return series.astype("string").astype(object).where(series.notna())
+
+
+def fit_encoder(attributes, baselines, df=None, attribute_levels=None):
+    """
+    Fit a design encoder from the attribute and baseline lists.
+
+    Levels are taken from attribute_levels if given, otherwise from the
+    data in order of appearance. The baseline level always comes first,
+    so the columns match the dummies used so far.
+
+    Parameters:
+    - attributes: list of attribute column names
+    - baselines: list of 'attribute:level' strings
+    - df: stacked conjoint DataFrame to take levels and cantons from
+    - attribute_levels: optional dictionary of attribute to list of levels
+
+    Returns:
+    - dictionary with the 'attributes', their 'levels' (baseline first),
+    the design 'columns' ('attribute_level'), the column 'offsets' of each
+    attribute and the 'cantons' in the data
+    """
+    baseline_dict = {attr.split(":")[0]: attr.split(":")[1] for attr in baselines}
+    levels = {}
+    for attr in attributes:
+        if attribute_levels is not None:
+            found = list(attribute_levels[attr])
+        else:
+            found = list(level_labels(df[attr]).dropna().unique())
+        baseline = baseline_dict[attr]
+        levels[attr] = [baseline] + [level for level in found if level != baseline]
+
+    offsets = {}
+    columns = []
+    for attr in attributes:
+        offsets[attr] = len(columns)
+        columns.extend(f"{attr}_{level}" for level in levels[attr])
+
+    cantons = []
+    if df is not None and "canton" in df:
+        cantons = sorted(df["canton"].dropna().unique())
+
+    return {"attributes": list(attributes),
+            "levels": levels,
+            "columns": columns,
+            "offsets": offsets,
+            "cantons": list(cantons)}
+
+
+def encode_design(encoder, df, format="csr"):
+    """
+    Encode the attribute levels of a choice table with a fitted encoder.
+
+    Parameters:
+    - encoder: dictionary as returned by fit_encoder
+    - df: DataFrame with one column per attribute
+    - format: 'csr' for a sparse one-hot matrix, 'index' for an integer
+    array with the design column of each attribute, or 'dense' for a
+    boolean DataFrame of dummies
+
+    Returns:
+    - design of shape (rows, columns) for 'csr' and 'dense', or
+    (rows, attributes) for 'index'
+    """
+    index = np.empty((len(df), len(encoder["attributes"])), dtype=np.int32)
+    for j, attr in enumerate(encoder["attributes"]):
+        labels = level_labels(df[attr])
+        codes = pd.Index(encoder["levels"][attr]).get_indexer(labels)
+        if (codes < 0).any():
+            unknown = sorted(set(labels[codes < 0].astype(str)))
+            raise ValueError(f"Unknown levels of {attr}: {unknown}. Refit the encoder or check the data.")
+        index[:, j] = codes + encoder["offsets"][attr]
+
+    if format == "index":
+        return index
+
+    n_rows, n_attributes = index.shape
+    design = sp.csr_matrix((np.ones(index.size, dtype=np.int8),
+                            index.ravel(),
+                            np.arange(0, index.size + 1, n_attributes)),
+                           shape=(n_rows, len(encoder["columns"])))
+    if format == "csr":
+        return design
+    if format == "dense":
+        return pd.DataFrame(design.toarray().astype(bool), index=df.index, columns=encoder["columns"])
+    raise ValueError("format should be 'csr', 'index' or 'dense'.")
+
+
+def encode_cantons(encoder, df):
+    """
+    Code the cantons of a choice table consistently with a fitted encoder.
+
+    Parameters:
+    - encoder: dictionary as returned by fit_encoder
+    - df: DataFrame with a 'canton' column
+
+    Returns:
+    - integer array with the position of each row's canton in encoder['cantons']
+    """
+    codes = pd.Index(encoder["cantons"]).get_indexer(df["canton"])
+    if (codes < 0).any():
+        raise ValueError("Cantons missing from the encoder, refit it on data including them.")
+    return codes
+
+
+def save_encoder(encoder, path):
+    """
+    Save a fitted encoder as json.
+    """
+    with open(path, "w") as f:
+        json.dump(encoder, f, indent=2, ensure_ascii=False)
+
+
+def load_encoder(path):
+    """
+    Load an encoder saved with save_encoder.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def attach_encoder(inference_data, encoder):
+    """
+    Store the encoder in the attributes of the posterior, so it is saved
+    with the netcdf file of the fit.
+    """
+    inference_data.posterior.attrs["design_encoder"] = json.dumps(encoder, ensure_ascii=False)
+    return inference_data
+
+
+def encoder_from_inference_data(inference_data):
+    """
+    Read the encoder stored with attach_encoder from a fit.
+    """
+    return json.loads(inference_data.posterior.attrs["design_encoder"])
@@ -0,0 +1,193 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# report the stages are recorded to, set by start_run
+current_report = None
+
+# seconds between the RSS samples of a stage, shorter peaks can be missed
+rss_interval_s = 0.05
+
+
+def start_run(name, **meta):
+    """
+    Start a run report that stages are recorded to.
+
+    Parameters:
+    - name: name of the run, used as file prefix of the report
+    - meta: additional fields stored in the report, e.g. the experiment
+
+    Returns:
+    - dictionary of the run report
+    """
+    global current_report
+    current_report = {"name": name,
+                      "started": datetime.now().isoformat(timespec='seconds'),
+                      **meta,
+                      "stages": []}
+    return current_report
+
+
+def current_rss_mb():
+    """
+    Current resident set size of the process in MB.
+
+    Read from /proc on Linux, elsewhere from psutil.
+
+    Returns:
+    - RSS in MB, or None if it can't be read
+    """
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 1e6
+
+
+def max_rss_mb(children=False):
+    """
+    Peak resident set size in MB.
+
+    From getrusage where the resource module exists, ru_maxrss is in bytes
+    on macOS and in kilobytes on Linux; on Windows the peak working set
+    from psutil, which has no peak of the child processes.
+
+    Parameters:
+    - children: if True, the peak of the finished child processes instead
+    of this process
+
+    Returns:
+    - peak RSS in MB over the lifetime of the process (or its finished
+    children), or None if it can't be read
+    """
+    try:
+        import resource
+    except ImportError:
+        # Unix only
+        try:
+            import psutil
+        except ImportError:
+            return None
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return None if children or peak is None else peak / 1e6
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1e6 if sys.platform == "darwin" else max_rss * 1024 / 1e6
+
+
+def watch_rss(peak, stopped, interval=rss_interval_s):
+    """
+    Keep the largest RSS in peak["rss_mb"], sampled until stopped is set.
+    """
+    while not stopped.wait(interval):
+        peak["rss_mb"] = max(peak["rss_mb"], current_rss_mb())
+
+
+@contextmanager
+def stage(name, report=None, **info):
+    """
+    Record wall time, CPU time and peak RSS of a stage.
+
+    Without a report nothing is measured, so instrumented functions cost
+    nothing outside of recorded runs. Otherwise it reads the clocks and
+    getrusage before and after the stage, and a background thread samples
+    the RSS every rss_interval_s. The stage peak is the largest sample
+    during the stage. The process peak is the maximum resident set size of
+    the process so far, including earlier stages, and the children peak
+    that of its finished child processes such as sampling chains.
+
+    Parameters:
+    - name: name of the stage
+    - report: run report to record to, by default the one set by start_run,
+    nothing is measured or recorded if there is none
+    - info: additional fields stored in the stage record
+
+    Yields:
+    - dict of the stage record, rows can be added by the caller as 'rows'
+    """
+    report = current_report if report is None else report
+    record = {"stage": name, **info}
+    if report is None:
+        yield record
+        return
+    start_rss = current_rss_mb()
+    if start_rss is not None:
+        peak, stopped = {"rss_mb": start_rss}, threading.Event()
+        watcher = threading.Thread(target=watch_rss, args=(peak, stopped), daemon=True)
+        watcher.start()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = round(time.perf_counter() - start_wall, 4)
+        record["cpu_s"] = round(time.process_time() - start_cpu, 4)
+        if start_rss is not None:
+            stopped.set()
+            watcher.join()
+            record["start_rss_mb"] = round(start_rss, 2)
+            record["peak_rss_mb"] = round(max(peak["rss_mb"], current_rss_mb()), 2)
+        for field, children in [("process_peak_rss_mb", False), ("children_peak_rss_mb", True)]:
+            peak_rss = max_rss_mb(children)
+            if peak_rss is not None:
+                record[field] = round(peak_rss, 2)
+        report["stages"].append(record)
+
+
+def instrumented(name=None, key=None):
+    """
+    Decorator recording each call of a function as a stage.
+
+    Parameters:
+    - name: name of the stage, by default the function name
+    - key: optional keyword argument whose value is added to the stage
+    name, e.g. 'filemarker' to tell the experiments apart
+
+    Returns:
+    - decorator, the row count of returned DataFrames is recorded as 'rows'
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stage_name = name or func.__name__
+            if key is not None and key in kwargs:
+                stage_name = f"{stage_name}[{kwargs[key]}]"
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if hasattr(result, 'shape'):
+                    record["rows"] = int(result.shape[0])
+            return result
+        return wrapper
+    return decorator
+
+
+def write_run_report(report=None, output_dir='output/reports'):
+    """
+    Write a run report to json.
+
+    Parameters:
+    - report: run report, by default the one set by start_run
+    - output_dir: directory the json file is written to
+
+    Returns:
+    - path of the written json file
+    """
+    report = current_report if report is None else report
+    finished = datetime.now()
+    report["finished"] = finished.isoformat(timespec='seconds')
+    report["total_wall_s"] = (finished - datetime.fromisoformat(report["started"])).total_seconds()
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = f'{output_dir}/{report["name"]}-{timestamp}.json'
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f'Run report saved to file {path}')
+    return path
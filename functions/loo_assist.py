@@ -0,0 +1,346 @@
+import arviz as az
+import pandas as pd
+import numpy as np
+import xarray as xr
+
+
+def open_fit(fit):
+    """
+    Open the posterior and constant data of a fit without loading the draws.
+
+    Parameters:
+    - fit: path of a netcdf file written by InferenceData.to_netcdf, or an
+    InferenceData object
+
+    Returns:
+    - posterior Dataset and constant_data Dataset, lazily loaded from file
+    """
+    if isinstance(fit, str):
+        return (xr.open_dataset(fit, group="posterior"),
+                xr.open_dataset(fit, group="constant_data"))
+    return fit.posterior, fit.constant_data
+
+
+def task_loglik(beta, canton, design, observed):
+    """
+    Log-likelihood of the observed choices for a batch of posterior draws.
+
+    Parameters:
+    - beta: array of shape (draws, cantons, levels)
+    - canton: integer array with the canton index of each task
+    - design: array of shape (tasks, levels), left minus right dummies
+    - observed: array with 1 if the left package was chosen
+
+    Returns:
+    - array of shape (draws, tasks) with log p(y_task | draw)
+    """
+    eta = np.empty((beta.shape[0], len(canton)))
+    for c in range(beta.shape[1]):
+        tasks = np.flatnonzero(canton == c)
+        eta[:, tasks] = beta[:, c, :] @ design[tasks].T
+    # log p(left) = -log(1 + exp(-eta)), log p(right) = -log(1 + exp(eta))
+    return -np.logaddexp(0, np.where(observed == 1, -eta, eta))
+
+
+def task_design(data, n_levels):
+    """
+    Difference of the left and right one-hot designs per task, from the 
+    design data of any model formulation.
+
+    Parameters:
+    - data: dictionary of tasks as returned by choice_arrays, or the 
+    constant_data group of a fit
+    - n_levels: number of design columns
+
+    Returns:
+    - float array of shape (tasks, levels)
+    """
+    if "attribute_levels_difference" in data:
+        return np.asarray(data["attribute_levels_difference"]).astype(float)
+    if "level_index_left" in data:
+        index_left = np.asarray(data["level_index_left"])
+        index_right = np.asarray(data["level_index_right"])
+        design = np.zeros((len(index_left), n_levels))
+        rows = np.arange(len(index_left))[:, None]
+        np.add.at(design, (rows, index_left), 1)
+        np.add.at(design, (rows, index_right), -1)
+        return design
+    return (np.asarray(data["attribute_levels_left"]).astype(float) -
+            np.asarray(data["attribute_levels_right"]).astype(float))
+
+
+def loglik_chunks(fit, chunk_size=200):
+    """
+    Evaluate the pointwise log-likelihood of each choice task in chunks of draws.
+    Fits on collapsed choice sets are expanded to tasks, so LOO still 
+    leaves out single tasks.
+
+    Only one chunk of posterior draws is read and held in memory at a time,
+    so the full draws x tasks matrix is never built.
+
+    Parameters:
+    - fit: path or InferenceData as accepted by open_fit
+    - chunk_size: number of draws per chunk, per chain
+
+    Yields:
+    - array of shape (chunk draws, tasks) with log p(y_task | draw)
+    """
+    posterior, constant_data = open_fit(fit)
+    canton = constant_data["c"].values
+    observed = constant_data["observed_choice_left"].values
+    design = task_design(constant_data, posterior.sizes["level"])
+    if "trials" in constant_data:
+        # fit on collapsed choice sets, expanded to one entry per task with 
+        # the left choices first
+        trials = constant_data["trials"].values
+        sets = np.repeat(np.arange(len(trials)), trials)
+        position = np.arange(len(sets)) - np.repeat(np.cumsum(trials) - trials, trials)
+        observed = (position < observed[sets]).astype(np.int8)
+        canton, design = canton[sets], design[sets]
+
+    beta = posterior["beta"].transpose("chain", "draw", "canton", "level")
+    for chain in range(posterior.sizes["chain"]):
+        for start in range(0, posterior.sizes["draw"], chunk_size):
+            # draw x canton x level
+            yield task_loglik(beta[chain, start:start + chunk_size].values, canton, design, observed)
+
+
+def gpdfit(x):
+    """
+    Fit a generalized Pareto distribution to the rows of x, with the
+    empirical Bayes method of Zhang and Stephens (2009) as used in PSIS.
+
+    Parameters:
+    - x: array of shape (observations, tail) of sorted positive exceedances
+
+    Returns:
+    - arrays of the shape parameter k and scale sigma per observation
+    """
+    prior_bs = 3
+    prior_k = 10
+    n = x.shape[1]
+    m_est = 30 + int(n ** 0.5)
+    b_ary = 1 - np.sqrt(m_est / (np.arange(1, m_est + 1, dtype=float) - 0.5))
+    b_ary = b_ary / (prior_bs * x[:, int(n / 4 + 0.5) - 1, None]) + 1 / x[:, -1, None] # obs x m
+    k_ary = np.log1p(-b_ary[:, :, None] * x[:, None, :]).mean(axis=2)
+    len_scale = n * (np.log(-(b_ary / k_ary)) - k_ary - 1)
+    weights = 1 / np.exp(len_scale[:, None, :] - len_scale[:, :, None]).sum(axis=2)
+    # remove negligible weights
+    weights = np.where(weights >= 10 * np.finfo(float).eps, weights, 0)
+    weights /= weights.sum(axis=1, keepdims=True)
+    b_post = (b_ary * weights).sum(axis=1)
+    k_post = np.log1p(-b_post[:, None] * x).mean(axis=1)
+    sigma = -k_post / b_post
+    k_post = (n * k_post + prior_k * 0.5) / (n + prior_k)
+    return k_post, sigma
+
+
+def gpinv(probs, k, sigma):
+    """
+    Quantiles of generalized Pareto distributions, one per row.
+    """
+    k = k[:, None]
+    small_k = np.abs(k) < np.finfo(float).eps
+    safe_k = np.where(small_k, 1, k)
+    quantiles = np.where(small_k,
+                         -np.log1p(-probs),
+                         np.expm1(-safe_k * np.log1p(-probs)) / safe_k)
+    return quantiles * sigma[:, None]
+
+
+def smooth_tail(tail, cutoff, obs_chunk_size=500):
+    """
+    Replace the largest log importance ratios by the quantiles of a fitted
+    generalized Pareto distribution, row by row.
+
+    Parameters:
+    - tail: array of shape (rows, tail length) of sorted log ratios,
+    relative to the largest ratio of the row
+    - cutoff: log ratio below the tail per row, relative to the largest ratio
+    - obs_chunk_size: number of rows smoothed at once
+
+    Returns:
+    - smoothed tail, truncated at the largest raw ratio, with the raw tail
+    kept where the fit failed
+    - Pareto k per row, inf for tails of at most four distinct ratios
+    """
+    tail_len = tail.shape[1]
+    pareto_k = np.empty(len(tail))
+    smoothed = np.empty_like(tail)
+    probs = (np.arange(0.5, tail_len) / tail_len)[None, :]
+    for start in range(0, len(tail), obs_chunk_size):
+        rows = slice(start, start + obs_chunk_size)
+        exceedance = np.exp(tail[rows]) - np.exp(cutoff[rows, None])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            k, sigma = gpdfit(exceedance)
+            pareto_k[rows] = k
+            smoothed[rows] = np.log(gpinv(probs, k, sigma) + np.exp(cutoff[rows, None]))
+    # tails of at most four distinct ratios, e.g. tasks with identical packages, are not smoothed
+    degenerate = (tail > cutoff[:, None]).sum(axis=1) <= 4
+    pareto_k[degenerate] = np.inf
+    smoothed = np.where(np.isfinite(smoothed) & ~degenerate[:, None], np.minimum(smoothed, 0), tail)
+    return smoothed, pareto_k
+
+
+def psis_smooth(log_weights, reff=1.0):
+    """
+    Pareto smoothed importance sampling of each row of log weights.
+
+    Parameters:
+    - log_weights: array of shape (rows, draws) of unnormalised log weights
+    - reff: relative efficiency of the draws, used for the tail length
+
+    Returns:
+    - normalised smoothed log weights of the same shape
+    - Pareto k per row
+    """
+    log_weights = log_weights - log_weights.max(axis=1, keepdims=True)
+    n_samples = log_weights.shape[1]
+    tail_len = int(np.ceil(min(0.2 * n_samples, 3 * np.sqrt(n_samples / reff))))
+
+    order = np.argsort(log_weights, axis=1)
+    ordered = np.take_along_axis(log_weights, order, axis=1)
+    cutoff = np.maximum(ordered[:, -tail_len - 1], np.log(np.finfo(float).tiny))
+    ordered[:, -tail_len:], pareto_k = smooth_tail(ordered[:, -tail_len:], cutoff)
+
+    smoothed = np.empty_like(ordered)
+    np.put_along_axis(smoothed, order, ordered, axis=1)
+    smoothed -= np.logaddexp.reduce(smoothed, axis=1, keepdims=True)
+    return smoothed, pareto_k
+
+
+def relative_efficiency(posterior):
+    """
+    Relative efficiency of the posterior draws, estimated as in az.loo: the
+    mean ESS of all posterior variables over the number of draws.
+
+    Parameters:
+    - posterior: posterior Dataset, e.g. as returned by open_fit
+
+    Returns:
+    - relative efficiency, 1 for a single chain
+    """
+    n_samples = posterior.sizes["chain"] * posterior.sizes["draw"]
+    if posterior.sizes["chain"] == 1:
+        return 1.0
+    # one variable at a time, so only one is loaded from file at once
+    ess = [az.ess(posterior[[var]], method="mean")[var].values.ravel() for var in posterior.data_vars]
+    return float(np.hstack(ess).mean() / n_samples)
+
+
+def streaming_loo_waic(fit, chunk_size=200, reff=None, obs_chunk_size=500):
+    """
+    Compute PSIS-LOO and WAIC from the log-likelihood streamed in draw chunks.
+
+    Per observation, only running sums for WAIC (log-sum-exp, mean and
+    variance of the log-likelihood) and the largest importance ratios needed
+    for Pareto smoothing are kept, so memory grows with the number of tasks
+    times the Pareto tail length instead of times the number of draws.
+
+    Parameters:
+    - fit: path or InferenceData as accepted by open_fit
+    - chunk_size: number of draws per chunk, per chain
+    - reff: relative efficiency of the draws, used for the tail length, 
+    estimated from the chains with relative_efficiency if None
+    - obs_chunk_size: number of observations smoothed at once
+
+    Returns:
+    - dictionary with totals 'elpd_loo', 'se_loo', 'p_loo', 'elpd_waic',
+    'se_waic', 'p_waic', the number of 'draws' and 'observations', the 
+    'reff' used, and the pointwise arrays 'loo_i', 'waic_i' and 'pareto_k'
+    """
+    posterior, _ = open_fit(fit)
+    if reff is None:
+        reff = relative_efficiency(posterior)
+    n_samples = posterior.sizes["chain"] * posterior.sizes["draw"]
+    tail_len = int(np.ceil(min(0.2 * n_samples, 3 * np.sqrt(n_samples / reff))))
+
+    count = 0
+    top = lse_ll = lse_ratio = mean = m2 = None
+    for ll in loglik_chunks(fit, chunk_size):
+        if top is None:
+            top = np.full((tail_len + 1, ll.shape[1]), -np.inf)
+            lse_ll = np.full(ll.shape[1], -np.inf)
+            lse_ratio = np.full(ll.shape[1], -np.inf)
+            mean = np.zeros(ll.shape[1])
+            m2 = np.zeros(ll.shape[1])
+
+        # largest log importance ratios r = -ll, cutoff value plus tail
+        stacked = np.vstack([top, -ll])
+        top = np.partition(stacked, stacked.shape[0] - tail_len - 1, axis=0)[-(tail_len + 1):]
+
+        lse_ll = np.logaddexp(lse_ll, np.logaddexp.reduce(ll, axis=0))
+        lse_ratio = np.logaddexp(lse_ratio, np.logaddexp.reduce(-ll, axis=0))
+
+        # combine running mean and variance with the chunk (Chan et al.)
+        n_chunk = ll.shape[0]
+        delta = ll.mean(axis=0) - mean
+        total = count + n_chunk
+        mean += delta * n_chunk / total
+        m2 += ((ll - ll.mean(axis=0)) ** 2).sum(axis=0) + delta ** 2 * count * n_chunk / total
+        count = total
+
+    # WAIC
+    lppd_i = lse_ll - np.log(count)
+    waic_i = lppd_i - m2 / count
+
+    # PSIS-LOO, smoothing the tail of the importance ratios per observation
+    top = np.sort(top, axis=0).T # obs x (cutoff + tail), ascending
+    r_max = top[:, -1]
+    cutoff = np.maximum(top[:, 0] - r_max, np.log(np.finfo(float).tiny))
+    smoothed, pareto_k = smooth_tail(top[:, 1:] - r_max[:, None], cutoff, obs_chunk_size)
+
+    # normalising constant of all smoothed ratios, relative to r_max
+    lse_tail_raw = np.logaddexp.reduce(top[:, 1:], axis=1)
+    lse_body = lse_ratio + np.log1p(-np.minimum(np.exp(lse_tail_raw - lse_ratio), 1 - 1e-16)) - r_max
+    log_norm = np.logaddexp(lse_body, np.logaddexp.reduce(smoothed, axis=1))
+    # body draws contribute exp(ll + r - r_max - log_norm) = exp(-r_max - log_norm) each
+    body = np.log(count - tail_len) - r_max - log_norm
+    tail_terms = -top[:, 1:] + smoothed - log_norm[:, None]
+    loo_i = np.logaddexp(body, np.logaddexp.reduce(tail_terms, axis=1))
+
+    n_obs = len(loo_i)
+    return {"elpd_loo": float(loo_i.sum()),
+            "se_loo": float(np.sqrt(n_obs * loo_i.var())),
+            "p_loo": float(lppd_i.sum() - loo_i.sum()),
+            "elpd_waic": float(waic_i.sum()),
+            "se_waic": float(np.sqrt(n_obs * waic_i.var())),
+            "p_waic": float((m2 / count).sum()),
+            "draws": count,
+            "observations": n_obs,
+            "reff": reff,
+            "loo_i": loo_i,
+            "waic_i": waic_i,
+            "pareto_k": pareto_k}
+
+
+def compare_fits(results, criterion="loo"):
+    """
+    Rank fitted variants by expected log pointwise predictive density.
+
+    Parameters:
+    - results: dictionary of variant name to the result of
+    streaming_loo_waic, all fitted to the same choice tasks
+    - criterion: 'loo' or 'waic'
+
+    Returns:
+    - DataFrame with one row per variant, best first, with elpd, its
+    standard error, effective number of parameters, the difference to the
+    best variant and its standard error, and the number of tasks with
+    Pareto k above 0.7
+    """
+    pointwise = {name: result[f"{criterion}_i"] for name, result in results.items()}
+    best = max(pointwise, key=lambda name: pointwise[name].sum())
+    rows = []
+    for name, result in results.items():
+        diff = pointwise[best] - pointwise[name]
+        rows.append({"variant": name,
+                     f"elpd_{criterion}": result[f"elpd_{criterion}"],
+                     "se": result[f"se_{criterion}"],
+                     f"p_{criterion}": result[f"p_{criterion}"],
+                     "elpd_diff": float(diff.sum()),
+                     "dse": float(np.sqrt(len(diff) * diff.var())),
+                     "n_bad_k": int((result["pareto_k"] > 0.7).sum())})
+    table = pd.DataFrame(rows).sort_values(f"elpd_{criterion}", ascending=False)
+    table.insert(0, "rank", range(len(table)))
+    return table.set_index("variant")
@@ -0,0 +1,525 @@
+import pandas as pd
+import numpy as np
+import pymc as pm
+import pytensor
+import pytensor.tensor as pt
+from pymc.distributions.transforms import ZeroSumTransform
+from functions.data_assist import apply_mapping
+from functions.design_assist import fit_encoder, encode_design, encode_cantons, level_labels
+from functions.spatial_assist import canton_adjacency, icar_edges, bym2_scale, icar_logp
+
+
+# attributes, baselines and translations per experiment
+attributes_pv = [ 
+    "mix", 
+    "imports",
+    "pv",
+    "tradeoffs", 
+    "distribution"
+]
+
+attributes_heat = [
+    "year",
+    "tax",
+    "ban",
+    "heatpump",
+    "energyclass",
+    "exemption"
+]
+
+baselines_pv = [
+    "mix:hydro",
+    "imports:0%",
+    "pv:none", 
+    "tradeoffs:none",
+    "distribution:none"
+]
+
+baselines_heat = [
+    "year:2050", 
+    "tax:0%",
+    "ban:none",
+    "heatpump:subsidy",
+    "energyclass:new-only-efficient",
+    "exemption:none"
+]
+
+translate_dict_pv = {
+    # target mix
+    'More hydro': 'hydro',
+    'More solar': 'solar',
+    'More wind': 'wind',
+
+    # rooftop pv requirements
+    'No obligation': 'none',
+    'New public and commercial buildings': 'new-non-residential',
+    'New and existing public and commercial buildings': 'all-non-residential',
+    'All new buildings': 'all-new',
+    'All new and existing buildings': 'all',
+
+    # biodiversity tradeoffs
+    'No trade-offs': 'none',
+    'Alpine regions': 'alpine',
+    'Agricultural areas': 'agricultural',
+    'Forests': 'forests',
+    'Rivers': 'rivers',
+    'Lakes': 'lakes',
+
+    # cantonal distribution
+    'No agreed distribution': 'none',
+    'Potential-based': 'potential-based',
+    'Equal per person': 'equal-pp', 
+    'Minimum limit': 'min-limit',
+    'Maximum limit': 'max-limit',
+}
+
+translate_dict_heat = {
+    # ban
+    'No ban': 'none',
+    'Ban on new installations': 'new',
+    'Ban and fossil heating replacement': 'all',
+
+    # heatpump
+    'Subsidy': 'subsidy',
+    'Governmental lease': 'lease',
+    'Subscription': 'subscription',
+
+    # energyclass 
+    'New buildings must be energy efficient': 'new-only-efficient',
+    'New buildings must be energy efficient and produce renewable electricity on-site': 'new-efficient-renewable',
+    'All buildings must be energy efficient': 'all-retrofit', 
+    'All buildings must be energy efficient and produce renewable electricity on-site': 'all-retrofit-renewable',
+
+    # exemptions
+    'No exemptions': 'none',
+    'Low-income households are exempted': 'low',
+    'Low and middle-income households are exempted': 'low-mid'
+}
+
+# attribute levels per experiment as named in the model, baseline first
+attribute_levels_pv = {
+    "mix": ["hydro", "solar", "wind"],
+    "imports": ["0%", "10%", "20%", "30%"],
+    "pv": ["none", "new-non-residential", "all-non-residential", "all-new", "all"],
+    "tradeoffs": ["none", "alpine", "agricultural", "forests", "rivers", "lakes"],
+    "distribution": ["none", "potential-based", "equal-pp", "min-limit", "max-limit"]
+}
+
+attribute_levels_heat = {
+    "year": ["2050", "2045", "2040", "2035", "2030"],
+    "tax": ["0%", "25%", "50%", "75%", "100%"],
+    "ban": ["none", "new", "all"],
+    "heatpump": ["subsidy", "lease", "subscription"],
+    "energyclass": ["new-only-efficient", "new-efficient-renewable",
+                    "all-retrofit", "all-retrofit-renewable"],
+    "exemption": ["none", "low", "low-mid"]
+}
+
+experiments = {
+    "pv": {"attributes": attributes_pv,
+           "baselines": baselines_pv,
+           "translate_dict": translate_dict_pv,
+           "attribute_levels": attribute_levels_pv},
+    "heat": {"attributes": attributes_heat,
+             "baselines": baselines_heat,
+             "translate_dict": translate_dict_heat,
+             "attribute_levels": attribute_levels_heat}
+}
+
+model_variants = ["hierarchical", "centered", "pooled", "spatial"]
+
+# layouts of the design data in the likelihood: one-hot dummies of both 
+# packages, their difference, or the design column of each attribute
+model_formulations = ["dense", "difference", "gather"]
+
+
+def encode_dummies(df, attributes, baselines, encoder=None):
+    """
+    One-hot encode the attribute levels with the baseline level first.
+
+    Parameters:
+    - df: stacked conjoint DataFrame with one column per attribute
+    - attributes: list of attribute column names
+    - baselines: list of 'attribute:level' strings
+    - encoder: encoder as returned by fit_encoder, fitted on df if None
+
+    Returns:
+    - df with categorical attribute and canton columns
+    - DataFrame of dummies with one column per attribute level
+    - the encoder, to encode new choice tables consistently
+    """
+    if encoder is None:
+        encoder = fit_encoder(attributes, baselines, df)
+
+    # dummies with the baseline first for each attribute
+    dummies = encode_design(encoder, df, format="dense")
+
+    for attr in attributes:
+        df[attr] = pd.Categorical(level_labels(df[attr]), 
+                                  categories=encoder["levels"][attr], 
+                                  ordered=True)
+    df["canton"] = pd.Categorical.from_codes(encode_cantons(encoder, df), 
+                                             categories=encoder["cantons"])
+
+    return df, dummies, encoder
+
+
+def prepare_model_data(df, experiment, encoder=None):
+    """
+    Translate the attribute levels of a stacked conjoint table to the 
+    model names and one-hot encode them.
+
+    Parameters:
+    - df: stacked conjoint DataFrame as written by prep_conjoint
+    - experiment: 'pv' or 'heat'
+    - encoder: encoder as returned by fit_encoder, fitted on df if None
+
+    Returns:
+    - df, dummies and encoder as returned by encode_dummies
+    """
+    df = apply_mapping(df, experiments[experiment]["translate_dict"])
+
+    # baseline first for each attribute
+    return encode_dummies(df, 
+                          experiments[experiment]["attributes"], 
+                          experiments[experiment]["baselines"], 
+                          encoder = encoder)
+
+
+def float_mode(dtype="float32"):
+    """
+    Context manager building and sampling models in the given float type.
+
+    Parameters, the data weights and the stored trace all take this type, 
+    e.g. 
+    with float_mode("float32"):
+        model = build_model(df, dummies)
+        inference_data = pm.sample(model = model)
+    """
+    return pytensor.config.change_flags(floatX=dtype)
+
+
+def choice_arrays(df, dummies, formulation="dense"):
+    """
+    Arrange a stacked conjoint table as the data of the model, one entry 
+    per choice task. Used by build_model and to swap data with pm.set_data.
+
+    Parameters:
+    - df: stacked conjoint DataFrame as returned by encode_dummies
+    - dummies: DataFrame of attribute level dummies as returned by encode_dummies
+    - formulation: design layout, one of model_formulations
+
+    Returns:
+    - dictionary of the pm.Data names 'c', 'observed_choice_left' and the 
+    design to arrays: 'attribute_levels_left' and 'attribute_levels_right' 
+    for 'dense', 'attribute_levels_difference' for 'difference', or 
+    'level_index_left' and 'level_index_right' of shape (tasks, attributes)
+    for 'gather', and 'weight' if df has respondent weights
+    """
+    if formulation not in model_formulations:
+        raise ValueError(f"formulation should be one of {model_formulations}.")
+    left = (df.pack_num_cat == "Left").values
+    right = (df.pack_num_cat == "Right").values
+    data = {"c": df.loc[left, "canton"].cat.codes.values,
+            "observed_choice_left": df.loc[left, "Y"].values.astype(np.int8)}
+    # one-hot dummies as int8, multiplied with the parameters they take 
+    # their float type instead of being upcast to float64
+    design_left = dummies[left].values.astype(np.int8)
+    design_right = dummies[right].values.astype(np.int8)
+    if formulation == "dense":
+        data["attribute_levels_left"] = design_left
+        data["attribute_levels_right"] = design_right
+    elif formulation == "difference":
+        data["attribute_levels_difference"] = design_left - design_right
+    else:
+        # one level per attribute, the nonzero columns of each row in order
+        n_attributes = int(design_left[0].sum()) if len(design_left) else 0
+        data["level_index_left"] = np.nonzero(design_left)[1].reshape(-1, n_attributes).astype(np.int16)
+        data["level_index_right"] = np.nonzero(design_right)[1].reshape(-1, n_attributes).astype(np.int16)
+    if "weight" in df:
+        data["weight"] = df.loc[left, "weight"].values
+    return data
+
+
+def collapse_choice_sets(data):
+    """
+    Group identical choice sets, the same canton, left and right design, 
+    into binomial trials. The Binomial likelihood of the sets equals the 
+    Bernoulli likelihood of the tasks up to a constant, so the posterior 
+    is the same with fewer likelihood terms.
+
+    Parameters:
+    - data: dictionary of tasks as returned by choice_arrays
+
+    Returns:
+    - dictionary with one entry per unique choice set of 'c' and the 
+    design arrays, the number of 
+    'trials', the number of left choices in 'observed_choice_left', and if 
+    the tasks have weights, the summed 'weight' and left choice weight 
+    'weight_left'
+    """
+    # design arrays of any formulation, one row per task
+    designs = [name for name, values in data.items() if values.ndim == 2]
+    keys = np.column_stack([data["c"].astype(np.int16)] + [data[name] for name in designs])
+    _, first, sets = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    sets = sets.ravel()
+    n_sets = len(first)
+
+    collapsed = {"c": data["c"][first],
+                 "trials": np.bincount(sets, minlength=n_sets).astype(np.int32),
+                 "observed_choice_left": np.bincount(sets, weights=data["observed_choice_left"], 
+                                                     minlength=n_sets).astype(np.int32),
+                 **{name: data[name][first] for name in designs}}
+    if "weight" in data:
+        collapsed["weight"] = np.bincount(sets, weights=data["weight"], minlength=n_sets)
+        collapsed["weight_left"] = np.bincount(sets, weights=data["weight"] * data["observed_choice_left"], 
+                                               minlength=n_sets)
+    return collapsed
+
+
+def compression_report(data):
+    """
+    Report how many likelihood terms collapsing the choice sets saves.
+
+    Parameters:
+    - data: dictionary as returned by collapse_choice_sets
+
+    Returns:
+    - dictionary with the number of 'tasks', 'choice_sets' and the 
+    'compression_ratio' of tasks per choice set
+    """
+    tasks = int(data["trials"].sum())
+    return {"tasks": tasks,
+            "choice_sets": len(data["trials"]),
+            "compression_ratio": round(tasks / len(data["trials"]), 3)}
+
+
+def build_model(df, dummies, variant="hierarchical", weighted=False, collapsed=False, adjacency=None, 
+                formulation="dense"):
+    """
+    Build the cantonal choice model.
+
+    Parameters:
+    - df: stacked conjoint DataFrame as returned by encode_dummies
+    - dummies: DataFrame of attribute level dummies as returned by encode_dummies
+    - variant: 'hierarchical' for the non-centered cantonal model, 
+    'centered' for the same model with centered canton effects, 
+    'pooled' for a model without canton effects, or 'spatial' for BYM2 
+    canton effects that mix independent and neighbour-smoothed (ICAR) parts
+    - weighted: if True, weight each task's log-likelihood by the 
+    respondent's raking weight in df['weight'] (pseudo-likelihood)
+    - collapsed: if True, group identical choice sets per canton with 
+    collapse_choice_sets and use a Binomial likelihood over the sets, 
+    along the 'choice_set' instead of the 'task' dimension
+    - adjacency: sparse canton adjacency in the order of the canton 
+    categories for the 'spatial' variant, read with canton_adjacency if None
+    - formulation: 'dense' multiplies the one-hot dummies of both packages 
+    with the partworths, 'difference' their difference and 'gather' sums 
+    the partworths of each package's levels by index, see choice_arrays; 
+    the package utilities are only stored for 'dense' and 'gather'
+
+    Returns:
+    - pymc Model
+    """
+    if variant not in model_variants:
+        raise ValueError(f"variant should be one of {model_variants}.")
+    if weighted and "weight" not in df:
+        raise ValueError("weighted model needs a 'weight' column, see weight_respondents.")
+
+    data = choice_arrays(df, dummies, formulation)
+    task = "task"
+    if collapsed:
+        data = collapse_choice_sets(data)
+        task = "choice_set"
+
+    #TODO add task dimension but doesn't yet exist in the data maybe add in the dataframe itself
+    coords = {"level": dummies.columns.values, 
+              "canton": df["canton"].cat.categories,}
+
+    with pm.Model(coords = coords) as bayes_model: 
+        beta_mean = pm.Normal("beta_mean", 0, sigma = 2, dims = "level")
+
+        if variant == "hierarchical":
+            canton_mean = pm.Normal(
+                "canton_mean", 
+                0, 
+                sigma = 1, 
+                dims = ["canton", "level"])
+
+            canton_sigma = pm.Exponential(
+                "canton_sigma", 
+                1, 
+                dims = "level")
+
+            canton_effect = pm.Deterministic(
+                "canton_effect", 
+                canton_mean * canton_sigma,
+                dims = ["canton", "level"])
+
+        elif variant == "centered":
+            canton_sigma = pm.Exponential(
+                "canton_sigma", 
+                1, 
+                dims = "level")
+
+            canton_effect = pm.Normal(
+                "canton_effect", 
+                0, 
+                sigma = canton_sigma, 
+                dims = ["canton", "level"])
+
+        elif variant == "spatial":
+            if adjacency is None:
+                adjacency = canton_adjacency(coords["canton"])
+            node1, node2 = icar_edges(adjacency)
+
+            canton_sigma = pm.Exponential(
+                "canton_sigma", 
+                1, 
+                dims = "level")
+
+            # share of the canton variance that is spatially structured
+            spatial_share = pm.Beta(
+                "spatial_share", 
+                0.5, 
+                0.5, 
+                dims = "level")
+
+            canton_mean = pm.Normal(
+                "canton_mean", 
+                0, 
+                sigma = 1, 
+                dims = ["canton", "level"])
+
+            # ICAR prior evaluated over the edges only, sampled on the 
+            # cantons summing to zero exactly, a soft constraint slows NUTS
+            canton_spatial = pm.Flat(
+                "canton_spatial", 
+                dims = ["canton", "level"], 
+                transform = ZeroSumTransform([-2]))
+            pm.Potential("canton_spatial_icar", 
+                         icar_logp(canton_spatial, node1, node2, zero_sum_sd = None))
+
+            canton_effect = pm.Deterministic(
+                "canton_effect", 
+                canton_sigma * (pm.math.sqrt(1 - spatial_share) * canton_mean + 
+                                pm.math.sqrt(spatial_share / bym2_scale(adjacency)) * canton_spatial),
+                dims = ["canton", "level"])
+
+        else:
+            canton_effect = pt.zeros((len(coords["canton"]), len(coords["level"])))
+
+        # column of which canton index per task
+        c = pm.Data(
+            "c", 
+            data["c"], 
+            dims = task
+        )
+
+        beta = pm.Deterministic(
+            "beta", 
+            beta_mean + canton_effect, 
+            dims = ["canton", "level"]
+        )
+
+        observed_choice_left = pm.Data(
+            "observed_choice_left", 
+            data["observed_choice_left"], 
+            dims = task
+        )
+
+        if collapsed:
+            # tasks per choice set, observed_choice_left counts the left choices
+            trials = pm.Data(
+                "trials", 
+                data["trials"], 
+                dims = task
+            )
+
+        if formulation == "difference":
+            attribute_levels_difference = pm.Data(
+                "attribute_levels_difference", 
+                data["attribute_levels_difference"], 
+                dims = [task, "level"])
+
+            # the likelihood uses the utility difference as logit, which 
+            # stays finite where the probability rounds to 0 or 1, e.g. in float32
+            utility_difference = pm.math.sum(attribute_levels_difference * beta[c, :], axis = 1)
+
+            probability_choice_left = pm.Deterministic(
+                "probability_choice_left", 
+                pm.math.sigmoid(utility_difference))
+
+        else:
+            if formulation == "gather":
+                # partworth of each attribute's level, summed per package
+                level_index_left = pm.Data(
+                    "level_index_left", 
+                    data["level_index_left"], 
+                    dims = [task, "attribute"])
+                utility_left = pm.math.sum(beta[c[:, None], level_index_left], axis = 1)
+
+                level_index_right = pm.Data(
+                    "level_index_right", 
+                    data["level_index_right"], 
+                    dims = [task, "attribute"])
+                utility_right = pm.math.sum(beta[c[:, None], level_index_right], axis = 1)
+            else:
+                attribute_levels_left = pm.Data(
+                    "attribute_levels_left", 
+                    data["attribute_levels_left"], 
+                    dims = [task, "level"])
+                utility_left = pm.math.sum(attribute_levels_left * beta[c, :], axis = 1)
+
+                attribute_levels_right = pm.Data(
+                    "attribute_levels_right", 
+                    data["attribute_levels_right"], 
+                    dims = [task, "level"])
+                utility_right = pm.math.sum(attribute_levels_right * beta[c, :], axis = 1)
+
+            utility_left = pm.Deterministic("utility_left", utility_left, dims = task)
+            utility_right = pm.Deterministic("utility_right", utility_right, dims = task)
+
+            probability_choice_left = pm.Deterministic(
+                "probability_choice_left", 
+                pm.math.exp(utility_left)/(pm.math.exp(utility_left)+pm.math.exp(utility_right)))
+
+            # the likelihood uses the utility difference as logit, which 
+            # stays finite where the probability rounds to 0 or 1, e.g. in float32
+            utility_difference = utility_left - utility_right
+
+        if weighted:
+            weight = pm.Data(
+                "weight", 
+                data["weight"], 
+                dims = task)
+
+            # weighted log-likelihood, the weights have mean one per canton
+            if collapsed:
+                # summed weights of the left and right choices of each set
+                weight_left = pm.Data(
+                    "weight_left", 
+                    data["weight_left"], 
+                    dims = task)
+                choice_distribution = pm.Potential(
+                    "choice_distirbution", 
+                    -weight_left * pm.math.log1pexp(-utility_difference) - 
+                    (weight - weight_left) * pm.math.log1pexp(utility_difference))
+            else:
+                choice_distribution = pm.Potential(
+                    "choice_distirbution", 
+                    weight * pm.logp(pm.Bernoulli.dist(logit_p = utility_difference), 
+                                     observed_choice_left))
+        elif collapsed:
+            choice_distribution = pm.Binomial(
+                "choice_distirbution", 
+                n = trials, 
+                logit_p = utility_difference, 
+                observed = observed_choice_left)
+        else:
+            choice_distribution = pm.Bernoulli(
+                "choice_distirbution",
+                logit_p = utility_difference, 
+                observed = observed_choice_left)
+
+    return bayes_model
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+from functions.survey_assist import (read_export, clean_export, flag_respondents,
+                                     drop_flagged, recode_demographics,
+                                     weight_respondents, translate_conjoints, respondent_columns,
+                                     heat_regex, pv_regex)
+from functions.conjoint_assist import prep_conjoint, respondent_table, read_conjoint
+from functions.weighting_assist import read_margins
+from functions.instrument_assist import stage
+from functions.registry_assist import settings_config
+from functions.resource_assist import limit_blas_threads
+
+
+experiment_regex = {"heat": heat_regex, "pv": pv_regex}
+
+stage_order = ["ingest", "clean", "prep", "fit", "summarize", "plot"]
+
+default_sampler_settings = {"draws": 1000, "tune": 500, "chains": 4, "cores": 4,
+                            "random_seed": 42, "target_accept": 0.9}
+
+# configuration stamps of the finished tasks, one json file per task
+stamp_dir = ".pipeline"
+
+
+def ingest(raw_path, output):
+    """
+    Read the Qualtrics export and store it as pickle.
+    """
+    read_export(raw_path).to_pickle(output)
+
+
+def clean(input, output, respondents_path, margins_path=None):
+    """
+    Clean, flag, recode, weight and translate the survey data and store it 
+    as pickle, and the respondent dimension table as csv.
+    """
+    df = pd.read_pickle(input)
+    df = clean_export(df)
+    df = flag_respondents(df)
+    df = drop_flagged(df)
+    df = recode_demographics(df)
+    margins = read_margins(margins_path) if margins_path and os.path.exists(margins_path) else None
+    df = weight_respondents(df, margins=margins)
+    df = translate_conjoints(df)
+    df.to_pickle(output)
+    respondent_table(df[respondent_columns]).to_csv(respondents_path, index=False)
+
+
+def prep(input, respondents_path, experiment, output_dir):
+    """
+    Stack the conjoint data of one experiment to long format, keyed to the
+    respondent dimension table.
+    """
+    df = pd.read_pickle(input)
+    prep_conjoint(df, respondent_columns=pd.read_csv(respondents_path),
+                  regex_list=experiment_regex[experiment],
+                  filemarker=experiment, output_dir=output_dir, layout='star')
+
+
+def fit(input, experiment, output, variant, sampler_settings, weighted=False, adaptive=None):
+    """
+    Fit the cantonal model to one experiment and save the InferenceData.
+
+    Fits are registered in the fit registry, a fit of the same data and
+    configuration is copied from there instead of sampling again. The 
+    runner calls fit whenever the stacked data or the configuration changed,
+    so the registry decides whether to sample. With adaptive, a dictionary 
+    of keyword arguments of adaptive_sample such as time_budget_s, the 
+    draws in sampler_settings are sampled in blocks until the convergence 
+    targets are met.
+    """
+    # pymc is only needed for this stage
+    import pymc as pm
+    from functions.model_assist import prepare_model_data, build_model
+    from functions.design_assist import attach_encoder
+    from functions.sampling_assist import adaptive_sample
+    from functions.registry_assist import fit_config, fit_key, find_fit, save_fit
+
+    df = read_conjoint(input)
+    config = fit_config(df, experiment, variant, sampler_settings, weighted=weighted, adaptive=adaptive)
+    key = fit_key(config)
+    registered = find_fit(key)
+    if registered:
+        print(f"fit[{experiment}]: registered fit {registered}")
+        shutil.copyfile(registered, output)
+        return
+
+    df, dummies, encoder = prepare_model_data(df, experiment)
+    bayes_model = build_model(df, dummies, variant=variant, weighted=weighted)
+    start = time.perf_counter()
+    if adaptive is None:
+        inference_data = pm.sample(model=bayes_model, progressbar=False, **sampler_settings)
+    else:
+        settings = {**sampler_settings}
+        inference_data = adaptive_sample(bayes_model, block_draws=settings.pop("draws"),
+                                         **adaptive, **settings)
+    sample_s = time.perf_counter() - start
+    attach_encoder(inference_data, encoder)
+    shutil.copyfile(save_fit(inference_data, key, config, timings={"sample_s": round(sample_s, 3)}),
+                    output)
+
+
+def summarize(input, output):
+    """
+    Summarise the posterior partworth utilities per canton and level to csv.
+    """
+    import arviz as az
+    from functions.posterior_assist import cantonal_beta_table
+
+    cantonal_beta_table(az.from_netcdf(input)).to_csv(output, index=False)
+
+
+def plot(input, experiment, output_dir):
+    """
+    Plot the cantonal maps and the level chart of one experiment.
+    """
+    # plotting dependencies are only needed for this stage
+    import matplotlib
+    matplotlib.use("Agg")
+    from functions.plot_assist import (load_cantons, plot_cantonal_beta_map,
+                                       beta_canton_chart, desired_orders, map_levels)
+
+    cantonal_beta = pd.read_csv(input)
+    cantons = load_cantons()
+    for attribute, levels in map_levels[experiment].items():
+        plot_cantonal_beta_map(cantons, cantonal_beta, levels, attribute, vmin=None,
+                               output_dir=output_dir, show=False)
+    beta_canton_chart(cantonal_beta, desired_orders[experiment]).save(
+        f"{output_dir}/beta_canton_plot_{experiment}.html")
+
+
+def pipeline_tasks(experiments,
+                   raw_path='raw_data/raw_conjoint_120624.csv',
+                   data_dir='data',
+                   output_dir='output',
+                   variant='hierarchical',
+                   sampler_settings=default_sampler_settings,
+                   weighted=False,
+                   adaptive=None):
+    """
+    Declare the pipeline stages as a DAG of tasks.
+
+    Parameters:
+    - experiments: list of experiments to run, 'pv' and/or 'heat'
+    - raw_path: path of the Qualtrics export
+    - data_dir: directory for intermediate and stacked data
+    - output_dir: directory for fits, summaries and plots
+    - variant: model variant passed on to build_model
+    - sampler_settings: keyword arguments passed on to pm.sample
+    - weighted: if True, fit the model with the respondents' raking weights
+    - adaptive: keyword arguments of adaptive_sample to sample in blocks of 
+    the sampler_settings draws until converged, or None for a single run
+
+    Returns:
+    - dictionary of task name to task, each a dictionary with the stage
+    'func', its 'kwargs', the 'inputs' and 'outputs' files and the names of
+    the tasks it depends on in 'deps', optionally the 'config' its outputs 
+    depend on besides the inputs, by default the kwargs
+    """
+    tasks = {
+        "ingest": {"func": ingest,
+                   "kwargs": {"raw_path": raw_path, "output": f"{data_dir}/raw.pkl"},
+                   "inputs": [raw_path],
+                   "outputs": [f"{data_dir}/raw.pkl"],
+                   "deps": []},
+        "clean": {"func": clean,
+                  "kwargs": {"input": f"{data_dir}/raw.pkl", "output": f"{data_dir}/clean.pkl",
+                             "respondents_path": f"{data_dir}/respondents.csv",
+                             "margins_path": f"{data_dir}/population_margins.csv"},
+                  "inputs": [f"{data_dir}/raw.pkl", f"{data_dir}/population_margins.csv"],
+                  "outputs": [f"{data_dir}/clean.pkl", f"{data_dir}/respondents.csv"],
+                  "deps": ["ingest"]},
+    }
+    for x in experiments:
+        stacked = f"{data_dir}/{x}-conjoint.csv"
+        fitted = f"{output_dir}/inference_data_{x}.nc"
+        summary = f"{output_dir}/cantonal_beta_{x}.csv"
+        tasks[f"prep[{x}]"] = {"func": prep,
+                               "kwargs": {"input": f"{data_dir}/clean.pkl", 
+                                          "respondents_path": f"{data_dir}/respondents.csv",
+                                          "experiment": x, "output_dir": data_dir},
+                               "inputs": [f"{data_dir}/clean.pkl", f"{data_dir}/respondents.csv"],
+                               "outputs": [stacked],
+                               "deps": ["clean"]}
+        tasks[f"fit[{x}]"] = {"func": fit,
+                              "kwargs": {"input": stacked, "experiment": x, "output": fitted,
+                                         "variant": variant, "sampler_settings": sampler_settings,
+                                         "weighted": weighted, "adaptive": adaptive},
+                              "inputs": [stacked, f"{data_dir}/respondents.csv"],
+                              "outputs": [fitted],
+                              # the fit registry's configuration, the data is
+                              # covered by the inputs
+                              "config": settings_config(x, variant, sampler_settings,
+                                                        weighted=weighted, adaptive=adaptive),
+                              "deps": [f"prep[{x}]"]}
+        tasks[f"summarize[{x}]"] = {"func": summarize,
+                                    "kwargs": {"input": fitted, "output": summary},
+                                    "inputs": [fitted],
+                                    "outputs": [summary],
+                                    "deps": [f"fit[{x}]"]}
+        tasks[f"plot[{x}]"] = {"func": plot,
+                               "kwargs": {"input": summary, "experiment": x,
+                                          "output_dir": output_dir},
+                               "inputs": [summary],
+                               "outputs": [f"{output_dir}/beta_canton_plot_{x}.html"],
+                               "deps": [f"summarize[{x}]"]}
+    return tasks
+
+
+def select_tasks(tasks, until):
+    """
+    Keep only the tasks up to and including a stage.
+
+    Parameters:
+    - tasks: dictionary as returned by pipeline_tasks
+    - until: last stage to run, one of stage_order
+
+    Returns:
+    - dictionary with the selected tasks
+    """
+    keep = stage_order[:stage_order.index(until) + 1]
+    return {name: task for name, task in tasks.items() if name.split("[")[0] in keep}
+
+
+def task_stamp(task):
+    """
+    Hash of the configuration a task's outputs depend on besides its inputs.
+    """
+    config = task.get("config", task["kwargs"])
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def write_stamp(name, task, directory=stamp_dir):
+    """
+    Record the configuration a task's outputs were created with.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(f"{directory}/{name}.json", "w") as f:
+        json.dump({"stamp": task_stamp(task), "outputs": task["outputs"]}, f, indent=2)
+
+
+def is_up_to_date(name, task, directory=stamp_dir):
+    """
+    Check whether all outputs of a task exist, are newer than its inputs and
+    were created with the same configuration.
+    """
+    if not all(os.path.exists(path) for path in task["outputs"]):
+        return False
+    try:
+        with open(f"{directory}/{name}.json") as f:
+            if json.load(f)["stamp"] != task_stamp(task):
+                return False
+    except FileNotFoundError:
+        return False
+    inputs = [os.path.getmtime(path) for path in task["inputs"] if os.path.exists(path)]
+    oldest_output = min(os.path.getmtime(path) for path in task["outputs"])
+    return not inputs or oldest_output >= max(inputs)
+
+
+def run_task(name, func, kwargs):
+    """
+    Run one task and return its stage record, used in the worker processes.
+    """
+    with stage(name, report={"stages": []}) as record:
+        func(**kwargs)
+    return record
+
+
+def run_pipeline(tasks, jobs=1, force=False, report=None, blas_threads=None):
+    """
+    Run a DAG of tasks, running independent tasks in parallel and
+    skipping tasks whose outputs are up to date. A task whose configuration
+    changed, e.g. the sampler settings of a fit, runs again.
+
+    Parameters:
+    - tasks: dictionary as returned by pipeline_tasks
+    - jobs: number of tasks run at the same time in separate processes
+    - force: if True, run all tasks even if their outputs are up to date
+    - report: run report the stage records are added to, e.g. from start_run
+    - blas_threads: BLAS threads per worker process, see core_layout, or 
+    None to leave the libraries' defaults
+
+    Returns:
+    - dictionary of task name to status: 'done', 'skipped', 'failed' or
+    'blocked' if a dependency failed
+    """
+    for name, task in tasks.items():
+        missing = [dep for dep in task["deps"] if dep not in tasks]
+        if missing:
+            raise ValueError(f"Task {name} depends on undeclared tasks {missing}.")
+
+    status = {}
+    running = {}
+    initializer = None if blas_threads is None else limit_blas_threads
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer,
+                             initargs=() if blas_threads is None else (blas_threads,)) as pool:
+        while len(status) < len(tasks):
+            # submit every task whose dependencies are finished
+            for name, task in tasks.items():
+                if name in status or name in running.values():
+                    continue
+                deps = [status.get(dep) for dep in task["deps"]]
+                if any(dep in ("failed", "blocked") for dep in deps):
+                    status[name] = "blocked"
+                elif all(dep in ("done", "skipped") for dep in deps):
+                    # a dependency that ran makes its outputs newer, so the mtimes decide
+                    if not force and is_up_to_date(name, task):
+                        status[name] = "skipped"
+                        print(f"{name}: up to date, skipped")
+                    else:
+                        print(f"{name}: started")
+                        running[pool.submit(run_task, name, task["func"], task["kwargs"])] = name
+
+            if not running:
+                if len(status) < len(tasks):
+                    raise ValueError("Tasks have circular dependencies.")
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    record = future.result()
+                except Exception as error:
+                    status[name] = "failed"
+                    print(f"{name}: failed with {error!r}")
+                    continue
+                status[name] = "done"
+                write_stamp(name, tasks[name])
+                print(f"{name}: done in {record['wall_s']} s")
+                if report is not None:
+                    report["stages"].append(record)
+
+    return status
@@ -0,0 +1,197 @@
+import os
+import geopandas as gpd
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+import altair as alt
+import numpy as np
+
+
+# attribute level order for plotting
+desired_order_pv = [
+    "mix_hydro", 
+    "mix_solar", 
+    "mix_wind",
+    "imports_0%",
+    "imports_10%",
+    "imports_20%",
+    "imports_30%",
+    "pv_none",
+    "pv_new-non-residential",
+    "pv_all-non-residential",
+    "pv_all-new",
+    "pv_all",
+    "tradeoffs_none",
+    "tradeoffs_alpine",
+    "tradeoffs_agricultural",
+    "tradeoffs_lakes",
+    "tradeoffs_rivers",
+    "tradeoffs_forests",
+    "distribution_none",
+    "distribution_potential-based",
+    "distribution_equal-pp",
+    "distribution_min-limit",
+    "distribution_max-limit"
+    ]
+
+desired_order_heat = [
+    "year_2050",
+    "year_2045",
+    "year_2040",
+    "year_2035",
+    "year_2030",
+    "tax_0%",
+    "tax_25%",
+    "tax_50%",
+    "tax_75%",
+    "tax_100%",
+    "ban_none",
+    "ban_new",
+    "ban_all",
+    "heatpump_subsidy", 
+    "heatpump_lease", 
+    "heatpump_subscription",
+    "energyclass_new-only-efficient",
+    "energyclass_new-efficient-renewable", 
+    "energyclass_all-retrofit",
+    "energyclass_all-retrofit-renewable",
+    "exemption_none",
+    "exemption_low",
+    "exemption_low-mid"
+]
+
+desired_orders = {"pv": desired_order_pv, "heat": desired_order_heat}
+
+# attribute levels shown side by side on the cantonal maps, per experiment
+map_levels = {
+    "pv": {
+        "distribution": ["distribution_none", "distribution_potential-based",
+                         "distribution_equal-pp", "distribution_max-limit"],
+        "tradeoffs": ["tradeoffs_none", "tradeoffs_forests",
+                      "tradeoffs_alpine", "tradeoffs_lakes"],
+        "imports": ["imports_0%", "imports_10%", "imports_20%", "imports_30%"],
+    },
+    "heat": {
+        "year": ["year_2030", "year_2040", "year_2050"],
+        "tax": ["tax_0%", "tax_50%", "tax_100%"],
+        "ban": ["ban_none", "ban_new", "ban_all"],
+        "exemption": ["exemption_none", "exemption_low", "exemption_low-mid"],
+    },
+}
+
+
+def load_cantons(shapefile="raw_data/swissBOUNDARIES3D_1_5_TLM_KANTONSGEBIET.shp", 
+                 geojson="data/swiss_cantons.geojson"):
+    """
+    Load the cantonal boundaries in WGS84, caching them as GeoJSON.
+
+    Parameters:
+    - shapefile: swissBOUNDARIES3D canton shapefile from 
+    https://www.swisstopo.admin.ch/de/landschaftsmodell-swissboundaries3d
+    - geojson: path of the cached GeoJSON, reused if it exists
+
+    Returns:
+    - GeoDataFrame with one row per canton and the canton name in 'NAME'
+    """
+    if os.path.exists(geojson):
+        return gpd.read_file(geojson)
+
+    # Ensure that the data is projected to WGS84 (lat/lon)
+    cantons_gdf = gpd.read_file(shapefile, engine = "pyogrio")
+    cantons_gdf = cantons_gdf.to_crs(epsg=4326)
+
+    # Convert to GeoJSON and save
+    cantons_gdf.to_file(geojson, driver="GeoJSON", engine = "pyogrio")
+    return cantons_gdf
+
+
+def plot_cantonal_beta_map(cantons, cantonal_beta, levels, filename_suffix, 
+                           cmap=plt.cm.coolwarm.reversed(), vmin=-0.4, vmax=None, 
+                           output_dir="output", show=True):
+    """
+    Plot maps for each level and saves the figure with a given filename_suffix.
+
+    Parameters:
+        cantons (GeoDataFrame): Cantonal boundaries as returned by load_cantons.
+        cantonal_beta (DataFrame): Partworth utilities as returned by cantonal_beta_table.
+        levels (list): Level names to plot, one map each.
+        filename_suffix (str): Prefix for the saved figure files.
+        cmap (Colormap): Colormap for the plot. Default is reversed coolwarm.
+        vmin (float): Minimum value for normalization. Default is -0.4.
+        vmax (float): Maximum value for normalization. Default is computed from data.
+        output_dir (str): Directory the figure is saved to.
+        show (bool): Whether to show the figure, otherwise it is closed.
+    """
+    levels_dict = {level: cantonal_beta[cantonal_beta['level'] == level] for level in levels}
+
+    # compute vmin and vmax if not provided
+    if vmin is None:
+        vmin = min(df['beta'].min() for df in levels_dict.values())
+
+    if vmax is None:
+        vmax = max(df['beta'].max() for df in levels_dict.values())
+
+    norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
+    num_levels = len(levels_dict)
+    if num_levels <= 3:
+        rows = 1
+        cols = num_levels 
+    else:
+        rows = 2  
+        cols = (num_levels + 1) // 2 if num_levels % 2 != 0 else num_levels // 2 
+    fig, axes = plt.subplots(rows, cols, figsize=(15, rows * 6), constrained_layout=True)
+
+    # flatten axes for easier iteration, if only one row adjust to single dimension
+    if rows == 1:
+        axes = np.array(axes)
+
+    # Iterate over levels and plot each map
+    for ax, (level_name, beta_level) in zip(axes.flat, levels_dict.items()):
+        # Merge data for the specific level
+        merged_df = cantons.merge(beta_level, left_on="NAME", right_on="canton", how="left")
+
+        # Plot map
+        merged_df.plot(column='beta', cmap=cmap, legend=False, ax=ax, norm=norm)
+        ax.set_title(level_name.replace("_", " ").capitalize(), fontsize=14)
+        ax.axis("off")  # Turn off axis for clean visualization
+
+    # Hide unused subplots
+    for ax in axes.flat[len(levels_dict):]:
+        ax.axis("off")
+
+    # Add one common color bar
+    cbar = fig.colorbar(
+        plt.cm.ScalarMappable(norm=norm, cmap=cmap), ax=axes, orientation='horizontal',
+        fraction=0.03, pad=0.1
+    )
+    cbar.set_label("Partworth utility", fontsize=12)
+
+    # Save the figure
+    plt.savefig(f"{output_dir}/cantonal_{filename_suffix}.png", dpi=300)
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+
+
+def beta_canton_chart(cantonal_beta, desired_order):
+    """
+    Dot plot of the cantonal partworth utilities per attribute level.
+
+    Parameters:
+    - cantonal_beta: DataFrame as returned by cantonal_beta_table
+    - desired_order: list of level names in plotting order
+
+    Returns:
+    - altair Chart
+    """
+    return alt.Chart(cantonal_beta).encode(
+        # quantitative axis for beta values
+        x='beta:Q',
+        # each level on separate row
+        y=alt.Y('level:N', sort=desired_order), 
+        # use a single color for all cantons
+        color=alt.value("steelblue")
+    #     color='canton:N',  # Color each canton differently
+    ).mark_circle(size=30, opacity=0.8).properties(
+        width=600,
+    )
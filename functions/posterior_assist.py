@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import xarray as xr
+from functions.design_assist import encode_design, encoder_from_inference_data
+
+
+def cantonal_beta_table(inference_data):
+    """
+    Summarise the posterior partworth utilities per canton and level.
+
+    Parameters:
+    - inference_data: InferenceData with 'canton_effect' and 'beta_mean'
+
+    Returns:
+    - DataFrame with columns 'canton', 'level', 'cantonal_beta' (cantonal 
+    variability, gamma), 'beta_mean' (national mean, alpha) and 'beta' 
+    (total canton dependent partworth utility)
+    """
+    # cantonal variability (gamma)
+    cantonal_beta = inference_data["posterior"]["canton_effect"].mean(["chain", "draw"])
+    cantonal_beta = cantonal_beta.to_dataframe(name="cantonal_beta").reset_index()
+
+    # national means (alpha)
+    beta_mean = inference_data["posterior"]["beta_mean"].mean(["chain", "draw"])
+    beta_mean = beta_mean.to_dataframe(name="beta_mean").reset_index()
+    cantonal_beta = cantonal_beta.merge(beta_mean, 
+                                        on = "level", 
+                                        how = "left")
+
+    # add total pathworth utilities (canton dependent)
+    cantonal_beta["beta"] = cantonal_beta["cantonal_beta"] + cantonal_beta["beta_mean"]
+
+    return cantonal_beta[["canton", "level", "cantonal_beta", "beta_mean", "beta"]]
+
+
+def fit_fingerprint(inference_data, var_name="beta"):
+    """
+    Identify a fit by a hash of its posterior draws of one variable.
+
+    Parameters:
+    - inference_data: InferenceData with a posterior group
+    - var_name: posterior variable to hash
+
+    Returns:
+    - hex digest string
+    """
+    values = np.ascontiguousarray(inference_data.posterior[var_name].values)
+    return hashlib.sha1(values.tobytes() + str(values.shape).encode()).hexdigest()
+
+
+def package_table(encoder, packages):
+    """
+    Complete policy packages with the baseline level of missing attributes.
+
+    Parameters:
+    - encoder: dictionary as returned by fit_encoder
+    - packages: DataFrame with one row per package and attribute columns,
+    or a dictionary of package name to dictionary of attribute levels
+
+    Returns:
+    - DataFrame with one row per package and one column per attribute
+    """
+    if isinstance(packages, dict):
+        packages = pd.DataFrame(list(packages.values()), index=list(packages))
+    packages = packages.copy()
+    for attr in encoder["attributes"]:
+        baseline = encoder["levels"][attr][0]
+        packages[attr] = packages[attr].fillna(baseline) if attr in packages else baseline
+    return packages[encoder["attributes"]]
+
+
+def single_change_packages(encoder):
+    """
+    Packages that differ from the all-baseline package in one attribute.
+
+    Against the all-baseline reference, their support is the choice 
+    probability of a single level over its baseline, everything else equal.
+
+    Parameters:
+    - encoder: dictionary as returned by fit_encoder
+
+    Returns:
+    - DataFrame with one package per non-baseline level, named 'attribute_level'
+    """
+    packages = {}
+    for attr in encoder["attributes"]:
+        for level in encoder["levels"][attr][1:]:
+            packages[f"{attr}_{level}"] = {attr: level}
+    return package_table(encoder, packages)
+
+
+# simulated support of recent fits, keyed by fit fingerprint and package
+# settings, the least recently used results are dropped beyond
+# support_cache_size; registered fits also keep theirs next to the netcdf file
+support_cache = OrderedDict()
+support_cache_size = 8
+
+
+def support_path(inference_data, key):
+    """
+    Path of the cached support of a registered fit, in a directory next to
+    its netcdf file named after the fit.
+
+    Parameters:
+    - inference_data: InferenceData, registered with save_fit
+    - key: tuple of the fit fingerprint and the package settings
+
+    Returns:
+    - path of the netcdf file, or None if the fit isn't registered
+    """
+    metadata = inference_data.posterior.attrs.get("fit_registry")
+    if metadata is None:
+        return None
+    path = json.loads(metadata)["path"]
+    digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+    return f"{path[:-3]}-support/{digest}.nc"
+
+
+def simulate_support(inference_data,
+                     packages,
+                     reference=None,
+                     mode="pairwise",
+                     encoder=None,
+                     chunk_size=500,
+                     use_cache=True):
+    """
+    Simulate the support for policy packages in each canton and posterior draw.
+
+    With mode 'pairwise', the support of a package is the logit probability
+    that it is chosen over the reference package, as in the choice model
+    (Pr = exp(U) / (exp(U) + exp(U_reference))). With mode 'share', the
+    packages and the reference compete together and the support is their
+    logit choice share. All cantons and draws are computed as one batched
+    matrix product per chunk of draws, which bounds the memory used for
+    the utilities.
+
+    Parameters:
+    - inference_data: InferenceData with posterior 'beta' (canton x level)
+    - packages: packages as accepted by package_table
+    - reference: dictionary of attribute levels of the reference package,
+    missing attributes are set to their baseline, by default all baselines
+    - mode: 'pairwise' or 'share'
+    - encoder: encoder of the fit, by default the one stored in the fit
+    - chunk_size: number of draws computed at once
+    - use_cache: reuse results for the same fit, packages and settings,
+    from memory or, for registered fits, from disk
+
+    Returns:
+    - DataArray of support with dims ('sample', 'canton', 'package')
+    """
+    if mode not in ("pairwise", "share"):
+        raise ValueError("mode should be 'pairwise' or 'share'.")
+    if encoder is None:
+        encoder = encoder_from_inference_data(inference_data)
+
+    packages = package_table(encoder, packages)
+    reference = package_table(encoder, {"reference": reference or {}})
+
+    key = (fit_fingerprint(inference_data), packages.to_json(), reference.to_json(), mode)
+    path = support_path(inference_data, key)
+    if use_cache and key in support_cache:
+        support_cache.move_to_end(key)
+        return support_cache[key]
+    if use_cache and path is not None and os.path.exists(path):
+        support = xr.load_dataarray(path)
+        support = support.set_index(sample=("chain", "draw"))
+        remember_support(key, support)
+        return support
+
+    # design rows of the packages and the reference over the fitted levels
+    design = encode_design(encoder, packages, format="dense").loc[:, list(inference_data.posterior["level"].values)]
+    design = design.to_numpy(dtype=float)
+    reference_design = encode_design(encoder, reference, format="dense").loc[:, list(inference_data.posterior["level"].values)]
+    reference_design = reference_design.to_numpy(dtype=float)[0]
+
+    beta = inference_data.posterior["beta"].stack(sample=("chain", "draw")).transpose("sample", "canton", "level")
+    n_samples = beta.sizes["sample"]
+    support = np.empty((n_samples, beta.sizes["canton"], len(packages)))
+    for start in range(0, n_samples, chunk_size):
+        beta_chunk = beta[start:start + chunk_size].values
+        utility = beta_chunk @ design.T # sample x canton x package
+        utility_reference = beta_chunk @ reference_design # sample x canton
+        if mode == "pairwise":
+            support[start:start + chunk_size] = 1 / (1 + np.exp(utility_reference[..., None] - utility))
+        else:
+            # softmax over packages and reference, shifted by the maximum for stability
+            shift = np.maximum(utility.max(axis=-1), utility_reference)
+            weights = np.exp(utility - shift[..., None])
+            total = weights.sum(axis=-1) + np.exp(utility_reference - shift)
+            support[start:start + chunk_size] = weights / total[..., None]
+
+    support = xr.DataArray(support,
+                           dims=("sample", "canton", "package"),
+                           coords={"sample": beta["sample"],
+                                   "canton": beta["canton"].values,
+                                   "package": list(packages.index)},
+                           name="support")
+    if use_cache:
+        remember_support(key, support)
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            support.reset_index("sample").to_netcdf(path)
+    return support
+
+
+def remember_support(key, support):
+    """
+    Keep simulated support in support_cache, dropping the least recently
+    used results beyond support_cache_size.
+    """
+    support_cache[key] = support
+    support_cache.move_to_end(key)
+    while len(support_cache) > support_cache_size:
+        support_cache.popitem(last=False)
+
+
+def support_summary(support, interval=0.9):
+    """
+    Summarise simulated support per canton and package.
+
+    Parameters:
+    - support: DataArray as returned by simulate_support
+    - interval: probability mass of the central interval between 'lower' and 'upper'
+
+    Returns:
+    - DataFrame with columns 'canton', 'package', 'mean', 'lower' and 'upper'
+    """
+    tail = (1 - interval) / 2
+    summary = xr.Dataset({"mean": support.mean("sample"),
+                          "lower": support.quantile(tail, dim="sample").drop_vars("quantile"),
+                          "upper": support.quantile(1 - tail, dim="sample").drop_vars("quantile")})
+    return summary.to_dataframe().reset_index()
@@ -0,0 +1,144 @@
+import pandas as pd
+import numpy as np
+
+
+# thresholds for flagging respondents, None switches a criterion off
+quality_thresholds = {
+    # duration quantiles below / above which respondents are speeders / laggards
+    "speeder_quantile": 0.05,
+    "laggard_quantile": 0.95,
+    # absolute duration limits in minutes, applied on top of the quantiles
+    "min_duration_min": None,
+    "max_duration_min": None,
+    # inattentive if the same answer is given to all justice questions
+    "justice_straightlining": True,
+    # inattentive if the longest run of identical justice answers reaches this length
+    "max_justice_run": None,
+    # inattentive if the variance of the conjoint ratings is below this value
+    "min_rating_variance": None,
+}
+
+
+def grid_block(df, columns, labels):
+    """
+    Turn a grid of answers into a numeric NumPy block.
+
+    Answers are coded by their position in labels. Numeric answers, also
+    stored as strings as after recoding, are kept as they are. Any other
+    answer, e.g. "don't know", gets its own negative code, so it counts as
+    an answer that differs from the scale answers, as in the row-wise 
+    nunique. Empty cells are missing.
+
+    Parameters:
+    - df: pandas DataFrame
+    - columns: list of the grid columns, in question order
+    - labels: ordered answer labels, e.g. the likert scale
+
+    Returns:
+    - float array of shape (rows, columns) with negative codes for answers
+    off the scale and NaN for missing answers
+    """
+    values = df[columns].to_numpy()
+    if values.dtype.kind in 'biuf':
+        return values.astype(float)
+
+    # code the few distinct answers once and look them up for all cells
+    codes, uniques = pd.factorize(values.ravel())
+    label_codes = {label: i for i, label in enumerate(labels)}
+    lookup = pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce').to_numpy(dtype=float)
+    lookup = np.array([label_codes.get(u, numeric) for u, numeric in zip(uniques, lookup)], dtype=float)
+    other = np.isnan(lookup)
+    lookup[other] = -1.0 - np.arange(other.sum())
+    block = np.append(lookup, np.nan)[codes] # code -1 for missing maps to the appended NaN
+    return block.reshape(values.shape)
+
+
+def grid_metrics(block):
+    """
+    Compute answer pattern metrics for every row of a grid in one pass.
+
+    Parameters:
+    - block: float array of shape (rows, questions) as returned by grid_block
+
+    Returns:
+    - dictionary of arrays with one value per row: 'answered' (number of
+    answers), 'straightlining' (all answers identical), 'longest_run'
+    (longest run of identical consecutive answers) and 'variance' of the
+    answers on the scale, leaving out the negative codes of other answers
+    """
+    answered = (~np.isnan(block)).sum(axis=1)
+    has_answers = answered > 0
+
+    # rows without answers get NaN for min, max and variance, without warnings
+    filled_min = np.where(np.isnan(block), np.inf, block).min(axis=1, initial=np.inf)
+    filled_max = np.where(np.isnan(block), -np.inf, block).max(axis=1, initial=-np.inf)
+    straightlining = has_answers & (filled_min == filled_max)
+
+    # run length: position minus the start of the current run of identical answers
+    position = np.arange(block.shape[1])
+    same = np.zeros(block.shape, dtype=bool)
+    same[:, 1:] = block[:, 1:] == block[:, :-1] # NaN never equals, so missing answers end runs
+    run_start = np.maximum.accumulate(np.where(same, 0, position), axis=1)
+    run_length = np.where(np.isnan(block), 0, position - run_start + 1)
+    longest_run = run_length.max(axis=1) if block.shape[1] else np.zeros(len(block), dtype=int)
+
+    on_scale = ~np.isnan(block) & (block >= 0)
+    count = on_scale.sum(axis=1)
+    mean = np.where(on_scale, block, 0).sum(axis=1) / np.maximum(count, 1)
+    variance = (np.where(on_scale, block - mean[:, None], 0) ** 2).sum(axis=1) / np.maximum(count, 1)
+
+    return {"answered": answered,
+            "straightlining": straightlining,
+            "longest_run": longest_run,
+            "variance": np.where(count > 0, variance, np.nan)}
+
+
+def quality_flags(df, justice_columns, rating_columns, labels,
+                  duration_column='duration_min', thresholds=quality_thresholds):
+    """
+    Screen respondents on the justice and rating grids and on duration.
+
+    Parameters:
+    - df: pandas DataFrame with one row per respondent
+    - justice_columns: list of the justice grid columns
+    - rating_columns: list of the conjoint rating columns
+    - labels: ordered answer labels of both grids
+    - duration_column: column with the survey duration in minutes
+    - thresholds: dictionary of thresholds, missing keys fall back to
+    quality_thresholds
+
+    Returns:
+    - DataFrame with the same index as df and the metric columns
+    'justice_straightlining', 'justice_longest_run', 'justice_variance',
+    'rating_straightlining', 'rating_longest_run', 'rating_variance' and
+    the flags 'speeder', 'laggard' and 'inattentive'
+    """
+    thresholds = {**quality_thresholds, **thresholds}
+    result = pd.DataFrame(index=df.index)
+
+    for grid, columns in [("justice", justice_columns), ("rating", rating_columns)]:
+        metrics = grid_metrics(grid_block(df, columns, labels))
+        result[f"{grid}_straightlining"] = metrics["straightlining"]
+        result[f"{grid}_longest_run"] = metrics["longest_run"]
+        result[f"{grid}_variance"] = metrics["variance"]
+
+    duration = df[duration_column].to_numpy(dtype=float)
+    speeder = duration < np.nanquantile(duration, thresholds["speeder_quantile"])
+    laggard = duration > np.nanquantile(duration, thresholds["laggard_quantile"])
+    if thresholds["min_duration_min"] is not None:
+        speeder |= duration < thresholds["min_duration_min"]
+    if thresholds["max_duration_min"] is not None:
+        laggard |= duration > thresholds["max_duration_min"]
+
+    inattentive = np.zeros(len(df), dtype=bool)
+    if thresholds["justice_straightlining"]:
+        inattentive |= result["justice_straightlining"].to_numpy()
+    if thresholds["max_justice_run"] is not None:
+        inattentive |= result["justice_longest_run"].to_numpy() >= thresholds["max_justice_run"]
+    if thresholds["min_rating_variance"] is not None:
+        inattentive |= result["rating_variance"].to_numpy() < thresholds["min_rating_variance"]
+
+    result["speeder"] = speeder
+    result["laggard"] = laggard
+    result["inattentive"] = inattentive
+    return result
@@ -0,0 +1,275 @@
+import time
+import pandas as pd
+import numpy as np
+import arviz as az
+import pymc as pm
+from functions.synthetic_assist import canton_population
+from functions.survey_assist import demographics_dict
+from functions.model_assist import experiments, encode_dummies, build_model, float_mode
+
+
+# canton names as used in the model and the swissBOUNDARIES3D data
+cantons = [demographics_dict.get(canton, canton) for canton in canton_population]
+
+
+def true_parameters(experiment, beta_scale=0.5, canton_sigma=0.3, seed=42):
+    """
+    Draw known parameter values to simulate choices from.
+
+    Baseline levels are fixed at zero, since only differences to the
+    baseline are identified by the choice data.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - beta_scale: standard deviation of the national partworth utilities
+    - canton_sigma: standard deviation of the canton effects, a scalar or
+    one value per level
+    - seed: seed of the random number generator
+
+    Returns:
+    - dictionary with 'beta_mean' and 'canton_sigma' (Series over levels),
+    and 'canton_effect' and 'beta' (DataFrames of canton x level)
+    """
+    rng = np.random.default_rng(seed)
+    attribute_levels = experiments[experiment]["attribute_levels"]
+    levels = [f"{attr}_{level}" for attr, attr_levels in attribute_levels.items() for level in attr_levels]
+    is_baseline = np.array([level for attr_levels in attribute_levels.values()
+                            for level in [True] + [False] * (len(attr_levels) - 1)])
+
+    beta_mean = pd.Series(np.where(is_baseline, 0, rng.normal(0, beta_scale, len(levels))),
+                          index=levels)
+    sigma = pd.Series(np.where(is_baseline, 0, canton_sigma), index=levels)
+    canton_effect = pd.DataFrame(rng.normal(0, 1, (len(cantons), len(levels))) * sigma.values,
+                                 index=cantons, columns=levels)
+
+    return {"beta_mean": beta_mean,
+            "canton_sigma": sigma,
+            "canton_effect": canton_effect,
+            "beta": canton_effect + beta_mean}
+
+
+def simulate_choices(experiment, n_respondents, truth, n_tasks=7, seed=42):
+    """
+    Simulate stacked choice data in the format written by prep_conjoint.
+
+    Respondents are drawn from the 26 cantons in proportion to their
+    population. Each respondent sees n_tasks random pairs of packages and
+    a repeat of task 1 with the packages swapped, and chooses with logit
+    probabilities given by the true cantonal partworth utilities.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - n_respondents: number of respondents to simulate
+    - truth: dictionary as returned by true_parameters
+    - n_tasks: number of distinct choice tasks per respondent
+    - seed: seed of the random number generator
+
+    Returns:
+    - DataFrame with one row per package and task, with columns 'ID',
+    'task_num', 'pack_num', 'pack_num_cat', one column per attribute,
+    'choice', 'Y' and 'canton'
+    """
+    rng = np.random.default_rng(seed)
+    attribute_levels = experiments[experiment]["attribute_levels"]
+    n = n_respondents
+
+    weights = np.array(list(canton_population.values()), dtype=float)
+    canton = rng.choice(len(cantons), n, p=weights / weights.sum())
+
+    # level index per respondent, task and package, task 8 repeats task 1 swapped
+    utility = np.zeros((n, n_tasks + 1, 2))
+    level_idx = {}
+    for attr, levels in attribute_levels.items():
+        idx = rng.integers(0, len(levels), (n, n_tasks, 2))
+        idx = np.concatenate([idx, idx[:, :1, ::-1]], axis=1)
+        level_idx[attr] = idx
+        columns = [f"{attr}_{level}" for level in levels]
+        beta_attr = truth["beta"].loc[cantons, columns].values
+        utility += beta_attr[canton[:, None, None], idx]
+
+    p_left = 1 / (1 + np.exp(utility[..., 1] - utility[..., 0]))
+    choice = np.where(rng.random((n, n_tasks + 1)) < p_left, 1, 2)
+
+    # stack to one row per respondent, task and package
+    ids, tasks, packs = np.meshgrid(np.arange(1, n + 1), np.arange(1, n_tasks + 2), [1, 2], indexing="ij")
+    df = pd.DataFrame({
+        "ID": ids.ravel(),
+        "task_num": tasks.ravel(),
+        "pack_num": packs.ravel(),
+        "pack_num_cat": np.where(packs.ravel() == 1, "Left", "Right"),
+    })
+    for attr, levels in attribute_levels.items():
+        df[attr] = np.array(levels, dtype=object)[level_idx[attr].ravel()]
+    df["choice"] = np.repeat(choice.ravel(), 2)
+    df["Y"] = (df["pack_num"] == df["choice"]).astype(int)
+    df["canton"] = np.array(cantons, dtype=object)[np.repeat(canton, (n_tasks + 1) * 2)]
+
+    return df
+
+
+def baseline_contrast(values, levels, baselines):
+    """
+    Subtract the baseline level of each attribute along the last axis.
+
+    Parameters:
+    - values: array with levels along the last axis
+    - levels: list of level names 'attribute_level' of the last axis
+    - baselines: list of 'attribute:level' strings
+
+    Returns:
+    - array of the same shape with differences to the baseline level
+    """
+    levels = list(levels)
+    baseline_dict = {attr.split(":")[0]: attr.split(":")[1] for attr in baselines}
+    baseline_idx = [levels.index(f"{level.split('_', 1)[0]}_{baseline_dict[level.split('_', 1)[0]]}")
+                    for level in levels]
+    return values - values[..., baseline_idx]
+
+
+def recovery_error(inference_data, truth, baselines, hdi_prob=0.9):
+    """
+    Compare posterior estimates with the parameters the data was simulated from.
+
+    Partworth utilities are compared as differences to the baseline level,
+    since only these are identified.
+
+    Parameters:
+    - inference_data: InferenceData of a fit to simulated data
+    - truth: dictionary as returned by true_parameters
+    - baselines: list of 'attribute:level' strings
+    - hdi_prob: probability mass of the intervals used for the coverage
+
+    Returns:
+    - dictionary with RMSE and interval coverage of the national and
+    cantonal contrasts, and the RMSE of canton_sigma on non-baseline levels
+    """
+    posterior = inference_data.posterior
+    levels = posterior["level"].values
+    canton_names = posterior["canton"].values
+
+    beta_mean = baseline_contrast(posterior["beta_mean"].values, levels, baselines)
+    true_beta_mean = baseline_contrast(truth["beta_mean"].loc[levels].values, levels, baselines)
+    hdi = az.hdi(beta_mean, hdi_prob=hdi_prob)
+    covered = (hdi[:, 0] <= true_beta_mean) & (true_beta_mean <= hdi[:, 1])
+
+    beta = baseline_contrast(posterior["beta"].mean(["chain", "draw"]).values, levels, baselines)
+    true_beta = baseline_contrast(truth["beta"].loc[canton_names, levels].values, levels, baselines)
+
+    result = {
+        "rmse_beta_mean": float(np.sqrt(np.mean((beta_mean.mean(axis=(0, 1)) - true_beta_mean) ** 2))),
+        "coverage_beta_mean": float(covered.mean()),
+        "rmse_beta": float(np.sqrt(np.mean((beta - true_beta) ** 2))),
+    }
+    if "canton_sigma" in posterior:
+        non_baseline = truth["canton_sigma"].loc[levels].values > 0
+        sigma = posterior["canton_sigma"].mean(["chain", "draw"]).values
+        result["rmse_canton_sigma"] = float(np.sqrt(np.mean(
+            (sigma[non_baseline] - truth["canton_sigma"].loc[levels].values[non_baseline]) ** 2)))
+    return result
+
+
+def sampler_metrics(inference_data, sample_s, var_names=["beta_mean", "canton_sigma"]):
+    """
+    Summarise sampler efficiency and convergence of a fit.
+
+    Parameters:
+    - inference_data: InferenceData with posterior and sample_stats groups
+    - sample_s: wall time of sampling in seconds
+    - var_names: variables to compute R-hat and ESS for, missing ones are skipped
+
+    Returns:
+    - dictionary with minimum bulk and tail ESS, ESS per second, maximum
+    R-hat and the number of divergences
+    """
+    var_names = [var for var in var_names if var in inference_data.posterior]
+    summary = az.summary(inference_data, var_names=var_names, kind="diagnostics")
+    return {
+        "ess_bulk_min": float(summary["ess_bulk"].min()),
+        "ess_tail_min": float(summary["ess_tail"].min()),
+        "ess_bulk_per_s": float(summary["ess_bulk"].min() / sample_s),
+        "r_hat_max": float(summary["r_hat"].max()),
+        "divergences": int(inference_data.sample_stats["diverging"].sum()),
+    }
+
+
+def fit_simulated(experiment,
+                  n_respondents,
+                  truth,
+                  variant="hierarchical",
+                  sampler_settings={},
+                  seed=42,
+                  dtype="float64",
+                  return_inference_data=False):
+    """
+    Simulate choices, fit the model to them and report timing, efficiency
+    and recovery.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - n_respondents: number of respondents to simulate
+    - truth: dictionary as returned by true_parameters
+    - variant: model variant passed on to build_model
+    - sampler_settings: keyword arguments passed on to pm.sample
+    - seed: seed for simulation and sampling
+    - dtype: float type of the model, see float_mode
+    - return_inference_data: if True, also return the fit
+
+    Returns:
+    - dictionary with settings, timings, trace size, sampler metrics and 
+    recovery errors, and the InferenceData if return_inference_data is True
+    """
+    df = simulate_choices(experiment, n_respondents, truth, seed=seed)
+    df, dummies, encoder = encode_dummies(df, experiments[experiment]["attributes"],
+                                          experiments[experiment]["baselines"])
+
+    with float_mode(dtype):
+        start = time.perf_counter()
+        model = build_model(df, dummies, variant=variant)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        inference_data = pm.sample(model=model,
+                                   random_seed=seed,
+                                   progressbar=False,
+                                   **sampler_settings)
+        sample_s = time.perf_counter() - start
+
+    record = {"experiment": experiment,
+              "n_respondents": n_respondents,
+              "n_tasks": int((df.pack_num_cat == "Left").sum()),
+              "variant": variant,
+              "dtype": dtype,
+              **sampler_settings,
+              "build_s": round(build_s, 3),
+              "sample_s": round(sample_s, 3),
+              "trace_mb": round(inference_data.posterior.nbytes / 1e6, 2),
+              **sampler_metrics(inference_data, sample_s),
+              **recovery_error(inference_data, truth, experiments[experiment]["baselines"])}
+    if return_inference_data:
+        return record, inference_data
+    return record
+
+
+def posterior_agreement(inference_data, reference, var_name="beta"):
+    """
+    Compare the posterior of a variable between two fits of the same data,
+    e.g. in float32 and float64.
+
+    Parameters:
+    - inference_data: InferenceData of the fit to check
+    - reference: InferenceData of the reference fit
+    - var_name: variable to compare
+
+    Returns:
+    - dictionary with the largest difference of the posterior means in 
+    reference posterior standard deviations, and the smallest and largest 
+    ratio of the posterior standard deviations
+    """
+    values = inference_data.posterior[var_name].astype(float)
+    reference_values = reference.posterior[var_name].astype(float)
+    reference_sd = reference_values.std(["chain", "draw"])
+    mean_difference = abs(values.mean(["chain", "draw"]) - reference_values.mean(["chain", "draw"]))
+    sd_ratio = values.std(["chain", "draw"]) / reference_sd
+    return {f"{var_name}_max_mean_diff_sd": float((mean_difference / reference_sd).max()),
+            f"{var_name}_sd_ratio_min": float(sd_ratio.min()),
+            f"{var_name}_sd_ratio_max": float(sd_ratio.max())}
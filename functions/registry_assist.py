@@ -0,0 +1,176 @@
+import glob
+import hashlib
+import json
+import os
+from datetime import datetime
+import pandas as pd
+
+
+# directory of the registered fits, one netcdf and one json file per fit
+registry_dir = "output/fits"
+
+# sampler settings that don't change the draws and are left out of the key
+ignored_settings = ["cores", "progressbar"]
+
+
+def data_hash(df):
+    """
+    Hash the content of a stacked conjoint table, independent of its index.
+    """
+    values = pd.util.hash_pandas_object(df, index=False).values
+    columns = json.dumps([str(col) for col in df.columns]).encode()
+    return hashlib.sha1(values.tobytes() + columns).hexdigest()
+
+
+def settings_config(experiment, variant="hierarchical", sampler_settings={}, **options):
+    """
+    Collect the settings a fit depends on, everything but the data.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - variant: model variant passed on to build_model
+    - sampler_settings: keyword arguments passed on to pm.sample
+    - options: further model or sampling options, e.g. weighted, dtype or
+    the adaptive sampling settings
+
+    Returns:
+    - dictionary with the experiment, its attributes and baselines, the 
+    variant, the sampler settings and the options
+    """
+    # imported here, so looking up fits for plotting doesn't need pymc
+    from functions.model_assist import experiments
+
+    return {"experiment": experiment,
+            "attributes": experiments[experiment]["attributes"],
+            "baselines": experiments[experiment]["baselines"],
+            "variant": variant,
+            "sampler_settings": {key: value for key, value in sorted(sampler_settings.items())
+                                 if key not in ignored_settings},
+            **options}
+
+
+def fit_config(df, experiment, variant="hierarchical", sampler_settings={}, **options):
+    """
+    Collect everything a fit depends on.
+
+    Parameters:
+    - df: stacked conjoint DataFrame as read from the prep_conjoint csv
+    - experiment, variant, sampler_settings, options: as in settings_config
+
+    Returns:
+    - dictionary with the hash of the 'data' and the settings_config
+    """
+    return {"data": data_hash(df),
+            **settings_config(experiment, variant, sampler_settings, **options)}
+
+
+def fit_key(config):
+    """
+    Key of a fit: hash of the data and the fit configuration.
+
+    Parameters:
+    - config: dictionary as returned by fit_config
+
+    Returns:
+    - hexadecimal key of 16 characters
+    """
+    content = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+def fit_path(key, config, registry=registry_dir):
+    """
+    Path of the netcdf file of a fit, the json metadata shares its name.
+    """
+    return f"{registry}/{config['experiment']}-{config['variant']}-{key}.nc"
+
+
+def find_fit(key, registry=registry_dir):
+    """
+    Find a registered fit by key.
+
+    Returns:
+    - path of its netcdf file, or None if it isn't registered
+    """
+    paths = glob.glob(f"{registry}/*-{key}.nc")
+    paths = [path for path in paths if os.path.exists(path[:-3] + ".json")]
+    return paths[0] if paths else None
+
+
+def save_fit(inference_data, key, config, timings={}, registry=registry_dir):
+    """
+    Register a fit: save the InferenceData and its metadata.
+
+    The metadata is also stored in the posterior attributes, so a netcdf
+    file copied elsewhere still tells what it was fitted with.
+
+    Parameters:
+    - inference_data: InferenceData of the fit
+    - key: key as returned by fit_key
+    - config: dictionary as returned by fit_config
+    - timings: dictionary of timings, e.g. the sampling wall time
+    - registry: directory of the registered fits
+
+    Returns:
+    - path of the netcdf file
+    """
+    os.makedirs(registry, exist_ok=True)
+    path = fit_path(key, config, registry)
+    metadata = {"key": key,
+                "created": datetime.now().isoformat(timespec='seconds'),
+                "path": path,
+                **config,
+                "timings": timings}
+    inference_data.posterior.attrs["fit_registry"] = json.dumps(metadata, default=str)
+    inference_data.to_netcdf(path)
+    # the json is written last, so only complete fits are found
+    with open(path[:-3] + ".json", "w") as f:
+        json.dump(metadata, f, indent=2, default=str)
+    return path
+
+
+def list_fits(registry=registry_dir):
+    """
+    List the registered fits.
+
+    Returns:
+    - DataFrame with one row per fit and its metadata, sampler settings
+    flattened to columns, newest first
+    """
+    records = []
+    for path in glob.glob(f"{registry}/*.json"):
+        with open(path) as f:
+            metadata = json.load(f)
+        records.append({**{key: value for key, value in metadata.items()
+                           if key not in ("sampler_settings", "timings")},
+                        **metadata["sampler_settings"],
+                        **metadata["timings"]})
+    if not records:
+        return pd.DataFrame(columns=["key", "created", "path", "experiment", "variant"])
+    return pd.DataFrame(records).sort_values("created", ascending=False, ignore_index=True)
+
+
+def lookup_fit(experiment, variant="hierarchical", registry=registry_dir, **filters):
+    """
+    Find the newest registered fit of an experiment and configuration.
+
+    Parameters:
+    - experiment: 'pv' or 'heat'
+    - variant: model variant
+    - registry: directory of the registered fits
+    - filters: further metadata or sampler settings the fit must match,
+    e.g. weighted=True or draws=1000
+
+    Returns:
+    - path of the netcdf file
+    """
+    fits = list_fits(registry)
+    filters = {"experiment": experiment, "variant": variant, **filters}
+    for column, value in filters.items():
+        if column not in fits:
+            fits = fits.iloc[0:0]
+            break
+        fits = fits[fits[column] == value]
+    if fits.empty:
+        raise FileNotFoundError(f"No registered fit matching {filters} in {registry}.")
+    return fits["path"].iloc[0]
@@ -0,0 +1,109 @@
+import math
+import os
+from functions import instrument_assist
+
+
+# environment variables read by the BLAS and OpenMP libraries when they load
+thread_variables = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                    "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+def cgroup_cpu_limit():
+    """
+    Read the CPU quota of the container, cgroup v2 or v1.
+
+    Returns:
+    - number of CPUs allowed by the quota, rounded up, or None without quota
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return math.ceil(int(quota) / int(period))
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return math.ceil(quota / period)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus():
+    """
+    Count the CPUs this process may use: the CPU affinity of the process,
+    capped by the container's cgroup quota.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError: # not available on macOS
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    return max(1, min(cpus, limit) if limit else cpus)
+
+
+def core_layout(chains=4, jobs=None, cpus=None):
+    """
+    Split the CPUs over parallel fits, their chains and BLAS threads, so
+    that processes times threads doesn't exceed the CPUs.
+
+    Parameters:
+    - chains: number of chains per fit
+    - jobs: number of fits or stages run at the same time, by default as
+    many as fit with one CPU per chain
+    - cpus: number of CPUs to use, by default available_cpus()
+
+    Returns:
+    - dictionary with the 'cpus', parallel 'jobs', 'chains', the 'cores'
+    passed to pm.sample (chains run in parallel per fit) and the
+    'blas_threads' per process
+    """
+    cpus = available_cpus() if cpus is None else cpus
+    if jobs is None:
+        jobs = max(1, cpus // chains)
+    jobs = max(1, min(jobs, cpus))
+    per_job = max(1, cpus // jobs)
+    cores = max(1, min(chains, per_job))
+    return {"cpus": cpus,
+            "jobs": jobs,
+            "chains": chains,
+            "cores": cores,
+            "blas_threads": max(1, per_job // cores)}
+
+
+def limit_blas_threads(threads):
+    """
+    Limit BLAS and OpenMP threads in this process and the processes it starts.
+
+    The environment variables cover processes started from now on, e.g.
+    sampling chains; threadpoolctl, if installed, also limits the libraries
+    already loaded in this process and forked workers.
+    """
+    for variable in thread_variables:
+        os.environ[variable] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(threads)
+
+
+def log_layout(layout, report=None):
+    """
+    Print the core layout and store it in the run report.
+
+    Parameters:
+    - layout: dictionary as returned by core_layout
+    - report: run report, by default the one set by start_run
+    """
+    report = instrument_assist.current_report if report is None else report
+    print(f"{layout['cpus']} CPUs: {layout['jobs']} job(s) x {layout['cores']} "
+          f"core(s) for {layout['chains']} chains x {layout['blas_threads']} BLAS thread(s)")
+    if report is not None:
+        report["layout"] = layout
@@ -0,0 +1,315 @@
+import json
+import time
+import numpy as np
+import arviz as az
+import pymc as pm
+from pymc.step_methods.hmc.quadpotential import QuadPotentialDiag, QuadPotentialDiagAdapt
+
+
+# targets adaptive_sample stops at, None switches a criterion off
+convergence_targets = {
+    "r_hat_max": 1.01,
+    "ess_bulk_min": 400,
+    "ess_tail_min": 400,
+    # divergences are reported in every check; a count, when set, above
+    # which sampling stops, as more draws don't remove divergences
+    "divergences_max": None,
+}
+
+# variables the targets are checked on, the cantonal spread mixes slowest
+convergence_var_names = ["beta_mean", "canton_sigma"]
+
+
+def convergence_check(inference_data, var_names=convergence_var_names, targets=convergence_targets):
+    """
+    Check R-hat, bulk and tail ESS and divergences of a fit against targets.
+
+    Parameters:
+    - inference_data: InferenceData with posterior and sample_stats groups
+    - var_names: variables to check, missing ones are skipped
+    - targets: dictionary of targets, missing keys fall back to
+    convergence_targets
+
+    Returns:
+    - dictionary with 'draws' per chain, 'r_hat_max', 'ess_bulk_min',
+    'ess_tail_min', 'divergences' and whether the targets are 'met'
+    """
+    targets = {**convergence_targets, **targets}
+    var_names = [var for var in var_names if var in inference_data.posterior]
+    summary = az.summary(inference_data, var_names=var_names, kind="diagnostics")
+    check = {"draws": int(inference_data.posterior.sizes["draw"]),
+             "r_hat_max": float(summary["r_hat"].max()),
+             "ess_bulk_min": float(summary["ess_bulk"].min()),
+             "ess_tail_min": float(summary["ess_tail"].min()),
+             "divergences": int(inference_data.sample_stats["diverging"].sum())}
+    check["met"] = bool(
+        (targets["r_hat_max"] is None or check["r_hat_max"] <= targets["r_hat_max"]) and
+        (targets["ess_bulk_min"] is None or check["ess_bulk_min"] >= targets["ess_bulk_min"]) and
+        (targets["ess_tail_min"] is None or check["ess_tail_min"] >= targets["ess_tail_min"]) and
+        (targets["divergences_max"] is None or check["divergences"] <= targets["divergences_max"]))
+    return check
+
+
+def last_points(inference_data, model):
+    """
+    Take the last draw of each chain as initial values to continue sampling.
+    """
+    posterior = inference_data.posterior
+    return [{rv.name: posterior[rv.name].isel(chain=chain, draw=-1).values
+             for rv in model.free_RVs}
+            for chain in range(posterior.sizes["chain"])]
+
+
+def adaptive_sample(model,
+                    block_draws=500,
+                    tune=500,
+                    max_blocks=10,
+                    time_budget_s=None,
+                    var_names=convergence_var_names,
+                    targets=convergence_targets,
+                    **sampler_settings):
+    """
+    Sample in blocks until the convergence targets are met.
+
+    Only the first block is tuned. Each further block continues every chain
+    from its last draw with the kernel adapted in the first block, see 
+    tuned_nuts, without tuning again, and appends its draws. After each 
+    block the targets are checked on all draws so far. Sampling stops when
+    they are all met, when there are more divergences than 
+    targets['divergences_max'] if that is set (by default divergences are 
+    only reported), when the next block would exceed the time budget, or 
+    after max_blocks blocks.
+
+    Parameters:
+    - model: pymc Model
+    - block_draws: draws per chain and block
+    - tune: tuning steps of the first block
+    - max_blocks: largest number of blocks
+    - time_budget_s: wall time after which no further block is started if
+    it would not finish in time, or None
+    - var_names, targets: passed on to convergence_check
+    - sampler_settings: further keyword arguments passed on to pm.sample,
+    e.g. chains, cores, random_seed and target_accept
+
+    Returns:
+    - InferenceData of all blocks, with the 'stopping_reason' ('converged',
+    'divergences', 'time_budget' or 'max_blocks'), the number of 'blocks'
+    and the per-block checks in 'convergence_history' (json) stored in the
+    posterior attributes
+    """
+    targets = {**convergence_targets, **targets}
+    seed = sampler_settings.pop("random_seed", None)
+    target_accept = sampler_settings.pop("target_accept", 0.8)
+    start = time.perf_counter()
+    history = []
+    inference_data = None
+    step = None
+    reason = "max_blocks"
+
+    for block in range(max_blocks):
+        block_start = time.perf_counter()
+        settings = {**sampler_settings,
+                    "draws": block_draws,
+                    "random_seed": None if seed is None else seed + block,
+                    "progressbar": False}
+        if block == 0:
+            block_data = pm.sample(model=model, tune=tune, target_accept=target_accept, **settings)
+        else:
+            # continue from where the chains are with the same kernel
+            if step is None:
+                step = tuned_nuts(model, inference_data, target_accept)
+            with model:
+                block_data = pm.sample(tune=0, step=step, initvals=last_points(inference_data, model),
+                                       **settings)
+        inference_data = block_data if block == 0 else az.concat(inference_data, block_data, dim="draw")
+
+        check = convergence_check(inference_data, var_names, targets)
+        block_s = time.perf_counter() - block_start
+        check.update(block=block + 1, block_s=round(block_s, 3),
+                     elapsed_s=round(time.perf_counter() - start, 3))
+        history.append(check)
+        print(f"Block {block + 1}: {check['draws']} draws, R-hat {check['r_hat_max']:.3f}, "
+              f"ESS bulk {check['ess_bulk_min']:.0f}, tail {check['ess_tail_min']:.0f}, "
+              f"{check['divergences']} divergences")
+
+        if check["met"]:
+            reason = "converged"
+            break
+        if targets["divergences_max"] is not None and check["divergences"] > targets["divergences_max"]:
+            reason = "divergences"
+            break
+        if time_budget_s is not None and check["elapsed_s"] + block_s > time_budget_s:
+            reason = "time_budget"
+            break
+
+    print(f"Stopped sampling: {reason}")
+    inference_data.posterior.attrs["stopping_reason"] = reason
+    inference_data.posterior.attrs["blocks"] = len(history)
+    inference_data.posterior.attrs["convergence_history"] = json.dumps(history)
+    return inference_data
+
+
+def tuned_nuts(model, inference_data, target_accept=0.8):
+    """
+    NUTS step with the step size and mass matrix adapted in a tuned fit, 
+    fixed so that sampling with tune=0 continues with the same kernel.
+
+    PyMC resets the adaptation of a step at the start of every pm.sample 
+    call and doesn't return the adapted state of the chain processes, so it 
+    is taken from the fit: the step size is the geometric mean over chains 
+    of the final adapted step size, and the diagonal mass matrix is the 
+    variance of the draws on the unconstrained scale, the quantity the 
+    adaptation estimates during tuning.
+
+    Parameters:
+    - model: pymc Model
+    - inference_data: InferenceData of a tuned fit of model, with the 
+    'step_size_bar' sampler statistic
+    - target_accept: target acceptance rate, only reported as no step size
+    adaptation is done
+
+    Returns:
+    - pm.NUTS step to pass to pm.sample with tune=0
+    """
+    step_size = inference_data.sample_stats["step_size_bar"].isel(draw=-1).values
+    step_size = float(np.exp(np.log(step_size).mean()))
+    variance = unconstrained_draws(model, inference_data).var(axis=0)
+    with model:
+        # NUTS divides step_scale by the fourth root of the dimension
+        return pm.NUTS(vars=model.value_vars, potential=QuadPotentialDiag(variance),
+                       step_scale=step_size * len(variance) ** 0.25, adapt_step_size=False,
+                       target_accept=target_accept)
+
+
+def approximate_posterior(model, method="advi", n=20000, draws=1000, random_seed=None):
+    """
+    Fit a fast approximation of the posterior to start sampling from.
+
+    Parameters:
+    - model: pymc Model
+    - method: 'advi', 'fullrank_advi' or 'pathfinder', the latter needs 
+    pymc-extras
+    - n: optimisation steps of ADVI
+    - draws: draws from the approximation
+    - random_seed: seed of the optimisation and the draws
+
+    Returns:
+    - InferenceData with the draws in the posterior group
+    """
+    if method == "pathfinder":
+        # optional dependency, only needed for this method
+        import pymc_extras as pmx
+        return pmx.fit(method="pathfinder", model=model, num_draws=draws, 
+                       random_seed=random_seed, progressbar=False)
+    approximation = pm.fit(n=n, method=method, model=model, random_seed=random_seed, 
+                           progressbar=False)
+    return approximation.sample(draws, random_seed=random_seed)
+
+
+def unconstrained_draws(model, inference_data):
+    """
+    Posterior draws of the free variables on the sampler's unconstrained 
+    scale, raveled in the order of model.value_vars.
+
+    Returns:
+    - array of shape (draws, parameters)
+    """
+    posterior = inference_data.posterior
+    shapes = model.eval_rv_shapes()
+    columns = []
+    for rv in model.free_RVs:
+        draws = posterior[rv.name].stack(sample=["chain", "draw"]).transpose("sample", ...).values
+        if draws.shape[1:] != shapes[rv.name]:
+            raise ValueError(f"{rv.name} has shape {draws.shape[1:]} in the previous fit and "
+                             f"{shapes[rv.name]} in the model.")
+        transform = model.rvs_to_transforms.get(rv)
+        if transform is not None:
+            # the transforms of the model don't depend on parameter values
+            draws = transform.forward(draws.astype(rv.dtype), *rv.owner.inputs).eval()
+        columns.append(draws.reshape(len(draws), -1))
+    return np.hstack(columns)
+
+
+def warm_start_sample(model,
+                      source,
+                      draws=1000,
+                      tune=100,
+                      chains=4,
+                      random_seed=None,
+                      approximation_settings={},
+                      **sampler_settings):
+    """
+    Sample with starting points and mass matrix taken from a previous fit 
+    or a fast approximation, so a short tuning phase is enough.
+
+    Each chain starts at a different random draw of the source, and the 
+    diagonal mass matrix starts at the variance of the source draws on the 
+    unconstrained scale. Tuning then only refines the step size and mass 
+    matrix.
+
+    Parameters:
+    - model: pymc Model
+    - source: InferenceData or netcdf path of a previous fit of the same 
+    model, e.g. a registered fit, or 'advi', 'fullrank_advi' or 
+    'pathfinder' for an approximation fitted first
+    - draws: draws per chain
+    - tune: tuning steps per chain
+    - chains: number of chains
+    - random_seed: seed of the starting points and the sampler
+    - approximation_settings: keyword arguments passed on to 
+    approximate_posterior
+    - sampler_settings: further keyword arguments passed on to pm.sample, 
+    e.g. cores, and target_accept passed on to NUTS
+
+    Returns:
+    - InferenceData, with the warm start report stored as json in the 
+    posterior attribute 'warm_start'
+    - report with the 'source', the 'approximation_s' and 'sample_s' wall 
+    times, the 'reference_sample_s' of the source fit if it was registered 
+    with timings, the 'saved_s' and the diagnostics of convergence_check
+    """
+    rng = np.random.default_rng(random_seed)
+    start = time.perf_counter()
+    reference_s = None
+    if isinstance(source, str) and source in ("advi", "fullrank_advi", "pathfinder"):
+        source_name = source
+        source = approximate_posterior(model, source, random_seed=random_seed, **approximation_settings)
+    else:
+        source_name = source if isinstance(source, str) else "inference_data"
+        if isinstance(source, str):
+            source = az.from_netcdf(source)
+        registry = json.loads(source.posterior.attrs.get("fit_registry", "{}"))
+        reference_s = registry.get("timings", {}).get("sample_s")
+    approximation_s = time.perf_counter() - start
+
+    # starting points: distinct random draws of the source per chain
+    posterior = source.posterior.stack(sample=["chain", "draw"])
+    picks = rng.choice(posterior.sizes["sample"], size=chains, replace=False)
+    initvals = [{rv.name: posterior[rv.name].isel(sample=pick).values.astype(rv.dtype)
+                 for rv in model.free_RVs} for pick in picks]
+
+    # mass matrix: variance of the source on the unconstrained scale
+    unconstrained = unconstrained_draws(model, source)
+    potential = QuadPotentialDiagAdapt(unconstrained.shape[1],
+                                       unconstrained.mean(axis=0),
+                                       unconstrained.var(axis=0),
+                                       initial_weight=10)
+    target_accept = sampler_settings.pop("target_accept", 0.8)
+
+    start = time.perf_counter()
+    with model:
+        step = pm.NUTS(vars=model.value_vars, potential=potential, target_accept=target_accept)
+        inference_data = pm.sample(draws=draws, tune=tune, chains=chains, step=step, 
+                                   initvals=initvals, random_seed=random_seed, 
+                                   progressbar=False, **sampler_settings)
+    sample_s = time.perf_counter() - start
+
+    report = {"source": source_name,
+              "tune": tune,
+              "approximation_s": round(approximation_s, 3),
+              "sample_s": round(sample_s, 3),
+              "reference_sample_s": reference_s,
+              "saved_s": None if reference_s is None else round(reference_s - approximation_s - sample_s, 3),
+              **convergence_check(inference_data)}
+    inference_data.posterior.attrs["warm_start"] = json.dumps(report)
+    return inference_data, report
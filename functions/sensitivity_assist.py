@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import pymc as pm
+import pytensor
+import pytensor.tensor as pt
+from pytensor.graph.replace import graph_replace, vectorize_graph
+from functions.loo_assist import psis_smooth
+
+
+# priors that are power-scaled by default, the canton offsets of the
+# non-centered model are part of the hierarchy rather than a prior choice
+sensitivity_components = ["beta_mean", "canton_sigma"]
+
+# power-scaling factors, below 1 widens and above 1 sharpens the prior
+sensitivity_alphas = [0.8, 1.25]
+
+# above this Pareto k the reweighted draws can't be trusted, refit instead
+pareto_k_threshold = 0.7
+
+
+def prior_logp_draws(model, inference_data, components=sensitivity_components):
+    """
+    Evaluate the log prior density of model variables at each posterior draw.
+
+    The prior log density of each component is built once with its parents
+    replaced by their values, vectorized over a leading draw dimension and
+    evaluated on all draws in one call. Densities are on the constrained
+    scale, the Jacobian of the transforms cancels in the importance ratios.
+
+    Parameters:
+    - model: pymc Model the posterior was sampled from
+    - inference_data: InferenceData with the free variables in the posterior
+    - components: free variables whose prior log density is returned
+
+    Returns:
+    - dictionary of component name to array of shape (chain * draw,) with the
+    log prior density summed over the variable's dimensions
+    """
+    posterior = inference_data.posterior
+    free = {rv.name: rv for rv in model.free_RVs}
+    missing = [name for name in components if name not in free]
+    if missing:
+        raise ValueError(f"{missing} are not free variables of the model.")
+
+    # one value placeholder per free variable, and a batched one over draws
+    values = {name: rv.type(name=name) for name, rv in free.items()}
+    batched = {name: pt.tensor(dtype=rv.dtype, shape=(None, *rv.type.shape), name=name)
+               for name, rv in free.items()}
+
+    logps = []
+    for name in components:
+        logp = pm.logp(free[name], values[name]).sum()
+        logp = graph_replace(logp, {free[parent]: values[parent] for parent in free
+                                    if parent != name}, strict=False)
+        logps.append(logp)
+
+    inputs = [name for name in free if name in posterior]
+    logps = vectorize_graph(logps, {values[name]: batched[name] for name in inputs})
+    # pytensor is imported by pymc already, the function is small
+    function = pytensor.function([batched[name] for name in inputs], logps,
+                                 on_unused_input="ignore")
+
+    draws = [posterior[name].stack(sample=["chain", "draw"]).transpose("sample", ...)
+             .values.astype(batched[name].dtype) for name in inputs]
+    return dict(zip(components, function(*draws)))
+
+
+def power_scale_sensitivity(model,
+                            inference_data,
+                            alphas=sensitivity_alphas,
+                            components=sensitivity_components,
+                            var_names=["beta_mean", "canton_sigma"]):
+    """
+    Estimate how posterior summaries shift when priors are power-scaled.
+
+    Scaling a prior p(theta) to p(theta)^alpha changes the posterior by the
+    importance weights p(theta)^(alpha - 1), so the shifted means and
+    standard deviations follow from the existing draws without refitting.
+    The weights are Pareto smoothed, a large Pareto k means the perturbed
+    posterior is too far from the fitted one and needs a refit.
+
+    Parameters:
+    - model: pymc Model the posterior was sampled from
+    - inference_data: InferenceData of the fit
+    - alphas: power-scaling factors
+    - components: priors that are scaled, one at a time
+    - var_names: posterior variables summarised
+
+    Returns:
+    - DataFrame with one row per component, alpha, variable and element,
+    with the posterior 'mean' and 'sd', the weighted 'mean_scaled' and
+    'sd_scaled', the 'mean_shift_sd' (shift of the mean in posterior sds),
+    'sd_ratio', 'pareto_k' and whether a 'refit' is needed
+    """
+    logp = prior_logp_draws(model, inference_data, components)
+    posterior = inference_data.posterior
+    alphas = np.asarray(alphas, dtype=float)
+
+    # draws x elements of every summarised variable
+    values, labels = [], []
+    for var in var_names:
+        samples = posterior[var].stack(sample=["chain", "draw"]).transpose("sample", ...)
+        flat = samples.values.reshape(samples.sizes["sample"], -1)
+        values.append(flat)
+        dims = [dim for dim in samples.dims if dim != "sample"]
+        index = pd.MultiIndex.from_product([samples[dim].values for dim in dims]) if dims else [()]
+        labels += [(var, ", ".join(str(i) for i in (item if isinstance(item, tuple) else (item,))))
+                   for item in index]
+    values = np.hstack(values)
+    mean = values.mean(axis=0)
+    sd = values.std(axis=0)
+
+    tables = []
+    for component in components:
+        # alphas x draws log weights, smoothed and normalised per alpha
+        weights, pareto_k = psis_smooth((alphas[:, None] - 1) * logp[component][None, :])
+        weights = np.exp(weights)
+        mean_scaled = weights @ values
+        sd_scaled = np.sqrt(np.maximum(weights @ values ** 2 - mean_scaled ** 2, 0))
+        tables.append(pd.DataFrame({
+            "component": component,
+            "alpha": np.repeat(alphas, len(labels)),
+            "variable": [var for var, _ in labels] * len(alphas),
+            "index": [index for _, index in labels] * len(alphas),
+            "mean": np.tile(mean, len(alphas)),
+            "sd": np.tile(sd, len(alphas)),
+            "mean_scaled": mean_scaled.ravel(),
+            "sd_scaled": sd_scaled.ravel(),
+            "pareto_k": np.repeat(pareto_k, len(labels)),
+        }))
+    table = pd.concat(tables, ignore_index=True)
+    table["mean_shift_sd"] = (table["mean_scaled"] - table["mean"]) / table["sd"]
+    table["sd_ratio"] = table["sd_scaled"] / table["sd"]
+    table["refit"] = table["pareto_k"] > pareto_k_threshold
+    return table
+
+
+def sensitivity_summary(table, shift_threshold=0.1):
+    """
+    Summarise power-scaling sensitivity per component and variable element.
+
+    Parameters:
+    - table: DataFrame as returned by power_scale_sensitivity
+    - shift_threshold: absolute mean shift, in posterior sds, above which
+    an estimate counts as prior sensitive
+
+    Returns:
+    - DataFrame with the largest absolute 'mean_shift_sd', the largest
+    deviation of 'sd_ratio' from 1, the largest 'pareto_k', whether a 'refit'
+    is needed and whether the estimate is 'sensitive', most sensitive first
+    """
+    summary = table.assign(shift=table["mean_shift_sd"].abs(),
+                           sd_change=(table["sd_ratio"] - 1).abs())
+    summary = summary.groupby(["component", "variable", "index"], sort=False).agg(
+        mean_shift_sd=("shift", "max"),
+        sd_change=("sd_change", "max"),
+        pareto_k=("pareto_k", "max"),
+        refit=("refit", "any"),
+    ).reset_index()
+    summary["sensitive"] = summary["mean_shift_sd"] > shift_threshold
+    return summary.sort_values("mean_shift_sd", ascending=False, ignore_index=True)
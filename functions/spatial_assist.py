@@ -0,0 +1,170 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+# cached canton adjacency, computed once from the boundary geometries
+adjacency_cache = "data/canton_adjacency.npz"
+
+# canton names as in the NAME column of swissBOUNDARIES3D, the survey
+# cantons are recoded to these, see canton_names in survey_assist
+swiss_cantons = [
+    "Zürich", "Bern", "Luzern", "Uri", "Schwyz", "Obwalden", "Nidwalden",
+    "Glarus", "Zug", "Fribourg", "Solothurn", "Basel-Stadt", 
+    "Basel-Landschaft", "Schaffhausen", "Appenzell Ausserrhoden",
+    "Appenzell Innerrhoden", "St. Gallen", "Graubünden", "Aargau",
+    "Thurgau", "Ticino", "Vaud", "Valais", "Neuchâtel", "Genève", "Jura"
+]
+
+
+def adjacency_from_geometries(cantons_gdf, name="NAME"):
+    """
+    Find the neighbouring cantons, cantons whose boundaries share a point.
+
+    Parameters:
+    - cantons_gdf: GeoDataFrame of cantonal boundaries, e.g. as returned by
+    load_cantons, possibly with several polygons per canton
+    - name: column with the canton name
+
+    Returns:
+    - sorted canton names
+    - symmetric sparse adjacency matrix in csr format, 1 for neighbours
+    """
+    cantons_gdf = cantons_gdf.dissolve(by=name).sort_index()
+    left, right = cantons_gdf.sindex.query(cantons_gdf.geometry, predicate="intersects")
+    neighbours = left != right
+    adjacency = sp.coo_matrix((np.ones(neighbours.sum(), dtype=np.int8),
+                               (left[neighbours], right[neighbours])),
+                              shape=(len(cantons_gdf), len(cantons_gdf))).tocsr()
+    # symmetric with ones, even if a pair is found twice
+    adjacency = ((adjacency + adjacency.T) > 0).astype(np.int8)
+    return cantons_gdf.index.values, adjacency
+
+
+def connected_parts(adjacency, cantons):
+    """
+    Split the cantons into the connected parts of their adjacency.
+
+    Parameters:
+    - adjacency: symmetric sparse adjacency matrix
+    - cantons: canton names in the order of the rows
+
+    Returns:
+    - list of lists of canton names, the largest part first
+    """
+    _, labels = connected_components(adjacency, directed=False)
+    parts = [[canton for canton, label in zip(cantons, labels) if label == part] 
+             for part in np.unique(labels)]
+    return sorted(parts, key=len, reverse=True)
+
+
+def canton_adjacency(cantons, path=adjacency_cache, **load_kwargs):
+    """
+    Sparse adjacency of the cantons, cached.
+
+    The adjacency of all cantons is derived from the swissBOUNDARIES3D
+    geometries on first use and stored in path, later calls read it.
+    The cantons must all be in the adjacency and connected through each
+    other, e.g. Genève only borders Vaud, so a survey without respondents
+    from Vaud cuts it off; the ValueError lists the parts in that case.
+
+    Parameters:
+    - cantons: canton names, the order of the rows and columns
+    - path: cached adjacency, created if it doesn't exist
+    - load_kwargs: passed on to load_cantons, e.g. the shapefile path
+
+    Returns:
+    - symmetric sparse adjacency matrix in csr format
+    """
+    if not os.path.exists(path):
+        # geopandas is only needed to build the cache
+        from functions.plot_assist import load_cantons
+
+        names, adjacency = adjacency_from_geometries(load_cantons(**load_kwargs))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, names=names.astype(str), indices=adjacency.indices,
+                            indptr=adjacency.indptr, data=adjacency.data)
+
+    cached = np.load(path)
+    names = cached["names"].tolist()
+    adjacency = sp.csr_matrix((cached["data"], cached["indices"], cached["indptr"]),
+                              shape=(len(names), len(names)))
+
+    missing = [canton for canton in cantons if canton not in names]
+    if missing:
+        raise ValueError(f"{missing} are not in the canton adjacency {path}, "
+                         f"which has {names}. Recode them with canton_names in survey_assist.")
+    order = [names.index(canton) for canton in cantons]
+    adjacency = adjacency[order][:, order]
+
+    parts = connected_parts(adjacency, list(cantons))
+    if len(parts) > 1:
+        raise ValueError(f"The cantons fall into {len(parts)} disconnected parts: "
+                         f"{parts[0]} and {parts[1:]} cut off without their "
+                         "neighbours. The ICAR prior needs a connected map, drop the "
+                         "cut off cantons or use the 'hierarchical' variant.")
+    return adjacency
+
+
+def icar_edges(adjacency):
+    """
+    Edge list of an adjacency matrix, each pair of neighbours once.
+
+    Returns:
+    - two integer arrays of the first and second canton of each edge
+    """
+    node1, node2 = sp.triu(adjacency, k=1).nonzero()
+    return node1, node2
+
+
+def bym2_scale(adjacency):
+    """
+    Scaling factor of the ICAR component of the BYM2 model (Riebler et al.
+    2016), the geometric mean of the marginal variances of the ICAR prior
+    with unit precision, so the spatial share is comparable across maps.
+
+    Parameters:
+    - adjacency: symmetric sparse adjacency matrix of a connected map
+
+    Returns:
+    - scaling factor as a float
+    """
+    n_components, _ = connected_components(adjacency, directed=False)
+    if n_components > 1:
+        raise ValueError(f"The canton adjacency has {n_components} disconnected parts, "
+                         "the ICAR prior needs a connected map.")
+
+    # ICAR precision D - W, its pseudo-inverse is the covariance under the
+    # sum-to-zero constraint, dense is fine for a map of 26 cantons
+    adjacency = sp.csr_matrix(adjacency, dtype=float)
+    precision = sp.diags(np.asarray(adjacency.sum(axis=1)).ravel()) - adjacency
+    covariance = np.linalg.pinv(precision.toarray())
+    return float(np.exp(np.mean(np.log(np.diag(covariance)))))
+
+
+def icar_logp(phi, node1, node2, zero_sum_sd=0.001):
+    """
+    Log density of independent ICAR priors with unit precision on the
+    columns of phi, up to a constant.
+
+    Only the pairwise differences along the edges are evaluated, so the
+    cost grows with the number of neighbours rather than cantons squared.
+    The sum-to-zero constraint of each column is soft, as in pm.ICAR, 
+    unless phi is constrained already, e.g. by a ZeroSumTransform.
+
+    Parameters:
+    - phi: tensor of shape (cantons, levels)
+    - node1, node2: edge list as returned by icar_edges
+    - zero_sum_sd: standard deviation of the column sums, per canton, or 
+    None if the columns sum to zero exactly
+
+    Returns:
+    - scalar tensor
+    """
+    pairwise = -0.5 * ((phi[node1] - phi[node2]) ** 2).sum()
+    if zero_sum_sd is None:
+        return pairwise
+    n_cantons = phi.shape[0]
+    zero_sum = -0.5 * ((phi.sum(axis=0) / (zero_sum_sd * n_cantons)) ** 2).sum()
+    return pairwise + zero_sum
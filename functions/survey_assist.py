@@ -0,0 +1,508 @@
+import re
+import warnings
+import pandas as pd
+import numpy as np
+from functions.data_assist import apply_mapping, rename_columns
+from functions.instrument_assist import instrumented
+from functions.quality_assist import quality_flags, quality_thresholds
+from functions.spatial_assist import swiss_cantons
+from functions.weighting_assist import rake_weights
+
+
+# likert scales in conjoints and justice section
+numerical_values = [0, 1, 2, 3, 4, 5]
+rating_values = ['Stark dagegen',
+                 'Dagegen',
+                 'Eher dagegen',
+                 'Eher dafür',
+                 'Dafür',
+                 'Stark dafür']
+rating_scale = np.array(list(zip(rating_values, numerical_values)))
+likert_dict = {**dict(rating_scale)}
+
+# demographic values
+demographics_dict = {
+    # gender
+    "Weiblich": "female",
+    "Männlich": "male", 
+    "Nicht-binär": "non-binary",
+
+    # age
+    "18-39 Jahre": "18-39", 
+    "40-64 Jahre": "40-64", 
+    "65-79 Jahre": "65-79", 
+    "80 Jahre oder älter": "80+",
+
+    # language region
+    "Deutschsprachige Schweiz": "german", 
+    "Französischsprachige Schweiz": "french", 
+    "Italienischsprachige Schweiz": "italian",
+    "Rätoromanische Schweiz": "romansh",
+
+    # survey language
+    "Deutsch": "german",
+    "Französisch": "french",
+    "Italienisch": "italian",
+
+    # income
+    "Unter CHF 70,000": "low", # lower
+    "CHF 70,000 – CHF 100,000": "mid", # lower
+    "CHF 100,001 – CHF 150,000": "mid", # higher
+    "CHF 150,001 – CHF 250,000": "high", # higher
+    "Über 250,000": "high", # higher
+    "Möchte ich nicht sagen": np.nan, 
+
+    # education 
+    "Keine Matura": "no secondary",
+    "Matura oder Berufsausbildung": "secondary",
+    "Abschluss einer Fachhochschule oder Universität": "university",
+
+    # citizen 
+    "Ja": True, 
+    "Nein": False, 
+
+    # tenant
+    "Mieter:in": True, 
+    "Besitzer:in": False,
+
+    # urbanness
+    "Stadt": "city",
+    "Agglomeration": "suburb",
+    "Land": "rural",
+
+    # political orientation
+    "Grüne Partei der Schweiz (GPS)": "left", 
+    "Sozialdemokratische Partei der Schweiz (SP)": "left", 
+    "Grünliberale Partei (GLP)": "liberal", 
+    "Die Mitte (ehemals CVP/BDP)": "liberal", 
+    "Die Liberalen (FDP)": "conservative", 
+    "Schweizerische Volkspartei (SVP)": "conservative", 
+    "Andere": np.nan, 
+    "Keine": np.nan, 
+    "Möchte ich nicht sagen": np.nan,
+
+    #TODO energy literacy
+}
+
+# canton labels in English, German, French and Italian to the names of 
+# swissBOUNDARIES3D, see swiss_cantons in spatial_assist; labels that are
+# the same in the boundary data aren't listed
+canton_names = {
+    # English
+    "Zurich": "Zürich", "Lucerne": "Luzern", "Geneva": "Genève",
+    "Grisons": "Graubünden", "Basel-City": "Basel-Stadt", 
+    "Basel-Country": "Basel-Landschaft", "Neuchatel": "Neuchâtel",
+    "St Gallen": "St. Gallen",
+
+    # German
+    "Freiburg": "Fribourg", "Tessin": "Ticino", "Waadt": "Vaud", 
+    "Wallis": "Valais", "Neuenburg": "Neuchâtel", "Genf": "Genève",
+
+    # French
+    "Berne": "Bern", "Schwytz": "Schwyz", "Obwald": "Obwalden",
+    "Nidwald": "Nidwalden", "Glaris": "Glarus", "Zoug": "Zug", "Soleure": "Solothurn",
+    "Bâle-Ville": "Basel-Stadt", "Bâle-Campagne": "Basel-Landschaft", 
+    "Schaffhouse": "Schaffhausen", "Appenzell Rhodes-Extérieures": "Appenzell Ausserrhoden",
+    "Appenzell Rhodes-Intérieures": "Appenzell Innerrhoden", "Saint-Gall": "St. Gallen",
+    "Argovie": "Aargau", "Thurgovie": "Thurgau",
+
+    # Italian
+    "Zurigo": "Zürich", "Berna": "Bern", "Lucerna": "Luzern", "Svitto": "Schwyz",
+    "Obvaldo": "Obwalden", "Nidvaldo": "Nidwalden", "Glarona": "Glarus", "Zugo": "Zug",
+    "Friburgo": "Fribourg", "Soletta": "Solothurn", "Basilea Città": "Basel-Stadt",
+    "Basilea Campagna": "Basel-Landschaft", "Sciaffusa": "Schaffhausen",
+    "Appenzello Esterno": "Appenzell Ausserrhoden", "Appenzello Interno": "Appenzell Innerrhoden",
+    "San Gallo": "St. Gallen", "Grigioni": "Graubünden", "Argovia": "Aargau",
+    "Turgovia": "Thurgau", "Vallese": "Valais",
+    "Ginevra": "Genève", "Giura": "Jura"
+}
+
+# conjoint attribute levels
+translation_dict_heat = {
+    # ban
+    "Kein Verbot": "No ban",
+    "Pas d'interdiction": "No ban",
+    "Nessun divieto": "No ban",
+
+    "Verbot von Neuinstallationen": "Ban on new installations",
+    "Interdiction de nouvelles installations uniquement": "Ban on new installations",
+    "Divieto di installare nuovi boiler": "Ban on new installations",
+
+    "Verbot von Neuinstallationen und obligatorischer Austausch bestehender fossilen Heizungen": "Ban and fossil heating replacement",
+    "Interdiction de nouvelles installations et remplacement obligatoire des chauffages à combustibles fossiles existants": "Ban and fossil heating replacement",
+    "Divieto di installare nuovi boiler e sostituzione obbligatoria dei boiler esistenti": "Ban and fossil heating replacement",
+
+    # heat pump
+    "Wärmepumpe mit Subventionen kaufen": "Subsidy", 
+    "Achat d’une pompe à chaleur avec des subventions": "Subsidy",
+    "Acquisto di una pompa di calore con sovvenzioni": "Subsidy",
+
+    "Wärmepumpe von der Regierung leasen": "Governmental lease",
+    "Achat d’une pompe à chaleur en leasing auprès du gouvernement": "Governmental lease",
+    "Leasing di una pompa di calore di proprietà del governo": "Governmental lease",
+
+    "Wärmepumpen-Abo": "Subscription",
+    "Abonnement à une pompe à chaleur": "Subscription",
+    "Abbonamento ad una pompa di calore": "Subscription",
+
+    # building codes
+    "Neue Gebäude müssen energieeffizient sein": "New buildings must be energy efficient", 
+    "Les nouveaux bâtiments doivent être énergétiquement efficaces": "New buildings must be energy efficient",
+    "Nuovi edifici devono rispettare standard di alta efficienza energetica": "New buildings must be energy efficient",
+
+    "Neue Gebäude müssen energieeffizient sein und vor Ort erneuerbaren Strom erzeugen": "New buildings must be energy efficient and produce renewable electricity on-site",
+    "Les nouveaux bâtiments doivent être énergétiquement efficaces et produire de l'électricité renouvelable sur place": "New buildings must be energy efficient and produce renewable electricity on-site",
+    "Nuovi edifici devono rispettare standard di alta efficienza energetica e produrre elettricità rinnovabile in modo autonomo": "New buildings must be energy efficient and produce renewable electricity on-site",
+
+    "Alle Gebäude müssen energieeffizient sein": "All buildings need to be energy efficient",
+    "Tous les bâtiments doivent être énergétiquement efficaces": "All buildings need to be energy efficient",
+    "Tutti gli edifici devono rispettare standard di alta efficienza energetica": "All buildings need to be energy efficient",
+
+    "Alle Gebäude müssen energieeffizient sein und vor Ort erneuerbaren Strom erzeugen": "All buildings need to be energy efficient and produce renewable electricity on-site",
+    "Tous les bâtiments doivent être énergétiquement efficaces et produire de l'électricité renouvelable sur place": "All buildings need to be energy efficient and produce renewable electricity on-site",
+    "Tutti gli edifici devono rispettare standard di alta efficienza energetica e produrre elettricità rinnovabile in modo autonomo": "All buildings need to be energy efficient and produce renewable electricity on-site",
+    
+    # exemptions -- there's an error here somewhere
+    "Keine Ausnahmen": "No exemptions", 
+    "Pas d'exemption": "No exemptions",
+    "Nessuna eccezione": "No exemptions",
+
+    "Geringverdienende Haushalte sind ausgenommen": "Low-income households are exempted",
+    "Les ménages à revenus faibles sont exclus": "Low-income households are exempted",
+    "Sono esentate le famiglie e utenze a basso reddito": "Low-income households are exempted",
+
+    "Gering- und mittelverdienende Haushalte sind ausgenommen": "Low and middle-income households are exempted",
+    "Les ménages à revenus faibles et moyens sont exclus": "Low and middle-income households are exempted",
+    "Sono esentate le famiglie e utenze a basso e medio reddito": "Low and middle-income households are exempted"
+}
+
+translate_dict_pv = {
+    # target mix
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_Xuqo08nWGvzTaSr': 'More hydro',
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_lwjCDBh17ODzYQM': 'More hydro', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_FvSefnnxSgWbb8J': 'More hydro', 
+
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_PnFZWmknO1NZLvB': 'More solar', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_vCbbVKg7jmWJgva': 'More solar', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_WFCdHR97e3KUwQG': 'More solar', 
+
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_9LCSI0Qu1yQuHNY': 'More wind',
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_9dSwpo1C4dEgjHD': 'More wind', 
+    'https://climatepolicy.qualtrics.com/ControlPanel/Graphic.php?IM=IM_G9HNH3uNGMuVtEb': 'More wind', 
+
+    # rooftop pv requirements
+    'Keine Verpflichtungen': 'No obligation', 
+    'Nessun obbligo': 'No obligation', 
+    'Aucune obligation': 'No obligation', 
+
+    'Neuen öffentlichen und gewerblichen Gebäuden': 'New public and commercial buildings', 
+    'Les nouveaux bâtiments publics et commerciaux': 'New public and commercial buildings', 
+    'Nuovi edifici pubblici e commerciali': 'New public and commercial buildings',
+
+    'Neuen und existierenden öffentlichen und gewerblichen Gebäuden': 'New and existing public and commercial buildings', 
+    'Les bâtiments publics et commerciaux à la fois nouveaux et existants': 'New and existing public and commercial buildings', 
+    'Edifici pubblici e commerciali sia nuovi che esistenti': 'New and existing public and commercial buildings', 
+
+    'Allen neuen Gebäuden': 'All new buildings', 
+    'Tous les nouveaux bâtiments': 'All new buildings', 
+    'Tutti i nuovi edifici': 'All new buildings', 
+
+    'Allen neuen und existierenden Gebäuden': 'All new and existing buildings', 
+    'Tous les bâtiments neufs et existants': 'All new and existing buildings', 
+    'Tutti gli edifici nuovi ed esistenti': 'All new and existing buildings', 
+
+    # biodiversity tradeoffs
+    'Keine Ausnahmefälle': 'No trade-offs',
+    'Pas de cas exceptionnels': 'No trade-offs', 
+    'In nessun caso eccezionale': 'No trade-offs', 
+
+    'Alpenregionen': 'Alpine regions',
+    'Les régions alpines': 'Alpine regions', 
+    'Regioni alpine': 'Alpine regions', 
+
+    'Landwirtschaflichen Flächen': 'Agricultural areas',
+    'Les terres agricoles': 'Agricultural areas', 
+    'Superfici agricole': 'Agricultural areas',
+
+    'Wäldern': 'Forests',
+    'Les forêts': 'Forests', 
+    'Foreste': 'Forests', 
+
+    'Flüssen': 'Rivers',
+    'Les rivières': 'Rivers', 
+    'Fiumi': 'Rivers',
+
+    'Seen': 'Lakes', 
+    'Les lacs': 'Lakes', 
+    'Laghi': 'Lakes',
+
+    # cantonal distribution
+    'Keine Vorgabe': 'No agreed distribution', 
+    'Pas d\'objectif': 'No agreed distribution', 
+    'Nessun obiettivo': 'No agreed distribution', 
+
+    'Basierend auf dem Erzeugungspotenzial': 'Potential-based', 
+    'Basée sur la production maximale potentielle d’un canton': 'Potential-based', 
+    'In base al potenziale di un cantone': 'Potential-based', 
+
+    'Basierend auf der Bevölkerungszahl': 'Equal per person', 
+    'Basée sur le nombre de personnes vivant dans chaque canton': 'Equal per person',
+    'In base al numero di abitanti di ogni cantone': 'Equal per person', 
+
+    'Mindestensvorgabe pro Kanton': 'Minimum limit', 
+    'Un minimum de production par canton est établi': 'Minimum limit', 
+    'In base al livello di produzione minimo cantonale concordato': 'Minimum limit', 
+
+    'Deckelung pro Kanton': 'Maximum limit',
+    'Un maximum de production par canton est établi': 'Maximum limit',
+    'Nessun cantone produce più di un tetto massimo concordato': 'Maximum limit'
+}
+
+# justice section used for the attention check
+just_columns = ['justice_general_1', 'justice_tax_1', 'justice_subsidy_1', 
+                'justice_general_2', 'justice_tax_2', 'justice_subsidy_2', 
+                'justice_general_3', 'justice_tax_3', 'justice_subsidy_3', 
+                'justice_general_4', 'justice_tax_4', 'justice_subsidy_4'
+]
+
+columns_to_num = ['Duration (in seconds)', 
+                  'household-size', 
+                  'trust_1', 
+                  'trust_2',
+                  'trust_3', 
+                  'satisfaction_1', 
+                  'literacy6_5']
+
+respondent_columns = [
+        "ID", "duration_min", "gender", "age", "region", "canton", "citizen", 
+        "education", "urbanness", "renting", "income", "household-size", "party", 
+        "satisfaction", "speeder", "laggard", "inattentive", "trust",
+        "justice_straightlining", "justice_longest_run", "justice_variance",
+        "rating_straightlining", "rating_longest_run", "rating_variance", "weight"]
+
+# pv experiment columns as exported by Qualtrics and as named from drop_flagged on
+pv_column_names = {
+    'TargetMix': 'mix',
+    'Imports': 'imports',
+    'RooftopSolarPV': 'pv',
+    'Infrastructure': 'tradeoffs',
+    'Distribution': 'distribution'
+}
+
+# attribute level columns of the conjoint tables, e.g. 'choice1_year_table1'
+conjoint_table_regex = r'^choice\d+_'
+
+heat_regex = 'pv|mix|imports|tradeoffs|distribution'
+heat_filemarker = 'heat'
+pv_regex = 'heat|year|tax|ban|energyclass|exemption'
+pv_filemarker = 'pv'
+
+
+@instrumented()
+def read_export(path, conjoint_tables=True):
+    """
+    Read a Qualtrics export, skipping the question text and import id rows.
+
+    Parameters:
+    - path: path to the csv file exported from Qualtrics
+    - conjoint_tables: if False, the attribute level columns of the conjoint 
+    tables are not read, e.g. when prep_conjoint_lazy stacks them from the
+    export
+
+    Returns:
+    - DataFrame with one row per response
+    """
+    usecols = None if conjoint_tables else (lambda col: not re.search(conjoint_table_regex, col))
+    return pd.read_csv(path, low_memory = False, skiprows = [1,2], usecols = usecols)
+
+
+@instrumented()
+def clean_export(df):
+    """
+    Fix column names and data types, add IDs and drop previews, 
+    incompletes and quota fulls.
+
+    Parameters:
+    - df: pandas DataFrame as returned by read_export
+
+    Returns:
+    - DataFrame with the respondents that completed the survey
+    """
+    # fix typos and replace dashes with underscores
+    df.rename(columns={'languge': 'language'}, inplace=True)
+    df = rename_columns(df, 'justice-', 'justice_')
+
+    # fix data types
+    df['Finished'] = df['Finished'].replace(
+        {'true': True, 'True': True, 'false': False, 'False': False}
+    ).astype(bool)
+
+    for col in columns_to_num:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # add column for IDs and duration in min
+    df['ID'] = range(1, len(df) + 1)
+    df['duration_min'] = df['Duration (in seconds)'] / 60
+
+    # filter out previews
+    df = df[df['DistributionChannel'] != 'preview'] 
+    # filter out recorded incompletes
+    df = df[df['Finished'] == True] 
+    # filter out quota fulls
+    df = df.dropna(subset=['canton']) 
+
+    return df
+
+
+@instrumented()
+def flag_respondents(df, thresholds=quality_thresholds):
+    """
+    Flag speeders, laggards and inattentive respondents, and add the 
+    answer pattern metrics of the justice and rating grids.
+
+    Parameters:
+    - df: pandas DataFrame as returned by clean_export
+    - thresholds: dictionary of screening thresholds, see quality_thresholds,
+    by default speeders and laggards are the 5% fastest and slowest and 
+    inattentives give the exact same answer to all justice questions
+
+    Returns:
+    - DataFrame with boolean columns 'speeder', 'laggard' and 'inattentive'
+    and the metric columns of quality_flags
+    """
+    rating_columns = [col for col in df.columns if '-rating_' in col]
+    flags = quality_flags(df, just_columns, rating_columns, rating_values,
+                          thresholds=thresholds)
+    df = df.assign(**{col: flags[col] for col in flags.columns})
+
+    # duration thresholds of speeders and laggards
+    thresholds = {**quality_thresholds, **thresholds}
+    lower, upper = thresholds['speeder_quantile'], thresholds['laggard_quantile']
+    print(f"Lower threshold (lowest {lower:.0%} quantile): {df['duration_min'].quantile(lower)} minutes")
+    print(f"Upper threshold (highest {1 - upper:.0%} quantile): {df['duration_min'].quantile(upper)} minutes")
+
+    # count the number of rows where the attention filters are True
+    print(f"Number of speeders: {df['speeder'].sum()}")
+    print(f"Number of laggards: {df['laggard'].sum()}")
+    print(f"Number of inattentive respondents: {df['inattentive'].sum()}")
+
+    return df
+
+
+@instrumented()
+def drop_flagged(df):
+    """
+    Drop flagged respondents and the empty Qualtrics table columns, and 
+    rename the pv experiment columns.
+
+    Parameters:
+    - df: pandas DataFrame as returned by flag_respondents
+
+    Returns:
+    - DataFrame with valid respondents only
+    """
+    # filter out rows of speeders, laggards, or inattentives
+    df = df[~((df['speeder'] == True) | 
+              (df['laggard'] == True) |
+              (df['inattentive'] == True)
+             )]
+
+    # remove non-functional empty columns 
+    empty_columns = [col for col in df.columns if col.endswith('_Table')]
+    df = df.drop(columns=empty_columns)
+
+    # rename columns for pv experiment
+    for original, replacement in pv_column_names.items():
+        df = rename_columns(df, original, replacement)
+
+    return df
+
+
+@instrumented()
+def recode_demographics(df):
+    """
+    Recode likert scales, demographics and canton names, and add 
+    categorical political trust and governmental satisfaction.
+
+    Parameters:
+    - df: pandas DataFrame as returned by drop_flagged
+
+    Returns:
+    - DataFrame with recoded columns, the cantons named as in swiss_cantons;
+    unknown canton labels are kept with a warning, the spatial model's 
+    canton_adjacency rejects them
+    """
+    df = apply_mapping(df, likert_dict, column_pattern=['justice', 'rating'])
+    df = apply_mapping(df, demographics_dict)
+
+    # canton names of the boundary data, so every canton has a place on the map
+    df['canton'] = df['canton'].replace(canton_names)
+    unknown = sorted(set(df['canton'].dropna()) - set(swiss_cantons))
+    if unknown:
+        warnings.warn(f"Cantons {unknown} aren't in swiss_cantons and are kept as they are, "
+                      "add them to canton_names for the spatial model.", stacklevel=2)
+
+    # create categorical political trust and governmental satisfaction
+    df = df.copy() # reduce fragmentation
+    df['trust_mean'] = pd.concat([df['trust_1'], df['trust_2'], df['trust_3']], axis=1).mean(axis=1).round(3)
+    df['trust'] = pd.cut(df['trust_mean'], 
+                         bins=[-float('inf'), 
+                               df['trust_mean'].quantile(0.33), 
+                               df['trust_mean'].quantile(0.65), # ensures ~33% in each bin
+                               float('inf')], 
+                         labels=['low', 'mid', 'high'], 
+                         include_lowest=True)
+
+    df['satisfaction'] = pd.cut(df['satisfaction_1'], 
+                                bins=[-float('inf'), 
+                                      df['satisfaction_1'].quantile(0.27), 
+                                      df['satisfaction_1'].quantile(0.63), # ensures ~33% in each bin
+                                      float('inf')], 
+                                labels=['low', 'mid', 'high'], 
+                                include_lowest=True)
+
+    return df
+
+
+@instrumented()
+def weight_respondents(df, margins=None, **kwargs):
+    """
+    Add raking weights to population margins within each canton.
+
+    Parameters:
+    - df: pandas DataFrame as returned by recode_demographics
+    - margins: dictionary as returned by read_margins, or None to give 
+    every respondent weight one
+    - kwargs: passed on to rake_weights, e.g. trim or population
+
+    Returns:
+    - DataFrame with the column 'weight'
+    """
+    df = df.copy()
+    if margins is None:
+        df['weight'] = 1.0
+        return df
+
+    df['weight'], diagnostics = rake_weights(df, margins, **kwargs)
+    print(f"Raking {'converged' if diagnostics['converged'] else 'did not converge'} "
+          f"after {diagnostics['iterations']} iterations, "
+          f"largest margin deviation {diagnostics['max_deviation']:.2g}, "
+          f"weights {diagnostics['weight_range'][0]:.2f} to {diagnostics['weight_range'][1]:.2f} "
+          f"times the canton mean")
+    print(f"Largest design effect: {diagnostics['design_effect'].max():.2f}")
+    return df
+
+
+@instrumented()
+def translate_conjoints(df):
+    """
+    Translate the DE/FR/IT conjoint attribute levels to English.
+
+    Parameters:
+    - df: pandas DataFrame as returned by recode_demographics
+
+    Returns:
+    - DataFrame with translated conjoint table columns
+    """
+    conjoint_dict = translation_dict_heat | translate_dict_pv
+    return apply_mapping(df, conjoint_dict, column_pattern='table')
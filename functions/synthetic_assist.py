@@ -0,0 +1,215 @@
+import csv
+import pandas as pd
+import numpy as np
+from functions.survey_assist import (rating_values, demographics_dict,
+                                     translation_dict_heat, translate_dict_pv,
+                                     just_columns)
+
+
+# cantons as exported by Qualtrics, with approximate permanent resident
+# population (thousands, 2023) used to draw realistic canton sizes
+canton_population = {
+    "Zurich": 1579, "Bern": 1063, "Lucerne": 424, "Uri": 38, "Schwyz": 165,
+    "Obwalden": 39, "Nidwalden": 44, "Glarus": 41, "Zug": 131,
+    "Fribourg": 334, "Solothurn": 283, "Basel-Stadt": 201,
+    "Basel-Landschaft": 295, "Schaffhausen": 85,
+    "Appenzell Ausserrhoden": 56, "Appenzell Innerrhoden": 16,
+    "St. Gallen": 520, "Graubünden": 203, "Aargau": 711, "Thurgau": 289,
+    "Ticino": 356, "Vaud": 836, "Valais": 357, "Neuchâtel": 178,
+    "Geneva": 514, "Jura": 74
+}
+
+# raw Qualtrics column names and English levels of each conjoint attribute
+levels_heat = {
+    "year": ["2050", "2045", "2040", "2035", "2030"],
+    "tax": ["0%", "25%", "50%", "75%", "100%"],
+    "ban": ["No ban", "Ban on new installations",
+            "Ban and fossil heating replacement"],
+    "heatpump": ["Subsidy", "Governmental lease", "Subscription"],
+    "energyclass": ["New buildings must be energy efficient",
+                    "New buildings must be energy efficient and produce renewable electricity on-site",
+                    "All buildings need to be energy efficient",
+                    "All buildings need to be energy efficient and produce renewable electricity on-site"],
+    "exemption": ["No exemptions", "Low-income households are exempted",
+                  "Low and middle-income households are exempted"]
+}
+
+levels_pv = {
+    "TargetMix": ["More hydro", "More solar", "More wind"],
+    "Imports": ["0%", "10%", "20%", "30%"],
+    "RooftopSolarPV": ["No obligation", "New public and commercial buildings",
+                       "New and existing public and commercial buildings",
+                       "All new buildings", "All new and existing buildings"],
+    "Infrastructure": ["No trade-offs", "Alpine regions", "Agricultural areas",
+                       "Forests", "Rivers", "Lakes"],
+    "Distribution": ["No agreed distribution", "Potential-based",
+                     "Equal per person", "Minimum limit", "Maximum limit"]
+}
+
+# answer options of the demographic questions, as keys of demographics_dict
+demographic_options = {
+    "gender": ["Weiblich", "Männlich", "Nicht-binär"],
+    "age": ["18-39 Jahre", "40-64 Jahre", "65-79 Jahre", "80 Jahre oder älter"],
+    "region": ["Deutschsprachige Schweiz", "Französischsprachige Schweiz",
+               "Italienischsprachige Schweiz", "Rätoromanische Schweiz"],
+    "citizen": ["Ja", "Nein"],
+    "education": ["Keine Matura", "Matura oder Berufsausbildung",
+                  "Abschluss einer Fachhochschule oder Universität"],
+    "urbanness": ["Stadt", "Agglomeration", "Land"],
+    "renting": ["Mieter:in", "Besitzer:in"],
+    "income": [key for key in demographics_dict if "CHF" in key or key == "Über 250,000"],
+    "party": ["Grüne Partei der Schweiz (GPS)",
+              "Sozialdemokratische Partei der Schweiz (SP)",
+              "Grünliberale Partei (GLP)", "Die Mitte (ehemals CVP/BDP)",
+              "Die Liberalen (FDP)", "Schweizerische Volkspartei (SVP)",
+              "Andere", "Keine", "Möchte ich nicht sagen"]
+}
+
+survey_languages = ["Deutsch", "Französisch", "Italienisch"]
+
+
+def raw_level_table(levels, translation_dict):
+    """
+    Collect the raw DE/FR/IT labels of each attribute level.
+
+    Parameters:
+    - levels: list of English levels of one attribute
+    - translation_dict: dictionary mapping raw labels to English levels
+
+    Returns:
+    - array of shape (levels, languages) with one raw label per language,
+    levels without translation keep their English label
+    """
+    table = np.empty((len(levels), len(survey_languages)), dtype=object)
+    for i, level in enumerate(levels):
+        synonyms = [raw for raw, english in translation_dict.items() if english == level] or [level]
+        table[i] = [synonyms[lang % len(synonyms)] for lang in range(len(survey_languages))]
+    return table
+
+
+def generate_qualtrics_export(n_respondents,
+                              seed=42,
+                              start_id=0,
+                              n_tasks=7,
+                              share_heat=0.5,
+                              share_straightliners=0.03,
+                              share_incomplete=0.02,
+                              share_preview=0.001,
+                              share_quota_full=0.01):
+    """
+    Generate a synthetic wide Qualtrics export of the conjoint survey.
+
+    Column naming follows the real export: attribute tables are stored in
+    'choice{task}_{attribute}_table{package}', choices in '{task}_{x}-choice',
+    ratings in '{task}_{x}-rating_{package}' and the justice section in
+    'justice-{topic}_{item}'. Task 8 repeats task 1, so it has choice and
+    rating columns but no attribute tables. As in the real export, the pv
+    tables are filled for all respondents, while the heat tables and all
+    choices and ratings are only filled for the experiment shown.
+
+    Parameters:
+    - n_respondents: number of rows to generate
+    - seed: seed of the random number generator
+    - start_id: offset for the ResponseId, used when generating in chunks
+    - n_tasks: number of distinct choice tasks per respondent
+    - share_heat: share of respondents assigned to the heat experiment
+    - share_straightliners: share of respondents giving the same answer to
+    all justice questions
+    - share_incomplete, share_preview, share_quota_full: shares of rows that
+    data cleaning should filter out
+
+    Returns:
+    - DataFrame with one row per response and Qualtrics column names
+    """
+    rng = np.random.default_rng(seed)
+    n = n_respondents
+    data = {}
+
+    # metadata
+    data["ResponseId"] = [f"R_{i:015d}" for i in range(start_id, start_id + n)]
+    data["DistributionChannel"] = np.where(rng.random(n) < share_preview, "preview", "anonymous")
+    data["Finished"] = np.where(rng.random(n) < share_incomplete, "False", "True")
+    data["Duration (in seconds)"] = np.round(rng.lognormal(np.log(900), 0.5, n)).astype(int)
+    language = rng.integers(0, len(survey_languages), n)
+    data["languge"] = np.array(survey_languages, dtype=object)[language]
+
+    # demographics
+    cantons = np.array(list(canton_population), dtype=object)
+    weights = np.array(list(canton_population.values()), dtype=float)
+    canton = cantons[rng.choice(len(cantons), n, p=weights / weights.sum())]
+    canton[rng.random(n) < share_quota_full] = np.nan
+    data["canton"] = canton
+    for column, options in demographic_options.items():
+        data[column] = np.array(options, dtype=object)[rng.integers(0, len(options), n)]
+    data["household-size"] = rng.integers(1, 7, n)
+    for item in range(1, 4):
+        data[f"trust_{item}"] = rng.integers(0, 11, n)
+    data["satisfaction_1"] = rng.integers(0, 11, n)
+    data["literacy6_5"] = rng.integers(0, 101, n)
+
+    # justice section, straightliners give one answer to all questions
+    likert = np.array(rating_values, dtype=object)
+    justice = rng.integers(0, len(likert), (n, len(just_columns)))
+    straightliners = rng.random(n) < share_straightliners
+    justice[straightliners] = justice[straightliners, :1]
+    for j, column in enumerate(just_columns):
+        data[column.replace("justice_", "justice-", 1)] = likert[justice[:, j]]
+
+    # conjoint experiments
+    heat = rng.random(n) < share_heat
+    for x, levels, translation_dict, shown in [
+            ("heat", levels_heat, translation_dict_heat, heat),
+            ("pv", levels_pv, translate_dict_pv, ~heat)]:
+        for task in range(1, n_tasks + 1):
+            for attribute, english in levels.items():
+                raw = raw_level_table(english, translation_dict)
+                for pack in (1, 2):
+                    values = raw[rng.integers(0, len(english), n), language]
+                    if x == "heat":
+                        values[~shown] = np.nan
+                    data[f"choice{task}_{attribute}_table{pack}"] = values
+            data[f"choice{task}_{x}_Table"] = np.full(n, np.nan)
+        for task in range(1, n_tasks + 2):
+            choice = np.where(rng.random(n) < 0.5, "Massnahmenpaket 1", "Massnahmenpaket 2").astype(object)
+            choice[~shown] = np.nan
+            data[f"{task}_{x}-choice"] = choice
+            for pack in (1, 2):
+                rating = likert[rng.integers(0, len(likert), n)]
+                rating[~shown] = np.nan
+                data[f"{task}_{x}-rating_{pack}"] = rating
+
+    return pd.DataFrame(data)
+
+
+def write_qualtrics_export(path,
+                           n_respondents,
+                           seed=42,
+                           chunk_size=100_000,
+                           **kwargs):
+    """
+    Write a synthetic Qualtrics export to csv, including the question text
+    and import id header rows, generating it in chunks to bound memory.
+
+    Parameters:
+    - path: path of the csv file to write
+    - n_respondents: number of rows to generate
+    - seed: seed of the random number generator, each chunk uses seed + chunk nr
+    - chunk_size: number of rows generated and written at once
+    - kwargs: passed on to generate_qualtrics_export
+
+    Returns:
+    - path of the written file
+    """
+    for nr, start in enumerate(range(0, n_respondents, chunk_size)):
+        chunk = generate_qualtrics_export(min(chunk_size, n_respondents - start),
+                                          seed=seed + nr,
+                                          start_id=start,
+                                          **kwargs)
+        if nr == 0:
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(chunk.columns)
+                writer.writerow(chunk.columns) # question text
+                writer.writerow([f'{{"ImportId":"{col}"}}' for col in chunk.columns])
+        chunk.to_csv(path, mode="a", header=False, index=False)
+    return path
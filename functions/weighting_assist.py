@@ -0,0 +1,164 @@
+import pandas as pd
+import numpy as np
+
+
+# variables raked to population margins by default, as recoded by recode_demographics
+weighting_variables = ["gender", "age", "education", "region", "urbanness"]
+
+
+def read_margins(path):
+    """
+    Read population margins from a long csv file.
+
+    Parameters:
+    - path: csv with the columns 'variable', 'category', 'share' and
+    optionally 'canton'; rows without canton apply to all cantons
+
+    Returns:
+    - dictionary of variable to target shares, a Series indexed by category
+    for national margins or a DataFrame with one row per canton and one
+    column per category for cantonal margins
+    """
+    table = pd.read_csv(path)
+    if "canton" not in table:
+        table["canton"] = np.nan
+    margins = {}
+    for variable, rows in table.groupby("variable", sort=False):
+        if rows["canton"].isna().all():
+            margins[variable] = rows.set_index("category")["share"]
+        else:
+            margins[variable] = rows.pivot(index="canton", columns="category", values="share").fillna(0)
+    return margins
+
+
+def trim_weights(weights, groups, trim, max_iter=100, tol=1e-9):
+    """
+    Scale weights to mean one within each group and clip them to the trim
+    bounds, alternately until the weights have mean one and are within the
+    bounds. The bounds must include one.
+
+    Parameters:
+    - weights: array of weights
+    - groups: integer group code of each weight
+    - trim: lower and upper bound of the weights relative to the group
+    mean, or None to only scale
+    - max_iter: maximum number of scale and clip steps
+    - tol: tolerance of the bounds
+
+    Returns:
+    - array of weights with mean one per group
+    """
+    group_count = np.bincount(groups).astype(float)
+    for _ in range(max_iter):
+        weights = weights * (group_count / np.bincount(groups, weights=weights))[groups]
+        if trim is None or ((weights >= trim[0] - tol) & (weights <= trim[1] + tol)).all():
+            break
+        weights = np.clip(weights, trim[0], trim[1])
+    return weights
+
+
+def rake_weights(df,
+                 margins,
+                 group="canton",
+                 population=None,
+                 max_iter=100,
+                 tol=1e-6,
+                 trim=(0.2, 5.0)):
+    """
+    Rake respondent weights to population margins within each canton.
+
+    All cantons are raked at once: per variable, the weighted counts of
+    every canton and category come from one bincount over the combined
+    canton-category code. Respondents with a missing value of a variable
+    keep their weight for that variable.
+
+    Parameters:
+    - df: pandas DataFrame with one row per respondent
+    - margins: dictionary as returned by read_margins, shares are
+    normalised to sum to one per canton over the observed categories
+    - group: column the weights are raked within
+    - population: optional dictionary of canton to population, weights
+    then sum to the population shares times the number of respondents;
+    otherwise they have mean one in every canton
+    - max_iter: maximum number of raking iterations
+    - tol: largest absolute difference between weighted and target
+    shares at which raking stops
+    - trim: lower and upper bound of the weights relative to the canton
+    mean, applied in every iteration with trim_weights, or None
+
+    Returns:
+    - Series of weights with the index of df
+    - dictionary with the 'iterations', whether raking 'converged', the
+    final 'max_deviation' from the margins, the smallest and largest weight
+    relative to its canton mean as 'weight_range' and the Kish 
+    'design_effect' per canton
+    """
+    groups, group_names = pd.factorize(df[group], sort=True)
+    n_groups = len(group_names)
+    group_count = np.bincount(groups, minlength=n_groups).astype(float)
+
+    # category codes and target shares (cantons x categories) per variable
+    coded = []
+    for variable, shares in margins.items():
+        if isinstance(shares, pd.Series):
+            shares = pd.DataFrame([shares.values] * n_groups, index=group_names, columns=shares.index)
+        shares = shares.reindex(group_names)
+        if shares.isna().all(axis=1).any():
+            missing = list(shares.index[shares.isna().all(axis=1)])
+            raise ValueError(f"No {variable} margins for {missing}.")
+        codes = pd.Categorical(df[variable], categories=shares.columns).codes
+        target = shares.fillna(0).to_numpy(dtype=float)
+        # keep the categories present in each canton, so the shares stay reachable
+        present = np.bincount(groups[codes >= 0] * target.shape[1] + codes[codes >= 0],
+                              minlength=target.size).reshape(target.shape) > 0
+        target = np.where(present, target, 0)
+        target /= target.sum(axis=1, keepdims=True)
+        coded.append((codes, target))
+
+    weights = np.ones(len(df))
+    converged = False
+    deviation = 0.0
+    for iteration in range(1, max_iter + 1):
+        for codes, target in coded:
+            valid = codes >= 0
+            cell = groups * target.shape[1] + np.where(valid, codes, 0)
+            totals = np.bincount(cell[valid], weights=weights[valid],
+                                 minlength=target.size).reshape(target.shape)
+            valid_total = totals.sum(axis=1, keepdims=True)
+            factor = np.divide(target * valid_total, totals,
+                               out=np.ones_like(totals), where=totals > 0)
+            weights = np.where(valid, weights * factor.ravel()[cell], weights)
+
+        # mean one per canton and within the trim bounds relative to it
+        weights = trim_weights(weights, groups, trim)
+
+        deviation = 0.0
+        for codes, target in coded:
+            valid = codes >= 0
+            cell = groups * target.shape[1] + np.where(valid, codes, 0)
+            totals = np.bincount(cell[valid], weights=weights[valid],
+                                 minlength=target.size).reshape(target.shape)
+            shares = totals / np.maximum(totals.sum(axis=1, keepdims=True), np.finfo(float).tiny)
+            deviation = max(deviation, np.abs(shares - target).max())
+        if deviation < tol:
+            converged = True
+            break
+
+    # the population scaling is constant per canton, the weights relative to
+    # the canton mean stay within the trim bounds
+    relative = weights / (np.bincount(groups, weights=weights, minlength=n_groups) / group_count)[groups]
+    if population is not None:
+        population_share = pd.Series(population).reindex(group_names).to_numpy(dtype=float)
+        population_share = population_share / population_share.sum()
+        weights *= (population_share * len(df) / group_count)[groups]
+
+    weight_sum = np.bincount(groups, weights=weights, minlength=n_groups)
+    squared_sum = np.bincount(groups, weights=weights ** 2, minlength=n_groups)
+    design_effect = pd.Series(group_count * squared_sum / weight_sum ** 2, index=group_names)
+
+    return (pd.Series(weights, index=df.index, name="weight"),
+            {"iterations": iteration,
+             "converged": converged,
+             "max_deviation": float(deviation),
+             "weight_range": (float(relative.min()), float(relative.max())),
+             "design_effect": design_effect})
@@ -0,0 +1,50 @@
+import pandas as pd
+from functions.compile_assist import use_compile_cache, pytensor_flags
+
+# run from the repository root with
+# python -m scripts.benchmark_float32
+
+# persistent compilation cache, set before pymc is imported
+use_compile_cache(**pytensor_flags)
+
+from functions.recovery_assist import true_parameters, fit_simulated, posterior_agreement
+from functions.benchmark_assist import save_benchmark
+
+# %% settings
+
+experiments = ["pv", "heat"]
+
+# respondent counts to simulate, the real data has roughly 1000 per experiment
+sizes = [1000, 4000]
+
+variant = "hierarchical"
+sampler_settings = {"draws": 1000, "tune": 500, "chains": 4, "cores": 4, "target_accept": 0.9}
+
+# %% fit each design in float64 and float32 with the same seed
+
+results = []
+
+for experiment in experiments:
+    truth = true_parameters(experiment)
+    for n in sizes:
+        fits = {}
+        for dtype in ["float64", "float32"]:
+            record, fits[dtype] = fit_simulated(experiment, n, truth,
+                                                variant = variant,
+                                                sampler_settings = sampler_settings,
+                                                dtype = dtype,
+                                                return_inference_data = True)
+            results.append(record)
+        # posterior of float32 relative to float64
+        record.update(posterior_agreement(fits["float32"], fits["float64"]))
+        print(record)
+
+# %% save and compare
+
+path = save_benchmark(results, 'float32', variant = variant, sampler_settings = sampler_settings)
+
+pd.DataFrame(results)[["experiment", "n_respondents", "dtype", "sample_s", "trace_mb",
+                       "ess_bulk_per_s", "divergences", "r_hat_max",
+                       "beta_max_mean_diff_sd", "beta_sd_ratio_min", "beta_sd_ratio_max"]]
+
+# %%
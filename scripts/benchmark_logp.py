@@ -0,0 +1,62 @@
+import glob
+import pandas as pd
+from functions.compile_assist import use_compile_cache, pytensor_flags
+
+# run from the repository root with
+# python -m scripts.benchmark_logp
+
+# persistent compilation cache, set before pymc is imported
+use_compile_cache(**pytensor_flags)
+
+from functions.compile_assist import time_logp_design
+from functions.benchmark_assist import save_benchmark, compare_benchmarks
+
+# %% settings
+
+experiments = ["pv", "heat"]
+
+# respondent counts to simulate, the real data has roughly 1000 per experiment
+sizes = [250, 1000, 4000]
+
+# design layouts of the likelihood, float32 is the dense layout in float32
+formulations = ["dense", "difference", "gather", "float32"]
+
+variant = "hierarchical"
+
+# least wall time spent evaluating per design and formulation
+min_time_s = 2.0
+
+# %% time logp and gradient per design, size and formulation
+
+results = []
+
+for experiment in experiments:
+    for n in sizes:
+        for formulation in formulations:
+            record = time_logp_design(experiment, n, formulation, variant = variant, 
+                                      min_time_s = min_time_s)
+            print(record)
+            results.append(record)
+
+# %% save and compare the formulations
+
+previous = sorted(glob.glob("output/benchmarks/logp-*.json"))
+path = save_benchmark(results, 'logp', variant = variant, min_time_s = min_time_s)
+
+# speed and allocations relative to the dense one-hot design
+table = pd.DataFrame(results).set_index(["experiment", "n_respondents", "formulation"])
+dense = table.xs("dense", level = "formulation")
+table["speedup"] = (dense["us_per_eval"].reindex(table.index.droplevel("formulation")).values 
+                    / table["us_per_eval"]).round(2)
+table["alloc_ratio"] = (table["peak_alloc_kb"] 
+                        / dense["peak_alloc_kb"].reindex(table.index.droplevel("formulation")).values).round(2)
+table[["tasks", "parameters", "evals_per_s", "us_per_eval", "speedup", "peak_alloc_kb", "alloc_ratio"]]
+
+# %% compare with the previous run, to track regressions over time
+
+if previous:
+    compare_benchmarks(path, previous[-1], 
+                       keys = ["experiment", "n_respondents", "formulation"], 
+                       metrics = ["us_per_eval", "peak_alloc_kb"])
+
+# %%
@@ -0,0 +1,98 @@
+import os
+import tempfile
+from functions.synthetic_assist import write_qualtrics_export
+from functions.benchmark_assist import profile_stage, save_benchmark, compare_benchmarks
+from functions.survey_assist import (read_export, clean_export, flag_respondents,
+                                     drop_flagged, recode_demographics, weight_respondents,
+                                     translate_conjoints, respondent_columns,
+                                     heat_regex, heat_filemarker,
+                                     pv_regex, pv_filemarker)
+from functions.conjoint_assist import prep_conjoint, respondent_table
+
+# run from the repository root with
+# python -m scripts.benchmark_pipeline
+
+# %% settings
+
+# respondent counts to benchmark, 1M needs several GB of memory in prep_conjoint
+sizes = [1_000, 10_000, 100_000, 1_000_000]
+
+# tracemalloc slows down allocation-heavy stages, switch off for pure timings
+trace_memory = True
+
+# stacked table layouts, respondent data on every row or in a dimension table
+layouts = ['wide', 'star']
+
+# previous benchmark file to compare against, None to skip the comparison
+baseline = None
+
+# %% run benchmarks
+
+results = []
+
+# the exports and stacked csv files take several GB at 1M respondents, the
+# directory is removed when done or interrupted
+with tempfile.TemporaryDirectory(prefix='benchmark-pipeline-') as workdir:
+    for n in sizes:
+        raw_path = f'{workdir}/raw_conjoint_{n}.csv'
+
+        with profile_stage(results, 'generate', trace_memory=False, n_respondents=n) as record:
+            write_qualtrics_export(raw_path, n)
+            record['file_mb'] = round(os.path.getsize(raw_path) / 1e6, 2)
+
+        with profile_stage(results, 'read_export', trace_memory, n_respondents=n) as record:
+            df = read_export(raw_path)
+            record['rows'] = len(df)
+
+        with profile_stage(results, 'clean_export', trace_memory, n_respondents=n) as record:
+            df = clean_export(df)
+            record['rows'] = len(df)
+
+        with profile_stage(results, 'flag_respondents', trace_memory, n_respondents=n) as record:
+            df = flag_respondents(df)
+            record['rows'] = len(df)
+
+        with profile_stage(results, 'drop_flagged', trace_memory, n_respondents=n) as record:
+            df = drop_flagged(df)
+            record['rows'] = len(df)
+
+        with profile_stage(results, 'recode_demographics', trace_memory, n_respondents=n) as record:
+            df = recode_demographics(df)
+            record['rows'] = len(df)
+
+        with profile_stage(results, 'weight_respondents', trace_memory, n_respondents=n) as record:
+            df = weight_respondents(df)
+            record['rows'] = len(df)
+
+        with profile_stage(results, 'translate_conjoints', trace_memory, n_respondents=n) as record:
+            df = translate_conjoints(df)
+            record['rows'] = len(df)
+
+        # the star layout stores the respondent table once for both experiments
+        with profile_stage(results, 'respondent_table', trace_memory, n_respondents=n) as record:
+            respondents = {'wide': df[respondent_columns], 'star': respondent_table(df[respondent_columns])}
+            respondents['star'].to_csv(f'{workdir}/respondents.csv', index=False)
+            record['rows'] = len(respondents['star'])
+            record['file_mb'] = round(os.path.getsize(f'{workdir}/respondents.csv') / 1e6, 2)
+
+        for layout in layouts:
+            for regex, filemarker in [(heat_regex, heat_filemarker), (pv_regex, pv_filemarker)]:
+                with profile_stage(results, f'prep_conjoint_{filemarker}', trace_memory, 
+                                   n_respondents=n, layout=layout) as record:
+                    stacked = prep_conjoint(df, respondent_columns=respondents[layout], regex_list=regex,
+                                            filemarker=filemarker, output_dir=workdir, layout=layout)
+                    record['rows'] = len(stacked)
+                    record['memory_mb'] = round(stacked.memory_usage(deep=True).sum() / 1e6, 2)
+                    record['file_mb'] = round(os.path.getsize(f'{workdir}/{filemarker}-conjoint.csv') / 1e6, 2)
+
+        del df, respondents, stacked
+        os.remove(raw_path)
+
+# %% save and compare
+
+path = save_benchmark(results, 'pipeline', sizes=sizes, trace_memory=trace_memory)
+
+if baseline is not None:
+    print(compare_benchmarks(path, baseline, keys=['stage', 'n_respondents', 'layout']))
+
+# %%
@@ -0,0 +1,53 @@
+import pandas as pd
+from functions.compile_assist import use_compile_cache, pytensor_flags
+
+# run from the repository root with
+# python -m scripts.benchmark_sampler
+
+# persistent compilation cache, set before pymc is imported
+use_compile_cache(**pytensor_flags)
+
+from functions.recovery_assist import true_parameters, fit_simulated
+from functions.benchmark_assist import save_benchmark
+
+# %% settings
+
+experiments = ["pv", "heat"]
+
+# respondent counts to simulate, the real data has roughly 1000 per experiment
+sizes = [250, 1000, 4000]
+
+# model variants and sampler settings to compare, every combination is fitted
+variants = ["hierarchical", "centered"]
+sampler_settings = [
+    {"draws": 1000, "tune": 500, "chains": 4, "cores": 4, "target_accept": 0.9},
+]
+
+# known parameter values the choices are simulated from
+beta_scale = 0.5
+canton_sigma = 0.3
+
+# %% run benchmarks
+
+results = []
+
+for experiment in experiments:
+    truth = true_parameters(experiment, beta_scale=beta_scale, canton_sigma=canton_sigma)
+    for n in sizes:
+        for variant in variants:
+            for settings in sampler_settings:
+                record = fit_simulated(experiment, n, truth, variant=variant, sampler_settings=settings)
+                print(record)
+                results.append(record)
+
+# %% save and compare
+
+path = save_benchmark(results, 'sampler',
+                      beta_scale=beta_scale,
+                      canton_sigma=canton_sigma)
+
+pd.DataFrame(results)[["experiment", "n_respondents", "variant", "sample_s",
+                       "ess_bulk_per_s", "divergences", "r_hat_max",
+                       "rmse_beta_mean", "rmse_beta"]]
+
+# %%
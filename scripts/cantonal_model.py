@@ -1,253 +1,175 @@
+# persistent compilation cache shared with the other scripts and workers,
+# set before pymc is imported, with the shared flags of all scripts
+from functions.compile_assist import use_compile_cache, precompile, pytensor_flags
+use_compile_cache(**pytensor_flags)
+
 import pymc as pm 
 import pandas as pd
 import arviz as az
 import xarray as xr
-from functions.data_assist import apply_mapping
+from functions.model_assist import (prepare_model_data, build_model, choice_arrays, collapse_choice_sets, 
+                                    compression_report, float_mode)
+from functions.design_assist import attach_encoder
+from functions.conjoint_assist import read_conjoint
+from functions.posterior_assist import simulate_support, single_change_packages, support_summary
+from functions.instrument_assist import start_run, stage, write_run_report
+from functions.resource_assist import core_layout, limit_blas_threads, log_layout
+from functions.sampling_assist import adaptive_sample, warm_start_sample
+from functions.registry_assist import fit_config, fit_key, find_fit, save_fit
 
-# %% pymc bug workaround
+# %% import data
 
-import pytensor
-pytensor.config.cxx = '/usr/bin/clang++'
+experiment = "pv"
 
-# %% import data
+# weight the likelihood by the respondents' raking weights, see data_prep
+weighted = False
 
-df_pv = pd.read_csv("data/pv-conjoint.csv")
-df_heat = pd.read_csv("data/heat-conjoint.csv")
-
-# %% define lists and translations
-
-attributes_pv = [ 
-    "mix", 
-    "imports",
-    "pv",
-    "tradeoffs", 
-    "distribution"
-]
-
-attributes_heat = [
-    "year",
-    "tax",
-    "ban",
-    "heatpump",
-    "energyclass",
-    "exemption"
-]
-
-baselines_pv = [
-    "mix:hydro",
-    "imports:0%",
-    "pv:none", 
-    "tradeoffs:none",
-    "distribution:none"
-]
-
-baselines_heat = [
-    "year:2050", 
-    "tax:0%",
-    "ban:none",
-    "heatpump:subsidy",
-    "energyclass:new-only-efficient",
-    "exemption:none"
-]
-
-translate_dict_pv = {
-    # target mix
-    'More hydro': 'hydro',
-    'More solar': 'solar',
-    'More wind': 'wind',
-
-    # rooftop pv requirements
-    'No obligation': 'none',
-    'New public and commercial buildings': 'new-non-residential',
-    'New and existing public and commercial buildings': 'all-non-residential',
-    'All new buildings': 'all-new',
-    'All new and existing buildings': 'all',
-
-    # biodiversity tradeoffs
-    'No trade-offs': 'none',
-    'Alpine regions': 'alpine',
-    'Agricultural areas': 'agricultural',
-    'Forests': 'forests',
-    'Rivers': 'rivers',
-    'Lakes': 'lakes',
-
-    # cantonal distribution
-    'No agreed distribution': 'none',
-    'Potential-based': 'potential-based',
-    'Equal per person': 'equal-pp', 
-    'Minimum limit': 'min-limit',
-    'Maximum limit': 'max-limit',
-}
-
-translate_dict_heat = {
-    # ban
-    'No ban': 'none',
-    'Ban on new installations': 'new',
-    'Ban and fossil heating replacement': 'all',
-
-    # heatpump
-    'Subsidy': 'subsidy',
-    'Governmental lease': 'lease',
-    'Subscription': 'subscription',
-
-    # energyclass 
-    'New buildings must be energy efficient': 'new-only-efficient',
-    'New buildings must be energy efficient and produce renewable electricity on-site': 'new-efficient-renewable',
-    'All buildings must be energy efficient': 'all-retrofit', 
-    'All buildings must be energy efficient and produce renewable electricity on-site': 'all-retrofit-renewable',
-
-    # exemptions
-    'No exemptions': 'none',
-    'Low-income households are exempted': 'low',
-    'Low and middle-income households are exempted': 'low-mid'
-}
+# fit identical choice sets per canton as binomial trials, same posterior 
+# with fewer likelihood terms
+collapsed = False
 
-# %% define dummies
+# build and sample the model in 'float32' for speed and half the trace 
+# memory, scripts/benchmark_float32.py compares its posterior with float64
+dtype = "float64"
 
-df = df_pv
-translate_dict = translate_dict_pv
-attributes = attributes_pv
-baselines = baselines_pv
+# record time and memory per stage to output/reports
+start_run("cantonal_model", experiment = experiment)
 
-df = apply_mapping(df, translate_dict)
+with stage("read_data"):
+    df = read_conjoint(f"data/{experiment}-conjoint.csv")
 
-# set baselines
-baseline_dict = {attr.split(":")[0]: attr.split(":")[1] for attr in baselines}
+# %% look up the fit registry
 
-# Reorder each attribute column by making it categorical with the baseline first
-for attr in attributes:
-    baseline = baseline_dict[attr]
-    df[attr] = pd.Categorical(df[attr], categories=[baseline] + 
-                              [level for level in df[attr].unique() if level != baseline], 
-                              ordered=True)
+# fits are registered by a hash of the stacked data, the attributes and 
+# baselines, the model variant and the sampler settings, an existing fit 
+# is loaded instead of sampling again; 'spatial' lets cantons borrow 
+# strength from their neighbours, the adjacency is cached in 
+# data/canton_adjacency.npz from the swissBOUNDARIES3D shapefile
+variant = "hierarchical"
 
-# Generate dummies with columns in the correct order
-dummies = pd.get_dummies(df[attributes], drop_first=False)
+# blocks of 500 draws after 500 tune samples, and 4 chains, until R-hat, bulk 
+# and tail ESS of beta_mean and canton_sigma reach the targets in 
+# convergence_targets, or up to 4 h
+sampler_settings = {"block_draws": 500, "tune": 500, "max_blocks": 8, 
+                    "time_budget_s": 4 * 3600, "chains": 4, 
+                    "random_seed": 42, "target_accept": 0.9}
 
-# Reorder columns to place baseline first for each attribute
-ordered_columns = []
-for attr in attributes:
-    # Collect the columns related to the attribute and put baseline first
-    attr_columns = [col for col in dummies.columns if col.startswith(attr)]
-    baseline_column = f"{attr}_{baseline_dict[attr]}"
-    ordered_columns.append(baseline_column)
-    ordered_columns.extend([col for col in attr_columns if col != baseline_column])
+# start the chains and mass matrix from a previous fit of the same model, 
+# e.g. lookup_fit(experiment, variant) after adding respondents, or from 
+# 'advi' or 'pathfinder', and tune only warm_start_tune steps; None samples
+# adaptively from the default initialisation
+warm_start = None
+warm_start_tune = 100
 
-# Reorder dummies according to ordered columns list
-dummies = dummies[ordered_columns]
-dummies = dummies.loc[:, ~dummies.columns.duplicated()]
+fit_settings = fit_config(df, experiment, variant, sampler_settings, 
+                          weighted = weighted, collapsed = collapsed, dtype = dtype,
+                          warm_start = warm_start, warm_start_tune = warm_start_tune)
+key = fit_key(fit_settings)
+registered = find_fit(key)
 
-df["canton"] = df["canton"].astype("category")
+# %% define dummies
 
-#TODO add task dimension but doesn't yet exist in the data maybe add in the dataframe itself
-coords = {"level": dummies.columns.values, 
-          "canton": df["canton"].cat.categories,}
+# translate levels and set baselines first for each attribute
+with stage("encode_dummies") as record:
+    df, dummies, encoder = prepare_model_data(df, experiment)
+    record["rows"] = len(df)
 
 # %% build model
 
-with pm.Model(coords = coords) as bayes_model: 
-    beta_mean = pm.Normal("beta_mean", 0, sigma = 2, dims = "level")
-
-    canton_mean = pm.Normal(
-        "canton_mean", 
-        0, 
-        sigma = 1, 
-        dims = ["canton", "level"])
-    
-    canton_sigma = pm.Exponential(
-        "canton_sigma", 
-        1, 
-        dims = "level")
-
-    canton_effect = pm.Deterministic(
-        "canton_effect", 
-        canton_mean * canton_sigma,
-        dims = ["canton", "level"])
-    
-    # column of which canton index per task
-    c = pm.Data(
-        "c", 
-        df.loc[df.pack_num_cat == "Left", "canton"].cat.codes, 
-        dims = "task"
-    )
-
-    beta = pm.Deterministic(
-        "beta", 
-        beta_mean + canton_effect, 
-        dims = ["canton", "level"]
-    )
-
-    observed_choice_left = pm.Data(
-        "observed_choice_left", 
-        df.loc[df.pack_num_cat == "Left", "Y"].values, 
-        dims = ["task"]
-    )
-
-    attribute_levels_left = pm.Data(
-        "attribute_levels_left", 
-        dummies[df.pack_num_cat == "Left"].values, 
-        dims = ["task", "level"])
-    
-    utility_left = pm.Deterministic(
-        "utility_left",
-        pm.math.sum(attribute_levels_left * beta[c, :], axis = 1), 
-        dims = "task")
-    
-    attribute_levels_right = pm.Data(
-        "attribute_levels_right", 
-        dummies[df.pack_num_cat == "Right"].values, 
-        dims = ["task", "level"])
-    
-    utility_right = pm.Deterministic(
-        "utility_right",
-        pm.math.sum(attribute_levels_right * beta[c, :], axis = 1), 
-        dims = "task")
-    
-    probability_choice_left = pm.Deterministic(
-        "probability_choice_left", 
-        pm.math.exp(utility_left)/(pm.math.exp(utility_left)+pm.math.exp(utility_right)))
-
-    choice_distribution = pm.Bernoulli(
-        "choice_distirbution",
-        p = probability_choice_left, 
-        observed = observed_choice_left)
-
-    
+with stage("build_model", dtype = dtype) as record, float_mode(dtype):
+    bayes_model = build_model(df, dummies, variant = variant, weighted = weighted, collapsed = collapsed)
+    # tasks per unique choice set, e.g. the repeated task 8
+    compression = compression_report(collapse_choice_sets(choice_arrays(df, dummies)))
+    record.update(compression)
+print(compression)
+
+# compile logp and gradient once up front, so the C compilation is cached 
+# and not counted in the sampling stage, fast if scripts/precompile.py ran
+with stage("compile") as record, float_mode(dtype):
+    record["compile_s"] = precompile(bayes_model)
 
 # %% get priors
 
-priors = pm.sample_prior_predictive(
-    samples = 1000, 
-    model = bayes_model, 
-    random_seed = 42, 
-)
+# the ICAR prior of the spatial variant is improper and can't be sampled
+if variant != "spatial":
+    with stage("sample_prior_predictive"), float_mode(dtype):
+        priors = pm.sample_prior_predictive(
+            samples = 1000, 
+            model = bayes_model, 
+            random_seed = 42, 
+        )
 
 # %% check priors
-az.summary(priors, var_names = ["canton_sigma"])
+if variant != "spatial":
+    az.summary(priors, var_names = ["canton_sigma"])
 
 # %% run model with MCMC
 
-# run model with MCMC with 1000 draws, 500 tune samples, and 4 chains on 6 cores
-inference_data = pm.sample(
-    model = bayes_model, 
-    draws = 1000, 
-    tune = 500, 
-    chains = 4,
-    cores = 6, 
-    random_seed = 42, 
-    return_inferencedata = True, 
-    target_accept = 0.9
-)
-
-#TODO you can check the meaning by using the Pr = ... equation (and setting right to 0)
+# one core per chain, spare cores go to BLAS threads within each chain
+layout = core_layout(chains = sampler_settings["chains"], jobs = 1)
+limit_blas_threads(layout["blas_threads"])
+log_layout(layout)
+
+# sample unless the fit is registered, the stopping reason is stored in the 
+# posterior attributes
+if registered:
+    print(f"Loading registered fit {registered}")
+    inference_data = az.from_netcdf(registered)
+elif warm_start:
+    # one block of draws, the report compares the wall time with the 
+    # sampling time of a registered source fit
+    with (stage("sample", warm_start = warm_start, tune = warm_start_tune) as sample_record, 
+          float_mode(dtype)):
+        inference_data, warm_start_report = warm_start_sample(
+            bayes_model, 
+            warm_start, 
+            draws = sampler_settings["block_draws"], 
+            tune = warm_start_tune, 
+            chains = sampler_settings["chains"], 
+            random_seed = sampler_settings["random_seed"], 
+            target_accept = sampler_settings["target_accept"], 
+            cores = layout["cores"]
+        )
+        sample_record["rows"] = int((df.pack_num_cat == "Left").sum())
+        sample_record.update(warm_start_report)
+    print(warm_start_report)
+else:
+    with stage("sample", **sampler_settings) as sample_record, float_mode(dtype):
+        inference_data = adaptive_sample(
+            bayes_model, 
+            cores = layout["cores"], 
+            **sampler_settings
+        )
+        sample_record["rows"] = int((df.pack_num_cat == "Left").sum())
+        sample_record["stopping_reason"] = inference_data.posterior.attrs["stopping_reason"]
+
+# %% predicted support per canton
+
+# probability that a package with one level changed is chosen over the 
+# all-baseline package, Pr = exp(U) / (exp(U) + exp(U_baseline)), per canton and draw
+with stage("simulate_support"):
+    support = simulate_support(inference_data, single_change_packages(encoder), encoder = encoder)
+    support_table = support_summary(support)
 
 # %% diagnostics
 
-inference_data["posterior"]["canton_effect"].mean(["chain", "draw"]).max(["canton"])
-az.plot_trace(inference_data, var_names = ["beta_mean", "canton_sigma", "beta"])
+# the pooled variant has no canton effects
+if "canton_effect" in inference_data.posterior:
+    inference_data["posterior"]["canton_effect"].mean(["chain", "draw"]).max(["canton"])
+az.plot_trace(inference_data, 
+              var_names = [var for var in ["beta_mean", "canton_sigma", "beta"] 
+                           if var in inference_data.posterior])
 
 # %% save to file 
 
-inference_data.to_netcdf("output/inference_data.nc")
+# register the fit with the design encoder, to encode new choice tables 
+# consistently, plots.py looks it up by experiment and configuration
+if not registered:
+    with stage("save"):
+        attach_encoder(inference_data, encoder)
+        save_fit(inference_data, key, fit_settings, 
+                 timings = {"sample_s": sample_record["wall_s"]})
+
+write_run_report()
 
 # %%
@@ -0,0 +1,50 @@
+from functions.compile_assist import use_compile_cache, pytensor_flags
+
+# persistent compilation cache shared by the fold workers, set before pymc is imported
+use_compile_cache(**pytensor_flags)
+
+from functions.model_assist import prepare_model_data
+from functions.cv_assist import cross_validate, cv_summary
+from functions.conjoint_assist import read_conjoint
+from functions.instrument_assist import start_run, stage, write_run_report
+
+# %% settings
+
+experiment = "pv"
+variant = "hierarchical"
+n_folds = 5
+
+# cores used in total, folds run side by side with one core per chain;
+# None uses all CPUs available to the process, including cgroup limits
+core_budget = None
+sampler_settings = {"draws": 1000, "tune": 500, "chains": 4, "target_accept": 0.9}
+
+# the fold workers are separate processes, so run the rest only in the main one
+if __name__ == "__main__":
+
+    # record time and memory per stage to output/reports
+    start_run("cross_validation", experiment = experiment, n_folds = n_folds)
+
+    # %% import data
+
+    with stage("read_data"):
+        df = read_conjoint(f"data/{experiment}-conjoint.csv")
+        df, dummies, encoder = prepare_model_data(df, experiment)
+
+    # %% fit folds holding out whole respondents
+
+    with stage("cross_validate", core_budget = core_budget) as record:
+        scores = cross_validate(df, dummies,
+                                n_folds = n_folds,
+                                variant = variant,
+                                sampler_settings = sampler_settings,
+                                core_budget = core_budget)
+        record["rows"] = len(scores)
+
+    # %% held-out log score and hit rate per canton
+
+    summary = cv_summary(scores, encoder["cantons"])
+    print(summary)
+    summary.to_csv(f"output/cv_{experiment}_{variant}.csv")
+
+    write_run_report()
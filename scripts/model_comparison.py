@@ -0,0 +1,53 @@
+import pandas as pd
+from functions.loo_assist import streaming_loo_waic, compare_fits
+from functions.instrument_assist import start_run, stage, write_run_report
+from functions.registry_assist import lookup_fit, data_hash
+from functions.conjoint_assist import read_conjoint
+
+# %% settings
+
+experiment = "pv"
+
+# variants to compare, the newest registered fit of each on the current
+# stacked data is used; variants without a registered fit are skipped
+variants = ["hierarchical", "centered", "pooled", "spatial"]
+
+# draws per chunk and chain, bounds memory to chunk_size x tasks per fit
+chunk_size = 200
+
+# record time and memory per stage to output/reports
+start_run("model_comparison", experiment = experiment)
+
+# %% PSIS-LOO and WAIC per fit
+
+# the log-likelihood is evaluated from the saved posterior chunk by chunk,
+# so the fits don't need a log_likelihood group
+df = read_conjoint(f"data/{experiment}-conjoint.csv")
+
+results = {}
+for variant in variants:
+    try:
+        path = lookup_fit(experiment, variant, data = data_hash(df))
+    except FileNotFoundError:
+        print(f"No registered {variant} fit of {experiment}, skipping it")
+        continue
+    with stage("loo", variant = variant) as record:
+        results[variant] = streaming_loo_waic(path, chunk_size = chunk_size)
+        record["rows"] = results[variant]["observations"]
+
+# %% comparison tables
+
+loo_table = compare_fits(results, criterion = "loo")
+waic_table = compare_fits(results, criterion = "waic")
+print(loo_table)
+print(waic_table)
+
+loo_table.to_csv(f"output/model_comparison_loo_{experiment}.csv")
+waic_table.to_csv(f"output/model_comparison_waic_{experiment}.csv")
+
+# %% tasks the importance sampling is unreliable for
+
+pareto_k = pd.DataFrame({variant: result["pareto_k"] for variant, result in results.items()})
+pareto_k[(pareto_k > 0.7).any(axis = 1)]
+
+write_run_report()
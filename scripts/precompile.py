@@ -0,0 +1,29 @@
+import pandas as pd
+from functions.compile_assist import (use_compile_cache, precompile_designs,
+                                      startup_report, compile_cache_dir, pytensor_flags)
+from functions.benchmark_assist import save_benchmark
+
+# %% settings
+
+experiments = ["pv", "heat"]
+variants = ["hierarchical", "centered", "pooled"]
+
+# %% warm the persistent cache
+
+# the fits of all scripts, subgroups and pipeline workers then load the 
+# compiled logp and gradient from output/pytensor_cache instead of compiling
+use_compile_cache(compile_cache_dir, **pytensor_flags)
+warmed = pd.DataFrame(precompile_designs(experiments, variants, weighted = [False, True]))
+print(warmed)
+
+# %% cold and warm startup
+
+# each startup in a fresh process, with an empty and with the persistent cache
+results = []
+for experiment in experiments:
+    results.extend(startup_report(experiment, path = compile_cache_dir, **pytensor_flags))
+
+startup = pd.DataFrame(results)
+print(startup[["experiment", "variant", "cache", "import_s", "build_s", "compile_s", "total_s"]])
+
+save_benchmark(results, 'compile_startup', cache_dir = compile_cache_dir, flags = pytensor_flags)
@@ -0,0 +1,50 @@
+import arviz as az
+from functions.model_assist import prepare_model_data, build_model
+from functions.design_assist import encoder_from_inference_data
+from functions.conjoint_assist import read_conjoint
+from functions.sensitivity_assist import power_scale_sensitivity, sensitivity_summary
+from functions.instrument_assist import start_run, stage, write_run_report
+from functions.registry_assist import lookup_fit
+
+# %% settings
+
+experiment = "pv"
+variant = "hierarchical"
+weighted = False
+
+# priors scaled to p^alpha one at a time, alpha < 1 widens and > 1 sharpens
+alphas = [0.8, 1.25]
+components = ["beta_mean", "canton_sigma"]
+
+# record time and memory per stage to output/reports
+start_run("prior_sensitivity", experiment = experiment)
+
+# %% registered fit and its model
+
+df = read_conjoint(f"data/{experiment}-conjoint.csv")
+path = lookup_fit(experiment, variant, weighted = weighted)
+inference_data = az.from_netcdf(path)
+
+# encode with the fit's encoder, so the model matches the posterior
+with stage("build_model"):
+    df, dummies, encoder = prepare_model_data(df, experiment, encoder_from_inference_data(inference_data))
+    bayes_model = build_model(df, dummies, variant = variant, weighted = weighted)
+
+# %% power-scaling sensitivity
+
+# importance reweighting of the existing draws, no refit
+with stage("power_scaling") as record:
+    sensitivity = power_scale_sensitivity(bayes_model, inference_data, 
+                                          alphas = alphas, components = components)
+    summary = sensitivity_summary(sensitivity)
+    record["rows"] = len(sensitivity)
+
+sensitivity.to_csv(f"output/prior_sensitivity_{experiment}.csv", index = False)
+summary.to_csv(f"output/prior_sensitivity_summary_{experiment}.csv", index = False)
+
+# %% prior sensitive estimates, and perturbations that need a refit
+
+summary[summary["sensitive"]]
+summary[summary["refit"]]
+
+write_run_report()
@@ -0,0 +1,80 @@
+"""
+Run the pipeline from the Qualtrics export to the cantonal plots.
+
+Stages: ingest -> clean -> prep per experiment -> fit per experiment ->
+summarize -> plot. The experiments run as independent branches, in parallel
+if --jobs allows it. Stages whose outputs are newer than their inputs and
+that ran with the same settings are skipped unless --force is given.
+
+Run from the repository root, e.g.
+python -m scripts.run_pipeline --experiment pv heat --jobs 2
+python -m scripts.run_pipeline --experiment heat --until prep --dry-run
+"""
+import argparse
+from functions.compile_assist import use_compile_cache, pytensor_flags
+
+# persistent compilation cache shared by the fit workers, set before pymc is imported
+use_compile_cache(**pytensor_flags)
+
+from functions.pipeline_assist import (pipeline_tasks, select_tasks, is_up_to_date,
+                                       run_pipeline, stage_order,
+                                       default_sampler_settings)
+from functions.model_assist import model_variants
+from functions.instrument_assist import start_run, write_run_report
+from functions.resource_assist import core_layout, log_layout
+
+
+parser = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--experiment", nargs="+", choices=["pv", "heat"], default=["pv", "heat"],
+                    help="experiments to run")
+parser.add_argument("--until", choices=stage_order, default=stage_order[-1],
+                    help="last stage to run")
+parser.add_argument("--jobs", type=int, default=2,
+                    help="number of stages run at the same time")
+parser.add_argument("--force", action="store_true",
+                    help="rerun stages even if their outputs are up to date")
+parser.add_argument("--dry-run", action="store_true",
+                    help="only list the stages and whether they are up to date")
+parser.add_argument("--raw", default="raw_data/raw_conjoint_120624.csv",
+                    help="path of the Qualtrics export")
+parser.add_argument("--variant", choices=model_variants, default="hierarchical")
+parser.add_argument("--weighted", action="store_true",
+                    help="weight the likelihood by the respondents' raking weights")
+parser.add_argument("--draws", type=int, default=default_sampler_settings["draws"])
+parser.add_argument("--tune", type=int, default=default_sampler_settings["tune"])
+parser.add_argument("--chains", type=int, default=default_sampler_settings["chains"])
+parser.add_argument("--adaptive", action="store_true",
+                    help="sample blocks of --draws until R-hat, ESS and divergence targets are met")
+parser.add_argument("--time-budget", type=float, default=None,
+                    help="hours after which adaptive sampling starts no further block")
+args = parser.parse_args()
+
+# share the CPUs between the parallel stages, their chains and BLAS threads
+layout = core_layout(chains=args.chains, jobs=args.jobs)
+sampler_settings = {**default_sampler_settings,
+                    "draws": args.draws, "tune": args.tune, "chains": args.chains,
+                    "cores": layout["cores"]}
+
+tasks = pipeline_tasks(args.experiment,
+                       raw_path=args.raw,
+                       variant=args.variant,
+                       sampler_settings=sampler_settings,
+                       weighted=args.weighted,
+                       adaptive=None if not args.adaptive else
+                       {"time_budget_s": None if args.time_budget is None else args.time_budget * 3600})
+tasks = select_tasks(tasks, args.until)
+
+if args.dry_run:
+    for name, task in tasks.items():
+        print(f"{name}: {'up to date' if is_up_to_date(name, task) else 'to run'}")
+else:
+    report = start_run("pipeline", experiments=args.experiment, jobs=layout["jobs"])
+    log_layout(layout, report)
+    status = run_pipeline(tasks, jobs=layout["jobs"], force=args.force, report=report,
+                          blas_threads=layout["blas_threads"])
+    report["status"] = status
+    write_run_report(report)
+    failed = [name for name, state in status.items() if state in ("failed", "blocked")]
+    if failed:
+        raise SystemExit(f"Failed or blocked stages: {failed}")
@@ -0,0 +1,88 @@
+import os
+import pandas as pd
+import pytest
+from functions.synthetic_assist import write_qualtrics_export
+from functions.survey_assist import (read_export, clean_export, flag_respondents,
+                                     drop_flagged, recode_demographics, weight_respondents,
+                                     translate_conjoints, respondent_columns,
+                                     heat_regex, heat_filemarker, pv_regex, pv_filemarker)
+from functions.conjoint_assist import prep_conjoint, prep_conjoint_lazy, respondent_table
+
+
+@pytest.fixture(scope="module")
+def export(tmp_path_factory):
+    """
+    Synthetic Qualtrics export and its respondents, cleaned with pandas.
+    """
+    directory = tmp_path_factory.mktemp("export")
+    path = str(directory / "raw.csv")
+    write_qualtrics_export(path, 300)
+    df = read_export(path)
+    df = drop_flagged(flag_respondents(clean_export(df)))
+    df = translate_conjoints(weight_respondents(recode_demographics(df)))
+    respondents = respondent_table(df[respondent_columns])
+    respondents.to_csv(directory / "respondents.csv", index=False)
+    df[respondent_columns].to_csv(directory / "respondents_wide.csv", index=False)
+    return directory, path, df, respondents
+
+
+@pytest.mark.parametrize("layout", ["star", "wide"])
+@pytest.mark.parametrize("regex_list, filemarker", [(heat_regex, heat_filemarker),
+                                                    (pv_regex, pv_filemarker)])
+@pytest.mark.parametrize("calculate_ratings", [True, False])
+def test_lazy_matches_pandas(export, layout, regex_list, filemarker, calculate_ratings):
+    pytest.importorskip("duckdb")
+    directory, path, df, respondents = export
+    if layout == "star":
+        respondents_path = directory / "respondents.csv"
+    else:
+        respondents, respondents_path = df[respondent_columns], directory / "respondents_wide.csv"
+    pandas_dir = directory / f"pandas-{layout}"
+    lazy_dir = directory / f"duckdb-{layout}"
+    pandas_dir.mkdir(exist_ok=True)
+    lazy_dir.mkdir(exist_ok=True)
+
+    prep_conjoint(df, respondent_columns=respondents, regex_list=regex_list, filemarker=filemarker,
+                  calculate_ratings=calculate_ratings, output_dir=str(pandas_dir), layout=layout)
+    lazy_path = prep_conjoint_lazy(path, str(respondents_path), regex_list=regex_list,
+                                   filemarker=filemarker, calculate_ratings=calculate_ratings,
+                                   output_dir=str(lazy_dir), layout=layout, memory_limit="200MB")
+
+    expected = pd.read_csv(pandas_dir / lazy_dir.joinpath(lazy_path).name)
+    stacked = pd.read_csv(lazy_path)
+    assert list(stacked.columns) == list(expected.columns)
+    # years are written as 2030.0 by pandas and 2030 by duckdb, so values
+    # are compared rather than dtypes
+    pd.testing.assert_frame_equal(stacked, expected, check_dtype=False)
+
+
+def test_lazy_ids_over_chunks(tmp_path):
+    # several CSV chunks read by several threads, the IDs must still be the
+    # row numbers of the export
+    pytest.importorskip("duckdb")
+    path = str(tmp_path / "raw.csv")
+    write_qualtrics_export(path, 5000)
+    df = read_export(path)
+    df = drop_flagged(flag_respondents(clean_export(df)))
+    df = translate_conjoints(weight_respondents(recode_demographics(df)))
+    respondents = respondent_table(df[respondent_columns])
+    respondents.to_csv(tmp_path / "respondents.csv", index=False)
+
+    prep_conjoint(df, respondent_columns=respondents, regex_list=heat_regex, filemarker=heat_filemarker,
+                  calculate_ratings=True, output_dir=str(tmp_path), layout="star")
+    expected = pd.read_csv(tmp_path / f"{heat_filemarker}-conjoint.csv")
+    lazy_dir = tmp_path / "duckdb"
+    lazy_dir.mkdir()
+    lazy_path = prep_conjoint_lazy(path, str(tmp_path / "respondents.csv"), regex_list=heat_regex,
+                                   filemarker=heat_filemarker, calculate_ratings=True,
+                                   output_dir=str(lazy_dir), layout="star", threads=4)
+    pd.testing.assert_frame_equal(pd.read_csv(lazy_path), expected, check_dtype=False)
+
+
+def test_lazy_removes_staging_database(export, tmp_path):
+    duckdb = pytest.importorskip("duckdb")
+    directory, path, df, respondents = export
+    with pytest.raises(duckdb.Error):
+        prep_conjoint_lazy(path, str(tmp_path / "missing.csv"), regex_list=heat_regex,
+                           filemarker=heat_filemarker, output_dir=str(tmp_path))
+    assert os.listdir(tmp_path / ".duckdb_tmp") == []
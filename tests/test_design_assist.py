@@ -0,0 +1,66 @@
+import arviz as az
+import numpy as np
+import pandas as pd
+import pytest
+from functions.design_assist import (fit_encoder, encode_design, encode_cantons, save_encoder,
+                                     load_encoder, attach_encoder, encoder_from_inference_data)
+
+
+attributes = ["year", "tax"]
+baselines = ["year:2050", "tax:0%"]
+
+
+def choices(n=40, seed=5):
+    """
+    Stacked choices with years read back from csv as floats.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"year": rng.choice([2030.0, 2040.0, 2050.0], size=n),
+                         "tax": rng.choice(["0%", "50%", "100%"], size=n),
+                         "canton": rng.choice(["Zürich", "Genève", "Bern"], size=n)})
+
+
+def test_baseline_first():
+    encoder = fit_encoder(attributes, baselines, df=choices())
+    assert encoder["levels"]["year"][0] == "2050"
+    assert encoder["levels"]["tax"][0] == "0%"
+    assert encoder["cantons"] == ["Bern", "Genève", "Zürich"]
+    assert encoder["columns"][encoder["offsets"]["tax"]] == "tax_0%"
+
+
+def test_encoder_round_trip(tmp_path):
+    df = choices()
+    encoder = fit_encoder(attributes, baselines, df=df)
+    design = encode_design(encoder, df, format="dense")
+
+    path = tmp_path / "encoder.json"
+    save_encoder(encoder, path)
+    inference_data = attach_encoder(az.from_dict(posterior={"beta": np.zeros((1, 2, 3))}), encoder)
+    inference_data.to_netcdf(tmp_path / "fit.nc")
+    stored = encoder_from_inference_data(az.from_netcdf(tmp_path / "fit.nc"))
+
+    for restored in (load_encoder(path), stored):
+        assert restored == encoder
+        # new data in another order is coded into the same columns, years
+        # as strings or floats alike
+        shuffled = df.sample(frac=1, random_state=1).assign(year=lambda d: d["year"].astype(int).astype(str))
+        pd.testing.assert_frame_equal(encode_design(restored, shuffled, format="dense"),
+                                      design.loc[shuffled.index])
+        np.testing.assert_array_equal(encode_cantons(restored, df), encode_cantons(encoder, df))
+
+
+def test_formats_agree():
+    df = choices()
+    encoder = fit_encoder(attributes, baselines, df=df)
+    index = encode_design(encoder, df, format="index")
+    csr = encode_design(encoder, df, format="csr")
+    dense = encode_design(encoder, df, format="dense")
+    np.testing.assert_array_equal(csr.toarray().astype(bool), dense.to_numpy())
+    np.testing.assert_array_equal(np.sort(csr.indices.reshape(len(df), -1), axis=1), np.sort(index, axis=1))
+
+
+def test_unknown_level():
+    df = choices()
+    encoder = fit_encoder(attributes, baselines, df=df)
+    with pytest.raises(ValueError, match="Unknown levels of tax"):
+        encode_design(encoder, df.assign(tax="25%"))
@@ -0,0 +1,66 @@
+import numpy as np
+import arviz as az
+import xarray as xr
+import pytest
+from functions.loo_assist import task_loglik, psis_smooth, relative_efficiency, streaming_loo_waic
+
+
+def simulated_fit(chains=4, draws=300, cantons=5, levels=4, tasks=120, rho=0.6, seed=1):
+    """
+    Autocorrelated posterior draws of beta and choice tasks, with the
+    pointwise log-likelihood az.loo needs.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(size=(chains, draws, cantons, levels))
+    beta = np.empty_like(noise)
+    beta[:, 0] = noise[:, 0]
+    for draw in range(1, draws):
+        beta[:, draw] = rho * beta[:, draw - 1] + np.sqrt(1 - rho ** 2) * noise[:, draw]
+    beta = 0.3 * beta + rng.normal(size=(cantons, levels))
+
+    canton = rng.integers(cantons, size=tasks)
+    design = rng.integers(-1, 2, size=(tasks, levels)).astype(float)
+    observed = rng.integers(2, size=tasks)
+    ll = task_loglik(beta.reshape(-1, cantons, levels), canton, design, observed)
+
+    coords = {"chain": np.arange(chains), "draw": np.arange(draws)}
+    return az.InferenceData(
+        posterior=xr.Dataset({"beta": (("chain", "draw", "canton", "level"), beta)}, coords=coords),
+        log_likelihood=xr.Dataset({"y": (("chain", "draw", "task"), ll.reshape(chains, draws, tasks))},
+                                  coords=coords),
+        constant_data=xr.Dataset({"c": ("task", canton),
+                                  "observed_choice_left": ("task", observed),
+                                  "attribute_levels_difference": (("task", "level"), design)}))
+
+
+def test_psis_smooth_matches_arviz():
+    rng = np.random.default_rng(0)
+    log_weights = rng.standard_t(3, size=(20, 1000))
+    for reff in [1.0, 0.4]:
+        smoothed, pareto_k = psis_smooth(log_weights, reff=reff)
+        expected, expected_k = az.psislw(log_weights, reff=reff)
+        np.testing.assert_allclose(smoothed, expected, atol=1e-10)
+        np.testing.assert_allclose(pareto_k, expected_k, atol=1e-10)
+
+
+def test_relative_efficiency_matches_arviz():
+    fit = simulated_fit()
+    ess = az.ess(fit.posterior, method="mean")["beta"].values.mean()
+    assert relative_efficiency(fit.posterior) == pytest.approx(ess / (4 * 300))
+    assert relative_efficiency(fit.posterior) < 0.8
+
+
+@pytest.mark.parametrize("chunk_size", [50, 300])
+def test_streaming_loo_waic_matches_arviz(chunk_size):
+    fit = simulated_fit()
+    result = streaming_loo_waic(fit, chunk_size=chunk_size, obs_chunk_size=32)
+    loo = az.loo(fit, pointwise=True)
+    assert result["elpd_loo"] == pytest.approx(loo["elpd_loo"], abs=1e-8)
+    assert result["se_loo"] == pytest.approx(loo["se"], abs=1e-8)
+    assert result["p_loo"] == pytest.approx(loo["p_loo"], abs=1e-8)
+    np.testing.assert_allclose(result["pareto_k"], loo["pareto_k"].values, atol=1e-8)
+    np.testing.assert_allclose(result["loo_i"], loo["loo_i"].values, atol=1e-8)
+
+    waic = az.waic(fit, pointwise=True)
+    assert result["elpd_waic"] == pytest.approx(waic["elpd_waic"], abs=1e-8)
+    assert result["p_waic"] == pytest.approx(waic["p_waic"], abs=1e-8)
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.special import gammaln
+from functions.model_assist import (encode_dummies, choice_arrays, collapse_choice_sets,
+                                    compression_report, build_model)
+
+
+attributes = ["year", "tax"]
+baselines = ["year:2050", "tax:0%"]
+
+
+def stacked(tasks=300, seed=7):
+    """
+    Stacked choices with few levels, so choice sets repeat within cantons.
+    """
+    rng = np.random.default_rng(seed)
+    levels = {"year": [2030, 2050], "tax": ["0%", "100%"]}
+    left = rng.integers(2, size=tasks)
+    packages = {pack: pd.DataFrame({attr: rng.choice(values, size=tasks) for attr, values in levels.items()})
+                for pack in ["Left", "Right"]}
+    canton = rng.choice(["Bern", "Genève", "Zürich"], size=tasks)
+    weight = rng.uniform(0.5, 2, size=tasks)
+    df = pd.concat([packages[pack].assign(pack_num_cat=pack, canton=canton, weight=weight,
+                                          Y=left if pack == "Left" else 1 - left,
+                                          task=np.arange(tasks))
+                    for pack in ["Left", "Right"]]).sort_values(["task", "pack_num_cat"], kind="stable")
+    df, dummies, _ = encode_dummies(df.reset_index(drop=True), attributes, baselines)
+    return df, dummies
+
+
+def binomial_constant(data):
+    """
+    Sum of the log binomial coefficients of the collapsed choice sets.
+    """
+    n, k = data["trials"], data["observed_choice_left"]
+    return float((gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)).sum())
+
+
+def test_collapse_keeps_tasks():
+    df, dummies = stacked()
+    data = choice_arrays(df, dummies)
+    collapsed = collapse_choice_sets(data)
+    report = compression_report(collapsed)
+    assert report["tasks"] == len(data["c"])
+    assert report["choice_sets"] < report["tasks"]
+    assert collapsed["observed_choice_left"].sum() == data["observed_choice_left"].sum()
+    assert collapsed["weight"].sum() == pytest.approx(data["weight"].sum())
+
+
+@pytest.mark.parametrize("formulation", ["dense", "difference", "gather"])
+@pytest.mark.parametrize("variant", ["hierarchical", "pooled"])
+@pytest.mark.parametrize("weighted", [False, True])
+def test_collapsed_logp(formulation, variant, weighted):
+    df, dummies = stacked()
+    models = {collapsed: build_model(df, dummies, variant=variant, weighted=weighted,
+                                     collapsed=collapsed, formulation=formulation)
+              for collapsed in [False, True]}
+    # the Binomial likelihood adds the binomial coefficients, the weighted
+    # pseudo-likelihood has none
+    constant = 0.0 if weighted else binomial_constant(
+        collapse_choice_sets(choice_arrays(df, dummies, formulation)))
+
+    rng = np.random.default_rng(0)
+    point = models[False].initial_point()
+    logps = {collapsed: model.compile_logp() for collapsed, model in models.items()}
+    for _ in range(3):
+        point = {name: rng.normal(size=np.shape(value)) for name, value in point.items()}
+        assert logps[True](point) == pytest.approx(logps[False](point) + constant, rel=1e-9)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from functions.quality_assist import grid_block, grid_metrics, quality_flags
+from functions.survey_assist import rating_values, just_columns
+
+
+def answers(n=2000, seed=11):
+    """
+    Justice grids with straightliners, "don't know" and "Weiss nicht"
+    answers off the scale and empty cells.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.array(rating_values + ["don't know", "Weiss nicht"], dtype=object)
+    grid = labels[rng.integers(len(labels), size=(n, len(just_columns)))]
+    straight = rng.random(n) < 0.4
+    grid[straight] = labels[rng.integers(len(labels), size=straight.sum())][:, None]
+    # off-scale answers and empty cells among otherwise identical answers
+    grid[straight & (rng.random(n) < 0.5), rng.integers(len(just_columns))] = "don't know"
+    grid[rng.random(grid.shape) < 0.05] = None
+    df = pd.DataFrame(grid, columns=just_columns)
+    df["duration_min"] = rng.uniform(5, 30, size=n)
+    return df
+
+
+def test_straightlining_matches_nunique():
+    df = answers()
+    flags = quality_flags(df, just_columns, [], rating_values)
+    # previous rule of flag_respondents, missing answers are ignored
+    expected = df[just_columns].nunique(axis=1) == 1
+    np.testing.assert_array_equal(flags["justice_straightlining"].to_numpy(), expected.to_numpy())
+    np.testing.assert_array_equal(flags["inattentive"].to_numpy(), expected.to_numpy())
+
+
+def test_off_scale_answers():
+    df = pd.DataFrame([["Dafür", "don't know", "Dafür", "Dafür"],
+                       ["Weiss nicht", "don't know", "don't know", "don't know"],
+                       ["don't know", "don't know", None, "don't know"]])
+    block = grid_block(df, list(df.columns), rating_values)
+    metrics = grid_metrics(block)
+    np.testing.assert_array_equal(metrics["answered"], [4, 4, 3])
+    np.testing.assert_array_equal(metrics["straightlining"], [False, False, True])
+    np.testing.assert_array_equal(metrics["longest_run"], [2, 3, 2])
+    # the variance only covers the answers on the scale
+    np.testing.assert_array_equal(metrics["variance"], [0.0, np.nan, np.nan])
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+from functions.weighting_assist import rake_weights, trim_weights
+
+
+def sample(n=900, seed=3):
+    """
+    Respondents of three cantons, skewed towards women and the young.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "canton": rng.choice(["Bern", "Genève", "Zürich"], size=n),
+        "gender": rng.choice(["female", "male"], size=n, p=[0.65, 0.35]),
+        "age": rng.choice(["18-39", "40-64", "65+"], size=n, p=[0.5, 0.35, 0.15]),
+    })
+
+
+margins = {
+    "gender": pd.Series([0.5, 0.5], index=["female", "male"]),
+    "age": pd.DataFrame([[0.35, 0.4, 0.25], [0.4, 0.4, 0.2], [0.3, 0.45, 0.25]],
+                        index=["Bern", "Genève", "Zürich"], columns=["18-39", "40-64", "65+"]),
+}
+
+
+def reference_raking(df, margins, iterations=500):
+    """
+    Iterative proportional fitting canton by canton, with pandas.
+    """
+    weights = pd.Series(1.0, index=df.index)
+    for canton, rows in df.groupby("canton"):
+        w = pd.Series(1.0, index=rows.index)
+        for _ in range(iterations):
+            for variable, shares in margins.items():
+                target = shares if isinstance(shares, pd.Series) else shares.loc[canton]
+                current = w.groupby(rows[variable]).sum() / w.sum()
+                w *= (target / current).reindex(rows[variable]).to_numpy()
+        weights[rows.index] = w / w.mean()
+    return weights
+
+
+def test_raking_matches_reference():
+    df = sample()
+    weights, diagnostics = rake_weights(df, margins, trim=None, tol=1e-12, max_iter=500)
+    assert diagnostics["converged"]
+    np.testing.assert_allclose(weights, reference_raking(df, margins), rtol=1e-8)
+    for canton, rows in df.groupby("canton"):
+        w = weights[rows.index]
+        assert w.mean() == pytest.approx(1)
+        shares = w.groupby(rows["age"]).sum() / w.sum()
+        np.testing.assert_allclose(shares, margins["age"].loc[canton], atol=1e-10)
+
+
+@pytest.mark.parametrize("population", [None, {"Bern": 1e6, "Genève": 5e5, "Zürich": 1.5e6}])
+def test_trimmed_weights_stay_within_bounds(population):
+    df = sample()
+    trim = (0.7, 1.4)
+    weights, diagnostics = rake_weights(df, margins, trim=trim, population=population)
+    mean = weights.groupby(df["canton"]).transform("mean")
+    relative = weights / mean
+    assert relative.min() >= trim[0] - 1e-9 and relative.max() <= trim[1] + 1e-9
+    assert diagnostics["weight_range"] == pytest.approx((relative.min(), relative.max()))
+    if population is None:
+        np.testing.assert_allclose(mean, 1)
+    else:
+        totals = weights.groupby(df["canton"]).sum()
+        expected = pd.Series(population) / sum(population.values()) * len(df)
+        np.testing.assert_allclose(totals, expected[totals.index])
+
+
+def test_trim_weights():
+    rng = np.random.default_rng(0)
+    groups = rng.integers(4, size=2000)
+    weights = trim_weights(rng.lognormal(sigma=1.2, size=2000), groups, (0.2, 5.0))
+    np.testing.assert_allclose(np.bincount(groups, weights=weights) / np.bincount(groups), 1)
+    assert weights.min() >= 0.2 - 1e-9 and weights.max() <= 5.0 + 1e-9